@@ -1,28 +1,38 @@
 import hashlib
 import json
 import logging
+import mmap
 import os.path
-import re
 import shutil
 import subprocess
-import tempfile
 import traceback
 import zipfile
 from asyncore import write
 
-from jinja2 import Environment, FileSystemLoader
 from ConfigManager import ConfigManager
+from apex_name_resolver import resolve_emulator_apex_folder, resolve_apex_source_key
+from apex_cache import get_apex_cache_key, restore_apex_from_cache, store_apex_in_cache
+from emulator_apex_cache import clone_emulator_apex_tree
+from apex_manifest_converter import get_cleaned_manifest_json, convert_manifest_in_process, get_converter_version, \
+    get_memoized_manifest_path, store_memoized_manifest
+from apex_workspace import scoped_apex_workspace, workspace_mkdtemp, workspace_temp_file_path, workspace_checkpoint
 from aosp_post_build_app_injector import get_signing_key_path, sign_apk_file, verify_apk_file, \
-    sign_apex_container_apksigner, sign_apex_container_signapk
-from common import extract_vendor_name, remove_vendor_name_from_filename, check_shared_object_architecture, \
-    get_path_up_to_first_term
+    sign_apex_container_apksigner, sign_apex_container_signapk, get_signing_key_from_shared_user_id
+from apk_manifest import read_apk_manifest
+from common import extract_vendor_name, remove_vendor_name_from_filename, \
+    get_path_up_to_first_term, get_aosp_out_path
 #from conv_apex_manifest import convert_manifest_from_json
 from parse_lddtree_to_json import run_lddtree
+from partition_index import build_partition_index, find_library, get_lib64_libraries
+from pipeline_trace import trace_span
 from shell_command import execute_shell_command
+from template_renderer import render_template_file, write_file_if_changed
 from config_post_injector import *
 
 POST_INJECTOR_CONFIG = {}
 
+@trace_span("apex.merge_module", category="apex")
+@scoped_apex_workspace("file_path")
 def handle_apex_modules(file_path, aosp_path, lunch_target, target_out_path, aosp_version):
     """
     Merges two APEX files into one. Overwrites the vendor's APEX for later injection.
@@ -34,13 +44,32 @@ def handle_apex_modules(file_path, aosp_path, lunch_target, target_out_path, aos
     logging.info(f"Handling APEX merge modules: {file_path} | {aosp_path} | {lunch_target} | {target_out_path}")
     is_merge_success = False
     log_message = ""
+    apex_emulator_folder = find_emulator_apex_folder(target_out_path, file_path)
+    if not apex_emulator_folder:
+        log_message = f"Error merging APEX file: {file_path}. No emulator folder found in: {target_out_path}"
+        logging.error(log_message)
+        return is_merge_success, log_message
     apex_out_file, org_apex_file = backup_original_apex_file(file_path)
 
     try:
-        apex_emulator_folder = find_emulator_apex_folder(target_out_path, file_path)
-        if apex_emulator_folder and os.path.exists(apex_emulator_folder):
+        if os.path.exists(apex_emulator_folder):
             logging.info(f"Emulator APEX folder found for: {file_path} and {apex_emulator_folder}")
-            is_merge_success, log_message = merge_apex_files(apex_emulator_folder, file_path, apex_out_file, lunch_target, aosp_path, target_out_path, aosp_version)
+            cache_key = get_apex_cache_key("merge", file_path, apex_emulator_folder, POST_INJECTOR_CONFIG, aosp_version, lunch_target)
+            is_cache_hit, key_artefacts = restore_apex_from_cache(cache_key, apex_out_file)
+            if is_cache_hit:
+                is_merge_success, log_message = True, f"APEX restored from cache: {cache_key}"
+                if POST_INJECTOR_CONFIG["REPLACE_AVB_KEYS"] and "avb_pub_key" in key_artefacts:
+                    is_merge_success, log_message = inject_apex_avb_public_key(file_path,
+                                                                               key_artefacts["avb_pub_key"],
+                                                                               target_out_path)
+            else:
+                is_merge_success, log_message = merge_apex_files(apex_emulator_folder, file_path, apex_out_file, lunch_target, aosp_path, target_out_path, aosp_version)
+                # Only the signed output of a successful merge is cached, merge_apex_files fails if signing fails
+                if is_merge_success and os.path.exists(apex_out_file):
+                    private_key_path, priv_pem_file_path, avb_pub_key_path, cert_apex_apk_path = \
+                        get_apex_default_keys(aosp_path, os.path.basename(apex_out_file))
+                    store_apex_in_cache(cache_key, apex_out_file,
+                                        [avb_pub_key_path, priv_pem_file_path, private_key_path, cert_apex_apk_path])
             if os.path.exists(apex_out_file):
                 try:
                     replace_org_apex_file(file_path, apex_out_file)
@@ -100,30 +129,72 @@ def rename_file(file_path, new_name):
         raise
 
 
+def get_predecompressed_capex_path(file_path):
+    """
+    Returns the path where the original_apex of a capex file is stored by predecompress_capex. The name depends on
+    the capex path, size and modification time, so stale results of earlier runs are never reused.
+
+    :param file_path: str - path to the capex file.
+    :return: str - path to the predecompressed apex file.
+    """
+    file_stat = os.stat(file_path)
+    name_hash = hashlib.md5(f"{file_path}|{file_stat.st_size}|{file_stat.st_mtime_ns}".encode()).hexdigest()
+    return os.path.join(CAPEX_PREDECOMPRESS_DIR, f"{name_hash}.apex")
+
+
+@trace_span("apex.predecompress_capex", category="apex")
+def predecompress_capex(file_path):
+    """
+    Decompresses the original_apex of a capex file into CAPEX_PREDECOMPRESS_DIR ahead of the injection pass.
+
+    :param file_path: str - path to the capex file.
+    :return: str - path to the predecompressed apex file or None on error.
+    """
+    out_file = get_predecompressed_capex_path(file_path)
+    if os.path.exists(out_file):
+        return out_file
+    os.makedirs(CAPEX_PREDECOMPRESS_DIR, exist_ok=True)
+    return prepare_capex(file_path, CAPEX_PREDECOMPRESS_DIR, os.path.basename(out_file))
+
+
+@trace_span("apex.prepare_capex", category="apex")
 def prepare_capex(file_path, output_dir, output_filename):
     """
-    Unzips the capex file into a temporary directory, then copies the apex file to the output directory.
+    Decompresses the original_apex member of the capex file straight into the output directory. If the capex was
+    already decompressed by predecompress_capex, the result is moved into place instead.
     """
+    out_file = str(os.path.join(output_dir, output_filename))
+    try:
+        predecompressed_file = get_predecompressed_capex_path(file_path)
+        if os.path.dirname(predecompressed_file) != os.path.abspath(output_dir) and os.path.exists(predecompressed_file):
+            shutil.move(predecompressed_file, out_file)
+            logging.info(f"APEX file taken from predecompressed capex: {predecompressed_file} -> {out_file}")
+            return out_file
+    except OSError as e:
+        logging.warning(f"Predecompressed capex not usable for {file_path}: {e}")
+
     logging.info(f"Unzipping capex file: {file_path}")
+    tmp_out_file = f"{out_file}.fmd-capex-tmp"
     try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            apex_file = os.path.join(temp_dir, "original_apex")
-            if os.path.exists(apex_file):
-                logging.info(f"APEX file extracted: {apex_file}")
-                out_file = str(os.path.join(output_dir, output_filename))
-                shutil.copy(apex_file, out_file)
-                return out_file
-            else:
-                logging.error(f"APEX file not found in capex: {file_path}")
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with zip_ref.open("original_apex") as apex_member, open(tmp_out_file, "wb") as apex_file:
+                shutil.copyfileobj(apex_member, apex_file, 1024 * 1024)
+        os.replace(tmp_out_file, out_file)
+        logging.info(f"APEX file extracted: {out_file}")
+        return out_file
+    except KeyError:
+        logging.error(f"APEX file not found in capex: {file_path}")
     except zipfile.BadZipFile as e:
         logging.error(f"Error unzipping capex file {file_path}: {e}")
     except Exception as e:
         logging.error(f"Unexpected error while preparing capex: {e}")
+    if os.path.exists(tmp_out_file):
+        os.remove(tmp_out_file)
     return None
 
 
+@trace_span("apex.repackage", category="apex")
+@scoped_apex_workspace("apex_file_path")
 def repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version):
     """
     Extracts the APEX file using deapexer, repackages it using apexer, and signs all the APK files in the APEX using apksigner.
@@ -144,13 +215,17 @@ def repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version):
 
     apex_out_file, org_apex_file = backup_original_apex_file(apex_file_path)
     try:
-        apex_root_path = tempfile.mkdtemp(suffix=f"_{filename}_apex_repack")
-        apex_extract_dir_path = tempfile.mkdtemp(dir=apex_root_path, suffix=f"_{filename}_extract")
+        cache_key = get_apex_cache_key("repack", apex_file_path, None, POST_INJECTOR_CONFIG, aosp_version, lunch_target)
+        is_cache_hit, key_artefacts = restore_apex_from_cache(cache_key, apex_out_file)
+        if is_cache_hit:
+            replace_org_apex_file(apex_file_path, apex_out_file)
+            return True, f"APEX restored from cache: {cache_key}"
+        apex_root_path = workspace_mkdtemp(suffix=f"_{filename}_apex_repack")
+        apex_extract_dir_path = workspace_mkdtemp(dir=apex_root_path, suffix=f"_{filename}_extract")
         extract_success, log_message = extract_apex_file(aosp_path, apex_file_path, apex_extract_dir_path, lunch_target, aosp_version)
         if extract_success:
             logging.info(f"APEX extracted: {apex_file_path} to {apex_extract_dir_path}")
-            with tempfile.NamedTemporaryFile(delete=False, dir=apex_root_path) as canned_fs_config:
-                generate_canned_fs_config(apex_extract_dir_path, canned_fs_config.name, allow_filtering=False)
+            canned_fs_config = generate_canned_fs_config(apex_extract_dir_path, workspace_temp_file_path(dir=apex_root_path), allow_filtering=False)
             logging.info(f"Canned FS config file: {canned_fs_config.name}")
             apex_file_name = str(os.path.basename(apex_file_path))
             is_manifest_found, apex_manifest_path = move_apex_manifest_file(apex_extract_dir_path, apex_root_path, apex_file_name, aosp_path, lunch_target)
@@ -169,6 +244,9 @@ def repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version):
                         file_contexts_path=None,
                         aosp_version=aosp_version
                     )
+                if is_success:
+                    store_apex_in_cache(cache_key, apex_file_path,
+                                        [avb_pub_key_path, priv_pem_file_path, private_key_path, cert_apex_apk_path])
             else:
                 log_message = f"APEX manifest file not found after extraction: {apex_extract_dir_path} | apex_manifest_path: {apex_manifest_path}"
         else:
@@ -178,6 +256,7 @@ def repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version):
     return is_success, log_message
 
 
+@trace_span("apex.create_and_sign_container", category="apex")
 def create_and_sign_apex_repack_container(apex_manifest_path,
                                             apex_extract_dir_path,
                                             apex_root_path,
@@ -216,29 +295,34 @@ def create_and_sign_apex_repack_container(apex_manifest_path,
         log_message = f"APEX repack creation failed. {apex_out_file} | {log_message}"
     return is_success, log_message, avb_pub_key_path, priv_pem_file_path, private_key_path, cert_apex_apk_path
 
-def find_lib64_folders(root_dir, folder_name="lib64", include_subfolders=True):
+def copy_indexed_library(lib_entry, apex_extract_dir_path, apex_file_name):
     """
-    Recursively finds all folders named 'lib64' under root_dir,
-    and adds all their subfolders to the result list as well.
+    Copies a library of the partition index into the lib64 folder of the APEX, keeping its path below lib64.
+
+    :param lib_entry: dict - entry of the partition index.
+    :param apex_extract_dir_path: str - path to the extracted APEX.
+    :param apex_file_name: str - name of the APEX file, for logging.
+    :return: tuple - (bool, str) - True if copied or already present, log message.
     """
-    lib64_paths = []
-
-    for dirpath, dirnames, _ in os.walk(root_dir):
-        if folder_name in dirnames:
-            lib64_dir = os.path.join(dirpath, folder_name)
-            if "com_android_vndk_current_apex" not in lib64_dir:
-                lib64_paths.append(lib64_dir)
-                # Add all subfolders of lib64
-                if include_subfolders:
-                    for subdir_root, subdir_names, _ in os.walk(lib64_dir):
-                        for subdir in subdir_names:
-                            subfolder_path = os.path.join(subdir_root, subdir)
-                            lib64_paths.append(subfolder_path)
-            else:
-                logging.info(f"Skipped vndk lib64 folder: {lib64_dir}")
-    return lib64_paths
+    src_lib_path = lib_entry["path"]
+    pre_path = get_path_up_to_first_term(lib_entry["dir"], "lib64")
+    post_path = str(src_lib_path.replace(pre_path, ""))
+    dst_lib_path = os.path.join(apex_extract_dir_path, "lib64", post_path)
+    if os.path.exists(dst_lib_path):
+        logging.debug(f"Library {src_lib_path} already exists in APEX {apex_file_name}, skipping copy.")
+        return True, ""
+    try:
+        os.makedirs(os.path.dirname(dst_lib_path), exist_ok=True)
+        shutil.copyfile(src_lib_path, dst_lib_path)
+        logging.info(f"Copied library {src_lib_path} to {dst_lib_path}: APEX {apex_file_name}")
+    except Exception as e:
+        logging.error(f"Error copying library {src_lib_path} to APEX {apex_file_name}: {e}")
+        return False, f"Error copying library {src_lib_path}: {e}"
+    return True, ""
 
 
+@trace_span("apex.add_new", category="apex")
+@scoped_apex_workspace("binary_file_path")
 def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name, aosp_version):
     """
     Creates a new APEX file with the given binary file path. Collects all necessary native libraries for the binary
@@ -257,8 +341,7 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
     # Copy the template APEX file to a temporary location
     template_folder_abs_path = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "apex")
     apex_template_file = os.path.join(template_folder_abs_path, "com.android.fmd.apex")
-    tempdir = tempfile.TemporaryDirectory()
-    apex_in_file = str(os.path.join(tempdir.name, apex_file_name))
+    apex_in_file = str(os.path.join(workspace_mkdtemp(suffix="_template"), apex_file_name))
     try:
         shutil.copyfile(apex_template_file, apex_in_file)
         logging.info(f"Copied APEX template file: {apex_template_file} to {apex_in_file}")
@@ -267,8 +350,8 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
         return False, f"Error copying APEX template file: {e}"
 
     # Extract the APEX file to a temporary directory
-    apex_root_path = tempfile.mkdtemp(suffix=f"_{filename}_apex_repack")
-    apex_extract_dir_path = tempfile.mkdtemp(dir=apex_root_path, suffix=f"_{filename}_extract")
+    apex_root_path = workspace_mkdtemp(suffix=f"_{filename}_apex_repack")
+    apex_extract_dir_path = workspace_mkdtemp(dir=apex_root_path, suffix=f"_{filename}_extract")
     extract_success, log_message = extract_apex_file(aosp_path, apex_in_file, apex_extract_dir_path, lunch_target, aosp_version)
     if os.path.exists(apex_in_file):
         logging.info(f"APEX file {apex_in_file} still exists after extraction. Removing it.")
@@ -297,8 +380,11 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
         logging.error(f"Partition root not found: {partition_root}. Cannot proceed with APEX creation for {apex_file_name}.")
         return False, f"Partition root not found: {partition_root}"
 
+    ## Index the partition once. All library lookups and bulk copies below are resolved from the index.
+    partition_index = build_partition_index(partition_root)
+
     ## Construct LD_LIBRARY_PATH for lddtree
-    lib64_path_list = find_lib64_folders(partition_root)
+    lib64_path_list = partition_index["lib64_folders"]
     extra_paths = []
     if lib64_path_list:
         extra_paths.extend(lib64_path_list)
@@ -348,91 +434,39 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
         if lib_name in exclude_list or any(keyword in lib_name for keyword in exclude_keyword):
             logging.info(f"Skipping excluded library {lib_name} for APEX {apex_file_name}")
             continue
-        logging.info(f"Searching for library {lib_name} in partition root: {partition_root} for APEX {apex_file_name}")
-        for root, dirs, files in os.walk(partition_root):
-            if lib_name in files:
-                src_lib_path = os.path.join(root, lib_name)
-                if "com_android_vndk_current_apex" in src_lib_path:
-                    logging.info(f"Skipping VNDK library {lib_name} in {src_lib_path} for APEX {apex_file_name}")
-                    continue
-                if any(keyword in src_lib_path for keyword in exclude_keyword):
-                    logging.info(f"Skipping excluded library {lib_name} for APEX {apex_file_name}")
-                    continue
-                if os.path.exists(src_lib_path):
-                    if check_shared_object_architecture(src_lib_path) == "64-bit":
-                        dst_lib_path = os.path.join(apex_lib64_path, lib_name)
-                        try:
-                            shutil.copyfile(src_lib_path, dst_lib_path)
-                            logging.info(f"Copied 64-bit library {lib_name} from {src_lib_path} to {dst_lib_path}: APEX {apex_file_name}")
-                            break  # Stop searching after finding the 64-bit version
-                        except Exception as e:
-                            logging.error(f"Error copying library {lib_name} from {src_lib_path} to {dst_lib_path} for {apex_file_name}: {e}")
-                            return False, f"Error copying library {lib_name}: {e}"
-                    else:
-                        logging.info(f"Found 32-bit library {lib_name} in {src_lib_path}, skipping. {apex_file_name}")
-                else:
-                    logging.error(f"Library {lib_name} not found in {partition_root}. Skipping. {apex_file_name}")
+        lib_entry = find_library(partition_index, lib_name, "64-bit", exclude_keyword)
+        if not lib_entry:
+            logging.error(f"Library {lib_name} not found in {partition_root}. Skipping. {apex_file_name}")
+            continue
+        src_lib_path = lib_entry["path"]
+        dst_lib_path = os.path.join(apex_lib64_path, lib_name)
+        try:
+            shutil.copyfile(src_lib_path, dst_lib_path)
+            logging.info(f"Copied 64-bit library {lib_name} from {src_lib_path} to {dst_lib_path}: APEX {apex_file_name}")
+        except Exception as e:
+            logging.error(f"Error copying library {lib_name} from {src_lib_path} to {dst_lib_path} for {apex_file_name}: {e}")
+            return False, f"Error copying library {lib_name}: {e}"
 
+    lib64_library_list = [lib_entry for lib_entry in get_lib64_libraries(partition_index)
+                          if os.path.basename(lib_entry["path"]) not in exclude_list]
     add_all_lib64_libraries = True
     if add_all_lib64_libraries:
-        for lib64_path in lib64_path_list:
-            if not "apex" in lib64_path:
-                for root, dirs, files in os.walk(lib64_path):
-                    for file in files:
-                        if file in exclude_list:
-                            logging.info(f"Skipping excluded library {file} for APEX {apex_file_name}")
-                            continue
-                        if file.endswith(".so"):
-                            src_lib_path = os.path.join(root, file)
-                            pre_path = get_path_up_to_first_term(root, "lib64")
-                            post_path = str(src_lib_path.replace(pre_path, ""))
-                            logging.info(f"Pre-path: {pre_path}, Post-path: {post_path} for "
-                                         f"lib64 {file} in APEX {apex_file_name}, src_lib_path: {src_lib_path}")
-                            dst_lib_path = os.path.join(apex_extract_dir_path, "lib64", post_path)
-                            if check_shared_object_architecture(src_lib_path) == "64-bit":
-                                if os.path.exists(dst_lib_path):
-                                    logging.info(
-                                        f"Library {src_lib_path} already exists in APEX {apex_file_name}, skipping copy.")
-                                    continue
-                                try:
-                                    os.makedirs(os.path.dirname(dst_lib_path), exist_ok=True)
-                                    shutil.copyfile(src_lib_path, dst_lib_path)
-                                    logging.info(f"Copied library {src_lib_path} to {dst_lib_path}: APEX {apex_file_name}")
-                                except Exception as e:
-                                    logging.error(f"Error copying library {src_lib_path} to APEX {apex_file_name}: {e}")
-                                    return False, f"Error copying library {src_lib_path}: {e}"
+        for lib_entry in lib64_library_list:
+            if not "apex" in lib_entry["dir"]:
+                is_success, log_message = copy_indexed_library(lib_entry, apex_extract_dir_path, apex_file_name)
+                if not is_success:
+                    return False, log_message
 
     add_all_apex_libraries = True
     if add_all_apex_libraries:
-        for lib64_path in lib64_path_list:
-            if not "vndk" in lib64_path: # "apex" in lib64_path and
-                if "apex" in lib64_path and ("adbd" in lib64_path or "art" in lib64_path or "runtime" in lib64_path):
-                    logging.info(f"Copying all libraries from {lib64_path} to APEX {apex_file_name}")
-                    for root, dirs, files in os.walk(lib64_path):
-                        for file in files:
-                            if file in exclude_list:
-                                logging.info(f"Skipping excluded library {file} for APEX {apex_file_name}")
-                                continue
-                            if file.endswith(".so"):
-                                src_lib_path = os.path.join(root, file)
-                                pre_path = get_path_up_to_first_term(root, "lib64")
-                                post_path = str(src_lib_path.replace(pre_path, ""))
-                                logging.info(f"Pre-path: {pre_path}, Post-path: {post_path} for "
-                                             f"lib64 {file} in APEX {apex_file_name}, src_lib_path: {src_lib_path}")
-                                dst_lib_path = os.path.join(apex_extract_dir_path, "lib64", post_path)
-                                if check_shared_object_architecture(src_lib_path) == "64-bit":
-                                    if os.path.exists(dst_lib_path):
-                                        logging.info(f"Library {src_lib_path} already exists in APEX {apex_file_name}, skipping copy.")
-                                        continue
-                                    try:
-                                        os.makedirs(os.path.dirname(dst_lib_path), exist_ok=True)
-                                        shutil.copyfile(src_lib_path, dst_lib_path)
-                                        logging.info(f"Copied APEX library {src_lib_path} to {dst_lib_path}: APEX {apex_file_name}")
-                                    except Exception as e:
-                                        logging.error(f"Error copying library {src_lib_path} to APEX {apex_file_name}: {e}")
-                                        return False, f"Error copying library {src_lib_path}: {e}"
-
-    javalib_folder_list = find_lib64_folders(partition_root, "javalib")
+        for lib_entry in lib64_library_list:
+            lib_dir = lib_entry["dir"]
+            if not lib_entry["is_vndk"] and "apex" in lib_dir and ("adbd" in lib_dir or "art" in lib_dir or "runtime" in lib_dir):
+                is_success, log_message = copy_indexed_library(lib_entry, apex_extract_dir_path, apex_file_name)
+                if not is_success:
+                    return False, log_message
+
+    javalib_folder_list = partition_index["javalib_folders"]
 
     logging.info(f"Javalib folders found: {javalib_folder_list} for APEX {apex_file_name}")
     add_javalibs = False
@@ -464,8 +498,7 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
 
     # Create the new APEX file
     ## Create Canned FS config file
-    with tempfile.NamedTemporaryFile(delete=False, dir=apex_root_path) as canned_fs_config:
-        generate_canned_fs_config(apex_extract_dir_path, canned_fs_config.name, allow_filtering=False)
+    canned_fs_config = generate_canned_fs_config(apex_extract_dir_path, workspace_temp_file_path(dir=apex_root_path), allow_filtering=False)
 
     ## Create APEX Manifest file
     apex_manifest_name = "apex_manifest.json"
@@ -513,13 +546,13 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
     file_contexts_path = os.path.join(aosp_path, "system", "sepolicy", "apex", f"com.android.fmd.{filename}-file_contexts")
 
     if aosp_version == "13":
-        apex_out_file = os.path.join(aosp_path, "out", "target", "product", "emulator64_arm64", partition_name, "apex",
+        apex_out_file = os.path.join(get_aosp_out_path(aosp_path), "target", "product", "emulator64_arm64", partition_name, "apex",
                                      apex_file_name)
     elif aosp_version == "14":
-        apex_out_file = os.path.join(aosp_path, "out", "target", "product", "emu64a", partition_name, "apex",
+        apex_out_file = os.path.join(get_aosp_out_path(aosp_path), "target", "product", "emu64a", partition_name, "apex",
                                      apex_file_name)
     else:
-        apex_out_file = os.path.join(aosp_path, "out", "target", "product", "emulator_arm64", partition_name, "apex",
+        apex_out_file = os.path.join(get_aosp_out_path(aosp_path), "target", "product", "emulator_arm64", partition_name, "apex",
                                      apex_file_name)
 
 
@@ -545,23 +578,7 @@ def add_new_apex_file(aosp_path, binary_file_path, lunch_target, partition_name,
     return is_success, log_message
 
 
-def clean_json_file(input_path, output_path):
-    with open(input_path, 'r') as f:
-        lines = f.readlines()
-    cleaned_lines = [
-        line for line in lines
-        if "Placeholder module version to be replaced during build." not in line
-        and "Do not change!" not in line
-    ]
-    for i, line in enumerate(cleaned_lines):
-        if "\"version\": 0" in line:
-            cleaned_lines[i] = line.replace("0", "999")
-
-    with open(output_path, 'w') as f:
-        f.writelines(cleaned_lines)
-    with open(output_path, 'r') as f:
-        json.load(f)
-
+@trace_span("apex.convert_manifest", category="apex")
 def convert_manifest_from_json(apex_manifest_path, out_file_path, aosp_path, lunch_target):
     """
     Executes the binary "conv_apex_manifest" to convert an apex_manifest.json file to
@@ -578,10 +595,21 @@ def convert_manifest_from_json(apex_manifest_path, out_file_path, aosp_path, lun
 
     options:
       -h, --help            show this help message and exit
+
+    The conversion runs in-process if the manifest only uses known ApexManifest fields. Outputs of the tool are
+    memoized by the cleaned JSON and the tool version.
     """
+    cleaned_json = get_cleaned_manifest_json(apex_manifest_path)
+    apex_manifest_pb = convert_manifest_in_process(cleaned_json)
+    if apex_manifest_pb is not None:
+        with open(out_file_path, "wb") as out_file:
+            out_file.write(apex_manifest_pb)
+        logging.info(f"APEX: manifest converted in-process: {apex_manifest_path} to {out_file_path}")
+        return True, {f"APEX manifest converted in-process: {out_file_path}"}
+
     conv_bin_candidates = [
-        os.path.join(aosp_path, "out/soong/host/linux-x86/bin/conv_apex_manifest"),
-        os.path.join(aosp_path, "out/host/linux-x86/bin/conv_apex_manifest"),
+        get_aosp_out_path(aosp_path, "out/soong/host/linux-x86/bin/conv_apex_manifest"),
+        get_aosp_out_path(aosp_path, "out/host/linux-x86/bin/conv_apex_manifest"),
     ]
     converter_path = next((p for p in conv_bin_candidates if os.path.exists(p)), None)
     if not converter_path:
@@ -589,9 +617,15 @@ def convert_manifest_from_json(apex_manifest_path, out_file_path, aosp_path, lun
         logging.info(message)
         return False, {f"{message}"}
 
-    base_dir = os.path.dirname(apex_manifest_path)
-    cleaned_manifest = os.path.join(base_dir, "apex_manifest_cleaned.json")
-    clean_json_file(apex_manifest_path, cleaned_manifest)
+    is_memoized, memo_path = get_memoized_manifest_path(cleaned_json, get_converter_version(converter_path))
+    if is_memoized:
+        shutil.copyfile(memo_path, out_file_path)
+        logging.info(f"APEX: memoized conv_apex_manifest output used: {memo_path} for {apex_manifest_path}")
+        return True, {f"APEX manifest taken from memo: {memo_path}"}
+
+    cleaned_manifest = workspace_temp_file_path(suffix="_apex_manifest_cleaned.json")
+    with open(cleaned_manifest, 'w') as f:
+        f.write(cleaned_json)
 
     info = f"APEX: conv_apex_manifest tool path: {converter_path}|{cleaned_manifest}|{out_file_path}|{lunch_target}"
     logging.info(info)
@@ -602,6 +636,8 @@ def convert_manifest_from_json(apex_manifest_path, out_file_path, aosp_path, lun
         logging.error(f"APEX: conv_apex_manifest conversion command failed. Trying again: {command} | {is_success} | {log}")
         is_success, log = execute_shell_command(command, aosp_path)
     logging.info(f"APEX: conv_apex_manifest extraction command: {command} | {is_success} | {log}")
+    if is_success and os.path.exists(out_file_path):
+        store_memoized_manifest(memo_path, out_file_path)
     return is_success, {f"ERROR: {log}| More infos: {info}"}
 
 
@@ -678,34 +714,10 @@ def get_apex_build_intermediate_folder(target_out_path):
 
 
 
-def get_match_existing_emulator_folders(filename_no_vendor):
-    if "tzdata" in filename_no_vendor:
-        filename_no_vendor = re.sub(r'tzdata\d+', 'tzdata', filename_no_vendor)
-
-    for key in POST_INJECTOR_CONFIG["APEX_DEFAULT_EMULATOR_PATHS_DICT"]:
-        if key in filename_no_vendor:
-            if key == "media" and ("mediaprovider" in filename_no_vendor or "swcodec" in filename_no_vendor):
-                continue
-            logging.info(f"Found APEX default path for {filename_no_vendor}: {POST_INJECTOR_CONFIG['APEX_DEFAULT_EMULATOR_PATHS_DICT'][key]}")
-            return POST_INJECTOR_CONFIG["APEX_DEFAULT_EMULATOR_PATHS_DICT"][key]
-    return None
-
-
 def find_emulator_apex_folder(target_out_path, file_path):
-    filename = str(os.path.basename(file_path))
-    filename_no_vendor = remove_vendor_name_from_filename(filename)
-    filename_no_vendor = filename_no_vendor.replace(".apex", "").replace(".capex", "")
-
-    apex_emulator_folder_root = get_apex_build_intermediate_folder(target_out_path)
-    logging.info(f"Searching for APEX module folder: {filename_no_vendor} in {apex_emulator_folder_root} for apex file {file_path}")
-    apex_emulator_folder_name = get_match_existing_emulator_folders(filename_no_vendor)
-    apex_module_folder = os.path.join(apex_emulator_folder_root, apex_emulator_folder_name)
-    logging.info(f"Test if APEX module folder exists: {apex_module_folder}")
-    if os.path.exists(apex_module_folder):
+    apex_module_folder = resolve_emulator_apex_folder(target_out_path, file_path, POST_INJECTOR_CONFIG)
+    if apex_module_folder:
         logging.info(f"APEX module folder found: {apex_module_folder} for apex {file_path}")
-    else:
-        apex_module_folder = None
-        logging.warning(f"APEX module folder not found: {filename_no_vendor} for apex {file_path}")
     return apex_module_folder
 
 
@@ -715,26 +727,104 @@ def get_last_two_as_int(input_string):
     except (ValueError, IndexError):
         return 0
 
+def read_protobuf_string_field(data, field_number):
+    """
+    Reads a string field from a serialized protobuf message without the generated message class.
+
+    :param data: bytes - serialized protobuf message.
+    :param field_number: int - number of the string field.
+    :return: str - the field value or None if not present.
+    """
+    def read_varint(position):
+        result, shift = 0, 0
+        while True:
+            byte = data[position]
+            position += 1
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result, position
+            shift += 7
+
+    position = 0
+    while position < len(data):
+        key, position = read_varint(position)
+        wire_type = key & 0x7
+        if wire_type == 0:
+            _, position = read_varint(position)
+        elif wire_type == 1:
+            position += 8
+        elif wire_type == 5:
+            position += 4
+        elif wire_type == 2:
+            length, position = read_varint(position)
+            if key >> 3 == field_number:
+                return data[position:position + length].decode("utf-8", errors="ignore")
+            position += length
+        else:
+            return None
+    return None
+
+
+def get_apex_manifest_name(file_path):
+    """
+    Reads the APEX name from the apex_manifest.pb (or apex_manifest.json) stored in the APEX zip container. Only the
+    zip central directory and the small manifest entry are read.
+
+    :param file_path: str - path to the APEX file.
+    :return: str - the APEX name or None if no manifest could be read.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as apex_zip:
+            zip_entry_names = apex_zip.namelist()
+            if "apex_manifest.pb" in zip_entry_names:
+                return read_protobuf_string_field(apex_zip.read("apex_manifest.pb"), 1)
+            if "apex_manifest.json" in zip_entry_names:
+                return json.loads(apex_zip.read("apex_manifest.json")).get("name")
+    except Exception as e:
+        logging.debug(f"Could not read APEX manifest from {file_path}: {e}")
+    return None
+
+
+def search_vndk_marker(file_path, marker=b"com.android.vndk.v"):
+    """
+    Searches the VNDK marker in a memory-mapped file and returns the printable string around the first match.
+
+    :param file_path: str - path to the binary file.
+    :param marker: bytes - marker to search for.
+    :return: str - the printable string containing the marker or None.
+    """
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = data.find(marker)
+            if index == -1:
+                return None
+            end = index + len(marker)
+            while end < len(data) and 0x20 <= data[end] <= 0x7E:
+                end += 1
+            return data[index:end].decode("utf-8", errors="ignore")
+
+
 def get_vndk_version(file_path):
     """
-    Extracts the VNDK version from a binary file by identifying readable strings and searching for 'vndk'.
+    Extracts the VNDK version of a VNDK APEX. The version is taken from the APEX name in the manifest and, if no
+    manifest is readable, from the first 'com.android.vndk.v' string in the memory-mapped file.
+
     :param file_path: str - Path to the binary file.
-    :return: str - The VNDK version if found, otherwise None.
+    :return: int - The VNDK version if found, otherwise 0.
     """
     version = 0
     try:
-        with open(file_path, 'rb') as file:
-            data = file.read()
-            strings = re.findall(rb'[ -~]{4,}', data)
-            logging.debug(f"Found VNDK strings: {strings}")
-            for string in strings:
-                if b'com.android.vndk.v' in string.lower():
-                    version_string = string.decode('utf-8')
-                    logging.debug(f"Found VNDK string: {version_string}")
-                    version = get_last_two_as_int(version_string)
-                    if version != 0:
-                        logging.info(f"Extracted VNDK version: {version}")
-                        return int(version)
+        version_string = get_apex_manifest_name(file_path)
+        if not version_string or "com.android.vndk.v" not in version_string.lower():
+            version_string = search_vndk_marker(file_path)
+        if version_string:
+            logging.debug(f"Found VNDK string: {version_string}")
+            version = get_last_two_as_int(version_string)
+            if version != 0:
+                logging.info(f"Extracted VNDK version: {version}")
+                return int(version)
     except Exception as e:
         logging.error(f"Error reading file {file_path}: {e}")
     return version
@@ -756,10 +846,7 @@ def get_matching_apex_key(filename, config):
     """
     Returns the first key from config that matches a substring in the filename.
     """
-    for key in config:
-        if key in filename:
-            return key
-    return None
+    return resolve_apex_source_key(filename, config)
 
 
 def load_apex_manifest_from_aosp(apex_emulator_folder, merged_apex_extract_dir_path, filename_input, aosp_path, apex_root_path, lunch_target):
@@ -819,6 +906,7 @@ def load_apex_manifest_from_aosp(apex_emulator_folder, merged_apex_extract_dir_p
 
 # Keep the structure of the original apex
 # Inject additional files into the apex
+@trace_span("apex.merge", category="apex")
 def merge_apex_files(apex_emulator_folder, input_apex, apex_out_file, lunch_target, aosp_path, target_out_path, aosp_version):
     """
     Merges the emulator APEX file with a vendor apex in case they have the same name.
@@ -834,16 +922,16 @@ def merge_apex_files(apex_emulator_folder, input_apex, apex_out_file, lunch_targ
 
     logging.info(f"Merging APEX files: {apex_emulator_folder} and {input_apex}")
     is_success, log_message = False, None
-    apex_root_path = tempfile.mkdtemp(suffix=f"_{filename_input}_merged")
-    merged_apex_extract_dir_path = tempfile.mkdtemp(suffix=f"extract", dir=apex_root_path)
-    apex_vendor_extract_dir_path = tempfile.mkdtemp(suffix=f"_{filename_input}_vendor")
+    apex_root_path = workspace_mkdtemp(suffix=f"_{filename_input}_merged")
+    merged_apex_extract_dir_path = workspace_mkdtemp(suffix=f"extract", dir=apex_root_path)
+    apex_vendor_extract_dir_path = workspace_mkdtemp(suffix=f"_{filename_input}_vendor")
     extract_success, log_message = extract_apex_file(aosp_path, input_apex, apex_vendor_extract_dir_path, lunch_target, aosp_version)
     if extract_success:
         if POST_INJECTOR_CONFIG["ALLOW_MIXED_APEX_FILES"] and any(keyword in filename_input for keyword in POST_INJECTOR_CONFIG["ALLOW_MIXED_APEX_KEYWORD_LIST"]):
             logging.info(f"APEX: CREATING MIXED APEX: {apex_emulator_folder} and vendor APEX: {input_apex}")
-            shutil.copytree(apex_emulator_folder, merged_apex_extract_dir_path, dirs_exist_ok=True)
-            logging.info(f"Copied emulator APEX folder: {apex_emulator_folder} to {merged_apex_extract_dir_path}")
-            log_files_in_dir(merged_apex_extract_dir_path)
+            clone_mode = clone_emulator_apex_tree(aosp_path, lunch_target, apex_emulator_folder,
+                                                  merged_apex_extract_dir_path)
+            logging.info(f"Cloned emulator APEX folder ({clone_mode}): {apex_emulator_folder} to {merged_apex_extract_dir_path}")
         else:
             load_apex_manifest_from_aosp(apex_emulator_folder,
                                          merged_apex_extract_dir_path,
@@ -865,8 +953,7 @@ def merge_apex_files(apex_emulator_folder, input_apex, apex_out_file, lunch_targ
         else:
             logging.info("Injecting APEX vendor apps is disabled.")
 
-        with tempfile.NamedTemporaryFile(delete=False) as canned_fs_config:
-            generate_canned_fs_config(merged_apex_extract_dir_path, canned_fs_config.name, apk_name_list)
+        canned_fs_config = generate_canned_fs_config(merged_apex_extract_dir_path, workspace_temp_file_path(dir=apex_root_path), apk_name_list)
 
 
         is_manifest_found, apex_manifest_path = move_apex_manifest_file(merged_apex_extract_dir_path,
@@ -890,17 +977,25 @@ def merge_apex_files(apex_emulator_folder, input_apex, apex_out_file, lunch_targ
                                                                                   file_contexts_path=None,
                                                                                   aosp_version=aosp_version)
                 if is_success:
-                    is_success, error_message = sign_apex_file(apex_out_file,
-                                                               aosp_path,
-                                                               private_key_path,
-                                                               cert_apex_apk_path,
-                                                               lunch_target)
-                    logging.info(f"Completed APEX merge successfully: {apex_out_file}")
-                    if POST_INJECTOR_CONFIG["REPLACE_AVB_KEYS"]:
-                        logging.info(f"Overwriting AVB keys for APEX: {apex_out_file}")
-                        is_success, log_message = inject_apex_avb_public_key(input_apex,
-                                                                             avb_pub_key_path,
-                                                                             target_out_path)
+                    is_signed, error_message = sign_apex_file(apex_out_file,
+                                                              aosp_path,
+                                                              private_key_path,
+                                                              cert_apex_apk_path,
+                                                              lunch_target)
+                    if not is_signed:
+                        # The unsigned APEX must neither replace the original nor end up in the APEX cache
+                        is_success = False
+                        log_message = f"APEX signing failed: {apex_out_file} | {error_message}"
+                        logging.error(log_message)
+                        if os.path.exists(apex_out_file):
+                            os.remove(apex_out_file)
+                    else:
+                        logging.info(f"Completed APEX merge successfully: {apex_out_file}")
+                        if POST_INJECTOR_CONFIG["REPLACE_AVB_KEYS"]:
+                            logging.info(f"Overwriting AVB keys for APEX: {apex_out_file}")
+                            is_success, log_message = inject_apex_avb_public_key(input_apex,
+                                                                                 avb_pub_key_path,
+                                                                                 target_out_path)
                 else:
                     logging.error(f"APEX container creation failed: {apex_out_file} | {log_message}")
                     log_message = f"APEX container creation failed. {log_message}"
@@ -910,6 +1005,7 @@ def merge_apex_files(apex_emulator_folder, input_apex, apex_out_file, lunch_targ
     return is_success, log_message
 
 
+@trace_span("apex.inject_vendor_apps", category="apex")
 def inject_apex_vendor_apps(merged_apex_extract_dir_path, apex_vendor_extract_dir_path):
     files_coped_list = []
     for root, dirs, files in os.walk(apex_vendor_extract_dir_path):
@@ -956,6 +1052,7 @@ def inject_apex_vendor_apps(merged_apex_extract_dir_path, apex_vendor_extract_di
     return files_coped_list
 
 
+@trace_span("apex.inject_vendor_files", category="apex")
 def inject_apex_vendor_files(merged_apex_extract_dir_path, apex_vendor_extract_dir_path):
     files_coped_list = []
     current_username = os.getlogin()
@@ -1165,13 +1262,14 @@ def get_existing_file_context(apex_file_name, aosp_path):
     return file_contexts_path
 
 
+@trace_span("apex.create_container", category="apex")
 def create_apex_container(apex_manifest_path, apex_extract_dir_path, apex_root_path, aosp_path, output_file_path, lunch_target, canned_fs_config, is_repack=False, file_contexts_path=None, aosp_version=None):
     success = False
     resign_apex_apk_files(aosp_path, apex_extract_dir_path, aosp_version)
 
     apexer_bin_candidates = [
-        os.path.join(aosp_path, "out/soong/host/linux-x86/bin/apexer"),
-        os.path.join(aosp_path, "out/host/linux-x86/bin/apexer"),
+        get_aosp_out_path(aosp_path, "out/soong/host/linux-x86/bin/apexer"),
+        get_aosp_out_path(aosp_path, "out/host/linux-x86/bin/apexer"),
     ]
     apexer_bin_path = next((p for p in apexer_bin_candidates if os.path.exists(p)), None)
     if not apexer_bin_path:
@@ -1205,7 +1303,8 @@ def create_apex_container(apex_manifest_path, apex_extract_dir_path, apex_root_p
     command = f"cd {apex_root_path} && {apexer_bin_path} --verbose " \
               f"--key={priv_pem_file_path} " \
               f"--pubkey={avb_pub_key_path} " \
-              f"--apexer_tool_path={aosp_path}out/host/linux-x86/bin/:{aosp_path}out/soong/host/linux-x86/bin/ " \
+              f"--apexer_tool_path={get_aosp_out_path(aosp_path, 'out/host/linux-x86/bin/')}:" \
+              f"{get_aosp_out_path(aosp_path, 'out/soong/host/linux-x86/bin/')} " \
               f"--file_contexts={file_contexts_path} " \
               f"--canned_fs_config={canned_fs_config.name} " \
               f"--include_build_info " \
@@ -1222,7 +1321,9 @@ def create_apex_container(apex_manifest_path, apex_extract_dir_path, apex_root_p
         and os.path.exists(file_contexts_path) \
         and os.path.exists(avb_pub_key_path) \
         and os.path.exists(priv_pem_file_path):
-        log_files_in_dir(apex_root_path)
+        logging.debug(f"APEX: Files in {apex_root_path}: {os.listdir(apex_root_path)}")
+        canned_fs_config.log_listing()
+        workspace_checkpoint("apexer")
         is_success, log_message = execute_shell_command(command, aosp_path)
         if is_success and os.path.exists(output_file_path):
             logging.info(f"APEX create_apex_container success: {output_file_path}. Command-Log: {log_message}")
@@ -1245,16 +1346,7 @@ def create_apex_container(apex_manifest_path, apex_extract_dir_path, apex_root_p
 
     return success, log_message, avb_pub_key_path, priv_pem_file_path, private_key_path, cert_apex_apk_path
 
-def log_files_in_dir(dir_path):
-    files_and_dirs = []
-    for root, dirs, files in os.walk(dir_path):
-        for file in files:
-            files_and_dirs.append(os.path.join(root, file))
-        for dir_name in dirs:
-            files_and_dirs.append(os.path.join(root, dir_name))
-    logging.info(f"APEX: Files and directories in {dir_path}: {files_and_dirs}")
-
-
+@trace_span("apex.sign", category="apex")
 def sign_apex_file(file_path, aosp_path, priv_key_apex_apk_path, apex_apk_certificate_path, lunch_target):
     error_message = None
     #signing_key_path = get_signing_key_path(aosp_path, "platform")
@@ -1315,78 +1407,80 @@ def prepare_apex_out_file(file_path):
     return str(os.path.join(apex_dir_path, apex_filename_new))
 
 
+class CannedFsConfigManifest:
+    """
+    Result of generate_canned_fs_config. Exposes the config file path as `name`, so it can be passed to
+    create_apex_container like the temporary file object it replaces, and keeps the written entries for logging.
+    """
+    def __init__(self, name, root_path):
+        self.name = name
+        self.root_path = root_path
+        self.entries = []
+        self.removed_files = []
+
+    def add_entry(self, relative_path, user_id, group_id, mode):
+        self.entries.append(f"/{relative_path} {user_id} {group_id} {mode}")
+
+    def log_listing(self, level=logging.DEBUG):
+        logging.log(level, f"APEX: Files and directories in {self.root_path}: {self.entries} | removed: {self.removed_files}")
+
+
+@trace_span("apex.canned_fs_config", category="apex")
 def generate_canned_fs_config(apex_extract_dir_path, output_file, apk_name_list=None, allow_filtering=True):
     """
     Generates a canned_fs_config file for the given directory. The config contains the file paths and their
-    permissions. The method gives all the files and directories the default permissions.
+    permissions. The method gives all the files and directories the default permissions. The tree is scanned in a
+    single pass and the lines are streamed to the output file. Executable files are detected from st_mode.
 
     :param apex_extract_dir_path: str - path to the directory where the extracted apex files reside.
     :param output_file: str - path to the output file where the canned_fs_config will be saved.
+    :param apk_name_list: list(str) - names of the apk files to keep if filtering is allowed.
+    :param allow_filtering: bool - if True, apk files not in apk_name_list are removed from the tree.
 
+    :return: CannedFsConfigManifest - manifest of the written entries.
     """
     if apk_name_list is None:
         apk_name_list = []
-    file_inserted_entries = []
+    manifest = CannedFsConfigManifest(output_file, apex_extract_dir_path)
     with open(output_file, 'w') as out_file:
         out_file.write(f"/ 1000 1000 0755\n")
-        for root, dirs, files in os.walk(apex_extract_dir_path):
-            for dir_name in dirs:
-                dir_path = str(os.path.join(root, dir_name))
-                relative_dir_path = os.path.relpath(dir_path, apex_extract_dir_path)
-                user_id = 0  # root
-                group_id = 2000  # system
-                mode = '0755'
-                out_file.write(f"/{relative_dir_path} {user_id} {group_id} {mode}\n")
-                file_inserted_entries.append(f"/{relative_dir_path} {user_id} {group_id} {mode}")
-
-            for file_name in files:
-                file_path = str(os.path.join(root, file_name))
-                #module_type = get_module_type(file_path, is_apex=True)
-
-                # if module_type == "SKIPPED":
-                #     try:
-                #         logging.error(f"APEX: SKIPPED module type. File not included into canned_fs: {file_path}")
-                #         os.remove(file_path)
-                #     except Exception as e:
-                #         logging.error(f"Error deleting file from canned_fs: {file_path} | {e}")
-                #     continue
-                # else:
-                #     logging.info(f"APEX: Adding file to canned_fs: {file_path}")
-                if allow_filtering:
-                    is_apk = file_path.endswith(".apk")
-                    if is_apk and not any(apk_name in file_path for apk_name in apk_name_list):
-                        try:
-                            logging.error(f"APEX: SKIPPED apk. File not included into canned_fs: {file_path}")
-                            os.remove(file_path)
-                        except Exception as e:
-                            logging.error(f"Error deleting file from canned_fs: {file_path} | {e}")
+        pending_dir_list = [apex_extract_dir_path]
+        while pending_dir_list:
+            with os.scandir(pending_dir_list.pop()) as dir_entries:
+                for entry in dir_entries:
+                    relative_path = os.path.relpath(entry.path, apex_extract_dir_path)
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            pending_dir_list.append(entry.path)
+                        out_file.write(f"/{relative_path} 0 2000 0755\n")
+                        manifest.add_entry(relative_path, 0, 2000, "0755")
+                        continue
+
+                    is_filtered_apk = allow_filtering and entry.name.endswith(".apk") \
+                        and not any(apk_name in entry.path for apk_name in apk_name_list)
+                    if is_filtered_apk or "apex_pubkey" in entry.name:
+                        manifest.removed_files.append(entry.path)
                         continue
 
-                if "apex_pubkey" in file_name:
-                    logging.info(f"APEX: SKIPPED apex_pubkey file. File not included: {file_path}")
-                    os.remove(file_path)
-
-                relative_file_path = os.path.relpath(file_path, apex_extract_dir_path)
-                user_id = 1000  # system
-                group_id = 1000  # system
-                mode = '0644'
-                if os.access(file_path, os.X_OK):
-                    mode = '0755'  # Executable files get 0755
-                out_file.write(f"/{relative_file_path} {user_id} {group_id} {mode}\n")
-                file_inserted_entries.append(f"/{relative_file_path} {user_id} {group_id} {mode}")
-                # Workaround for boot.art file in APEX
-                # if "boot" in file_name and "arm64" in file_path:
-                #     parent_dir = os.path.dirname(file_path)
-                #     grandparent_dir = os.path.dirname(parent_dir)
-                #     copy_dst = os.path.join(grandparent_dir, file_name)
-                #     logging.info(f"APEX Copying boot.art javalib: {file_path}:{copy_dst}")
-                #     shutil.copyfile(file_path, copy_dst)
-                #     relative_file_path = os.path.relpath(copy_dst, apex_extract_dir_path)
-                #     logging.info(f"APEX Write new boot.art path: {relative_file_path}:{copy_dst}:{parent_dir}")
-                #     out_file.write(f"/{relative_file_path} {user_id} {group_id} {mode}\n")
-                #     file_inserted_entries.append(f"/{relative_file_path} {user_id} {group_id} {mode}")
-    logging.info(f"APEX: Canned FS Config file created: {output_file} | {file_inserted_entries}")
+                    try:
+                        is_executable = entry.stat().st_mode & 0o111
+                    except OSError:
+                        is_executable = False
+                    mode = '0755' if is_executable else '0644'
+                    out_file.write(f"/{relative_path} 1000 1000 {mode}\n")
+                    manifest.add_entry(relative_path, 1000, 1000, mode)
+
+    for file_path in manifest.removed_files:
+        try:
+            logging.info(f"APEX: SKIPPED file not included into canned_fs: {file_path}")
+            os.remove(file_path)
+        except Exception as e:
+            logging.error(f"Error deleting file from canned_fs: {file_path} | {e}")
+    logging.info(f"APEX: Canned FS Config file created: {output_file} | {len(manifest.entries)} entries")
+    return manifest
 
+
+@trace_span("apex.extract", category="apex")
 def extract_apex_file(aosp_path, apex_file_path, output_dir_path, lunch_target, aosp_version):
     """
     Extracts the APEX file using deapexer.
@@ -1401,8 +1495,8 @@ def extract_apex_file(aosp_path, apex_file_path, output_dir_path, lunch_target,
     """
     logging.info(f"Extracting APEX file: {apex_file_path}")
     deapexer_candidates = [
-        os.path.join(aosp_path, "out/soong/host/linux-x86/bin/deapexer"),
-        os.path.join(aosp_path, "out/host/linux-x86/bin/deapexer"),
+        get_aosp_out_path(aosp_path, "out/soong/host/linux-x86/bin/deapexer"),
+        get_aosp_out_path(aosp_path, "out/host/linux-x86/bin/deapexer"),
     ]
     deapexer_tool_path = next((p for p in deapexer_candidates if os.path.exists(p)), None)
     if not deapexer_tool_path:
@@ -1426,14 +1520,13 @@ def extract_apex_file(aosp_path, apex_file_path, output_dir_path, lunch_target,
 def create_apex_manifest_file(apex_extract_dir_path, apex_package_name):
     manifest_file_name = "AndroidManifest.json"
     manifest_file_path = os.path.join(apex_extract_dir_path, manifest_file_name)
-    with open(manifest_file_path, 'w') as manifest_file:
-        template_folder_abs_path = os.path.join(ROOT_PATH, TEMPLATE_FOLDER)
-        environment = Environment(loader=FileSystemLoader(str(template_folder_abs_path)))
-        template = environment.get_template(manifest_file_name)
-        rendered_template = template.render(package=apex_package_name, versionCode=999)
-        manifest_file.write(rendered_template)
+    template_folder_abs_path = os.path.join(ROOT_PATH, TEMPLATE_FOLDER)
+    rendered_template = render_template_file(template_folder_abs_path, manifest_file_name,
+                                             package=apex_package_name, versionCode=999)
+    write_file_if_changed(manifest_file_path, rendered_template)
 
 
+@trace_span("apex.move_manifest", category="apex")
 def move_apex_manifest_file(apex_extract_dir_path, output_dir_path, apex_filename, aosp_path, lunch_target):
     """
     Searches for the APEX manifest file in the APEX extract directory and moves it to the current directory.
@@ -1480,10 +1573,9 @@ def move_apex_manifest_file(apex_extract_dir_path, output_dir_path, apex_filenam
           "version": 999999
         }}
         """
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".json", mode='w',
-                                             encoding='utf-8') as temp_manifest_file:
+            temp_manifest_path = workspace_temp_file_path(suffix=".json")
+            with open(temp_manifest_path, mode='w', encoding='utf-8') as temp_manifest_file:
                 temp_manifest_file.write(manifest_json_str)
-                temp_manifest_path = temp_manifest_file.name
         convert_manifest_from_json(apex_manifest_path=temp_manifest_path, out_file_path=manifest_dst, aosp_path=aosp_path, lunch_target=lunch_target)
         if os.path.exists(manifest_dst):
             is_apex_manifest_file_found = True
@@ -1500,31 +1592,9 @@ def convert_apex_manifest_json_to_pb(apex_manifest_path, output_file_path):
     else:
         raise ValueError(f"APEX: Error converting APEX manifest file to pb: {result.stderr}")
 
-def search_string_in_apk(apk_file, search_string):
-    is_user_id_found = False
-    with zipfile.ZipFile(apk_file, 'r') as apk:
-        for file_info in apk.infolist():
-            if file_info.filename == "AndroidManifest.xml":
-                with apk.open(file_info) as android_manifest_file:
-                    try:
-                        content = android_manifest_file.read().decode('utf-8', errors='ignore')
-                        if search_string in content:
-                            logging.info(f"Found string in APK: {apk_file}")
-                            is_user_id_found = True
-                            break
-                    except UnicodeDecodeError:
-                        pass
-                break
-    return is_user_id_found
-
 def get_signing_key_from_manifest(apk_file):
-    signing_key = None
-    for key, shared_uid_list in POST_INJECTOR_CONFIG["SHARED_USER_ID_MAPPING_DICT"].items():
-        for shared_uid in shared_uid_list:
-            if search_string_in_apk(apk_file, shared_uid):
-                signing_key = key
-                break
-    return signing_key
+    shared_user_id = read_apk_manifest(apk_file)["sharedUserId"]
+    return get_signing_key_from_shared_user_id(shared_user_id)
 
 def get_signing_key_from_filename(apk_file, aosp_version):
     file_name = os.path.basename(apk_file).lower()
@@ -1541,6 +1611,7 @@ def get_signing_key_from_filename(apk_file, aosp_version):
     return key
 
 
+@trace_span("apex.resign_apks", category="apex")
 def resign_apex_apk_files(aosp_path, apex_extract_dir_path, aosp_version):
     """
     Searches for apk files within the apex extract directory. Signs all the apk files of the apex file.
@@ -1585,7 +1656,7 @@ def copy_android_prebuilt_jar(aosp_path, apex_root_path):
 
 
 def create_key_paths(apex_file_name):
-    temp_keys_dir = tempfile.mkdtemp(suffix="_apex_keys")
+    temp_keys_dir = workspace_mkdtemp(suffix="_apex_keys")
     apex_file_name = apex_file_name.replace(".apex", "").replace(".capex", "")
     priv_key_path = os.path.join(temp_keys_dir, f"{apex_file_name}.pk8")
     pub_key_path = os.path.join(temp_keys_dir, f"{apex_file_name}.cert")
@@ -1595,6 +1666,7 @@ def create_key_paths(apex_file_name):
     return temp_keys_dir, priv_key_path, pub_key_path, priv_pem_file_path, avb_pub_key_path, apex_apk_cert
 
 
+@trace_span("apex.generate_keys", category="apex")
 def generate_apex_keys(aosp_path, apex_file_name):
     temp_keys_dir, priv_key_path, pub_key_path, priv_pem_file_path, avb_pub_key_path, apex_apk_cert = create_key_paths(apex_file_name)
     is_success = False
@@ -1699,7 +1771,7 @@ def extract_avb_public_key(aosp_path, key, avb_pub_out_path):
     """
     is_success = True
     try:
-        avbtool_path = os.path.join(aosp_path, "out/host/linux-x86/bin/avbtool")
+        avbtool_path = get_aosp_out_path(aosp_path, "out/host/linux-x86/bin/avbtool")
         avb_extract_command = [avbtool_path, 'extract_public_key', "--key", key, "--output", avb_pub_out_path]
         subprocess.run(avb_extract_command, check=True)
         logging.info(f"AVB public key extracted at: {avb_pub_out_path}")
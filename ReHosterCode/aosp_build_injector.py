@@ -11,17 +11,34 @@ import logging
 import shutil
 import subprocess
 import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from jinja2 import Environment, FileSystemLoader
 from getpass import getpass
 import time
+from filelock import FileLock
 from aosp_apex_injector import repackage_apex_file
 from aosp_post_build_injector import start_post_build_injector
-from common import extract_zip, load_configs
+from build_cache import get_build_cache_environment, pop_firmware_build_cache_statistics, read_ccache_counters, \
+    record_build_cache_statistics, reset_firmware_build_cache_statistics
+from build_failure import BuildFailureError, pop_firmware_build_failures, record_build_failure, record_build_fix, \
+    reset_firmware_build_failures, run_build_command_streamed
+from build_job_runner import run_build_jobs
+from common import load_configs, get_aosp_out_path, copy_tree_linked
 from config import *
+from firmware_prefetcher import FirmwarePrefetcher
 from fmd_backend_requests import download_firmware_build_files, get_csrf_token, authenticate_fmd, \
     get_firmware_ids, get_graphql_url, upload_image_as_raw
+from incremental_build import invalidate_incremental_build, write_incremental_build_state, read_incremental_build_state, \
+    get_changed_config_keys, get_staged_package_paths, invalidate_staged_packages, remove_packed_images
+from metrics_store import append_metrics_record, export_all_metrics
+from partition_sizing import get_fixed_step_partition_size, get_image_sizes, right_size_partitions_after_injection, \
+    right_size_partitions_before_build, write_board_partition_sizes
+from pipeline_trace import start_trace, stop_trace, trace_span
 from setup_logger import setup_logger
+from source_overlay import mount_source_overlay, unmount_source_overlay
+from streaming_unzip import StreamingZipExtractor
+from template_renderer import render_template_file, write_file_if_changed
 
 
 
@@ -30,6 +47,9 @@ if os.environ.get("FMD_DEBUG") == "True":
 else:
     setup_logger()
 
+# APEX repackaging runs build tools on shared workspaces and is not run concurrently by the staging threads
+apex_repackaging_lock = threading.Lock()
+
 
 def delete_files(dir_path):
     """
@@ -43,7 +63,27 @@ def delete_files(dir_path):
         os.remove(f)
 
 
-def start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, aosp_version, skip_filtering, cookies):
+def get_make_command():
+    """
+    Returns the make command with the -j share of this build job, if one is set.
+    """
+    if BUILD_JOBS > 0:
+        return f"m -j{BUILD_JOBS}"
+    return "m"
+
+
+def source_tree_lock(aosp_path):
+    """
+    Returns the lock that serializes the phases of concurrent build jobs that modify or build from the shared aosp
+    source tree.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    """
+    return FileLock(os.path.join(aosp_path, SOURCE_TREE_LOCK_FILENAME))
+
+
+def start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, aosp_version, skip_filtering, cookies,
+                     incremental_build=False):
     """
     Wrapper method to start the firmware injection and build process.
 
@@ -53,6 +93,7 @@ def start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, a
     :param aosp_path: str - path to aosp root folder.
     :param aosp_version: str - version of the aosp build.
     :param skip_filtering: bool - skip the filtering process.
+    :param incremental_build: bool - keep out/ and invalidate only the outputs affected by the injection.
 
     :returns: bool - True if the build process was successful.
 
@@ -61,17 +102,28 @@ def start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, a
     pre_injector_start_time = time.time()
     is_successful = False
     logging.debug(f"Start aosp {aosp_version} build injection with firmware: {firmware_id}")
-    overwrite_partition_size(aosp_path, aosp_packages_path, aosp_version)
+    with trace_span("overwrite_partition_size", category="staging"):
+        overwrite_partition_size(aosp_path, aosp_packages_path, aosp_version)
+    make_command = get_make_command()
+    clean_command = "m clean && "
+    if incremental_build:
+        with trace_span("invalidate_incremental_build", category="build"):
+            if invalidate_incremental_build(aosp_path, get_target_out_path(aosp_path, lunch_target)):
+                clean_command = ""
     if aosp_version in ["11", "12"]:
-        blueprint_build_command = f"bash -c 'cd {aosp_path} && source {aosp_path}/build/envsetup.sh && lunch {lunch_target} && m clean && m blueprint_tools otatools debugfs_static'"
+        blueprint_build_command = f"bash -c 'cd {aosp_path} && source {aosp_path}/build/envsetup.sh && lunch {lunch_target} && {clean_command}{make_command} blueprint_tools otatools debugfs_static'"
     else:
-        blueprint_build_command = f"bash -c 'cd {aosp_path} && source {aosp_path}/build/envsetup.sh && lunch {lunch_target} && m clean && m blueprint_tools otatools debugfs_static apexer deapexer avbtool'"
-    execute_build_command(aosp_path, firmware_id, blueprint_build_command, aosp_path)
+        blueprint_build_command = f"bash -c 'cd {aosp_path} && source {aosp_path}/build/envsetup.sh && lunch {lunch_target} && {clean_command}{make_command} blueprint_tools otatools debugfs_static apexer deapexer avbtool'"
+    execute_build_command(aosp_path, firmware_id, blueprint_build_command, aosp_path,
+                          trace_name="m blueprint_tools otatools")
+    with trace_span("clear_staged_packages", category="source_tree"):
+        clear_staged_packages(aosp_path, os.path.join(aosp_path, aosp_packages_path))
     logging.debug(f"Environment setup for {lunch_target} completed. Moving packages to aosp source code next.")
     try:
         move_txt_files(EXTRACTED_PACKAGES_PATH, BUILD_OUT_PATH)
         if PRE_INJECTOR_CONFIG["ENABLE_INJECTION"]:
-            included_package_statistics = move_packages_to_aosp(aosp_path, EXTRACTED_PACKAGES_PATH, lunch_target, aosp_version)
+            with trace_span("package_staging", category="staging"):
+                included_package_statistics = move_packages_to_aosp(aosp_path, EXTRACTED_PACKAGES_PATH, lunch_target, aosp_version)
         else:
             logging.debug("Skipping package injection as ENABLE_INJECTION is set to False.")
             included_package_statistics = {"apps": [], "libs": [], "apex": [], "count": 0}
@@ -108,41 +160,292 @@ def start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, a
         exit(-1)
 
     retry_attempts = BUILD_RETRY_COUNT
+    fix_count = 0
+    partition_headroom_percent = PARTITION_HEADROOM_PERCENT
     while not is_successful and retry_attempts > 0:
         try:
             main_build_command = get_aosp_build_command(lunch_target, aosp_version, aosp_path)
             build_start_time = time.time()
-            execute_build_command(aosp_path, firmware_id, main_build_command, aosp_path)
+            execute_build_command(aosp_path, firmware_id, main_build_command, aosp_path, trace_name="m")
             build_end_time = time.time()
             logging.info(f"AOSP main build completed successfully. Continuing with post-build injection.")
-            target_out_path = get_target_out_path(aosp_path, lunch_target)
-            all_extracted_firmware_files_path = os.path.join(EXTRACTED_PACKAGES_PATH, EXTRACTION_ALL_FILES_DIR_NAME)
-
-            start_post_build_injector(aosp_path=aosp_path,
-                                      source_folder_path=all_extracted_firmware_files_path,
-                                      target_out_path=target_out_path,
-                                      lunch_target=lunch_target,
-                                      firmware_id=firmware_id,
-                                      pre_injector_package_list=included_package_statistics["apps"],
-                                      pre_injector_config_path=PRE_INJECTOR_CONFIG_PATH,
-                                      post_injector_config_path=POST_INJECTOR_CONFIG_PATH,
-                                      cookies=cookies,
-                                      aosp_version=aosp_version
-                                      )
             included_package_statistics["main_build_duration"] = round(build_end_time - build_start_time, 2)
-            logging.info(f"Summary Pre-Injector: {included_package_statistics}")
-            package_build_artefacts_command = get_aosp_repo_build_command(aosp_path, lunch_target, aosp_version)
-            package_start_time = time.time()
-            execute_build_command(aosp_path, firmware_id, package_build_artefacts_command, aosp_path)
-            package_end_time = time.time()
-            included_package_statistics["package_build_artefacts_duration"] = round(package_end_time - package_start_time, 2)
+            inject_and_package_images(aosp_path, firmware_id, lunch_target, aosp_version, cookies,
+                                      included_package_statistics, package_name_list,
+                                      partition_headroom_percent=partition_headroom_percent)
             is_successful = True
+        except BuildFailureError as err:
+            logging.error(err)
+            failure = err.failure
+            if not failure["retryable"]:
+                logging.error(f"Not retrying the build of firmware-id {firmware_id} after {failure['class']}.")
+                break
+            fix = None
+            if fix_count < BUILD_FAILURE_MAX_FIXES:
+                if failure["class"] == "partition_too_large" and PARTITION_RIGHT_SIZING:
+                    partition_headroom_percent = max(2 * partition_headroom_percent, 10)
+                    overwrite_partition_size(aosp_path, aosp_packages_path, aosp_version, partition_headroom_percent)
+                    fix = f"partition headroom {partition_headroom_percent}%"
+                elif failure["class"] in ["duplicate_module", "missing_dependency"]:
+                    dropped_package_name = drop_failed_package(aosp_path, aosp_version, lunch_target, failure,
+                                                               package_name_list, included_package_statistics)
+                    if dropped_package_name:
+                        fix = f"dropped package {dropped_package_name}"
+            if fix:
+                # A fixed failure does not use up a retry attempt
+                fix_count += 1
+                record_build_fix(fix)
+                logging.warning(f"Retrying the build of firmware-id {firmware_id} after {failure['class']} with "
+                                f"fix: {fix}")
+            else:
+                retry_attempts -= 1
         except Exception as err:
             logging.error(err)
             retry_attempts -= 1
     return is_successful
 
 
+def get_failed_package_name(failure, staged_package_dict):
+    """
+    Finds the injected package a build failure is caused by, from the staged path or the module in the failure line.
+
+    :param failure: dict - classified build failure, see build_failure.match_fatal_pattern.
+    :param staged_package_dict: dict - lower-case package name -> staged folders, see get_staged_package_paths.
+    :return: str - lower-case name of the staged package, None if the failure is not caused by an injected package.
+    """
+    if failure.get("path"):
+        path_part_list = failure["path"][len(MODULE_BASE_INJECT_DIR):].split("/")
+        if len(path_part_list) >= 2:
+            if path_part_list[0] == "apex":
+                package_name = path_part_list[1].lower()
+            else:
+                package_name = path_part_list[1].rsplit("_", 1)[0].lower()
+            if package_name in staged_package_dict:
+                return package_name
+    if failure.get("module"):
+        module_name = clean_package_name(failure["module"].lower())
+        for package_name in staged_package_dict:
+            if module_name in [package_name, clean_package_name(package_name)]:
+                return package_name
+    return None
+
+
+def drop_failed_package(aosp_path, aosp_version, lunch_target, failure, package_name_list,
+                        included_package_statistics):
+    """
+    Removes the injected package that caused a duplicate module or missing dependency failure from the build: its
+    staged folder and build outputs are removed and the base files are rendered without it.
+
+    :param failure: dict - classified build failure.
+    :param package_name_list: list(str) - names of the injected packages, updated in place.
+    :param included_package_statistics: dict - statistics of the injected packages, updated in place.
+    :return: str - name of the dropped package, None if the failure is not caused by an injected package.
+    """
+    out_dir = os.path.join(aosp_path, MODULE_BASE_INJECT_DIR)
+    staged_package_dict = get_staged_package_paths(out_dir)
+    package_name = get_failed_package_name(failure, staged_package_dict)
+    if not package_name:
+        logging.info(f"Build failure {failure['class']} is not caused by an injected package: {failure['line']}")
+        return None
+    invalidate_staged_packages(aosp_path, get_target_out_path(aosp_path, lunch_target),
+                               staged_package_dict[package_name])
+    for name_list in [package_name_list, included_package_statistics["apps"], included_package_statistics["libs"],
+                      included_package_statistics["apex"]]:
+        name_list[:] = [name for name in name_list if name.lower() != package_name]
+    included_package_statistics.setdefault("dropped_packages", []).append(package_name)
+    inject_meta_files(aosp_path, aosp_version, package_name_list)
+    logging.warning(f"Dropped injected package {package_name} after {failure['class']}: {failure['line']}")
+    return package_name
+
+
+def inject_and_package_images(aosp_path, firmware_id, lunch_target, aosp_version, cookies,
+                              included_package_statistics, package_name_list, post_injection_start_time=None,
+                              partition_headroom_percent=PARTITION_HEADROOM_PERCENT):
+    """
+    Runs the post-build injection into the built target and packs the emulator images.
+
+    :param included_package_statistics: dict - statistics of the injected packages, durations are added.
+    :param package_name_list: list(str) - names of the injected packages.
+    :param post_injection_start_time: float - start of the first post-build injection into this out folder, see
+        write_incremental_build_state.
+    :param partition_headroom_percent: int - free space to leave in every partition when right-sizing.
+    """
+    target_out_path = get_target_out_path(aosp_path, lunch_target)
+    all_extracted_firmware_files_path = os.path.join(EXTRACTED_PACKAGES_PATH, EXTRACTION_ALL_FILES_DIR_NAME)
+    write_incremental_build_state(target_out_path, firmware_id, package_name_list, PRE_INJECTOR_CONFIG,
+                                  post_injection_start_time)
+
+    start_post_build_injector(aosp_path=aosp_path,
+                              source_folder_path=all_extracted_firmware_files_path,
+                              target_out_path=target_out_path,
+                              lunch_target=lunch_target,
+                              firmware_id=firmware_id,
+                              pre_injector_package_list=included_package_statistics["apps"],
+                              pre_injector_config_path=PRE_INJECTOR_CONFIG_PATH,
+                              post_injector_config_path=POST_INJECTOR_CONFIG_PATH,
+                              cookies=cookies,
+                              aosp_version=aosp_version
+                              )
+    logging.info(f"Summary Pre-Injector: {included_package_statistics}")
+    partition_size_report = None
+    if PARTITION_RIGHT_SIZING:
+        with trace_span("right_size_partitions", category="staging") as span:
+            partition_size_report = right_size_partitions_after_injection(aosp_path, aosp_version, target_out_path,
+                                                                          partition_headroom_percent)
+            span["saved_bytes"] = partition_size_report["saved_bytes"]
+    package_build_artefacts_command = get_aosp_repo_build_command(aosp_path, lunch_target, aosp_version)
+    package_start_time = time.time()
+    execute_build_command(aosp_path, firmware_id, package_build_artefacts_command, aosp_path,
+                          trace_name="m image zip")
+    package_end_time = time.time()
+    included_package_statistics["package_build_artefacts_duration"] = round(package_end_time - package_start_time, 2)
+    if partition_size_report:
+        partition_size_report["images"] = get_image_sizes(target_out_path)
+        write_json_output({"hostname": os.uname()[1], "firmware_id": firmware_id, **partition_size_report},
+                          PATH_PARTITION_SIZE_LOG)
+
+
+def has_previous_build(aosp_path, lunch_target, firmware_id):
+    """
+    Checks if out/ and the injected packages hold the last build of the firmware, which a targeted rebuild can be
+    based on.
+    """
+    state = read_incremental_build_state(get_target_out_path(aosp_path, lunch_target))
+    return bool(state) and state.get("firmware_id") == firmware_id \
+        and os.path.isdir(os.path.join(aosp_path, MODULE_BASE_INJECT_DIR))
+
+
+def is_package_staged(package_path, dir_name):
+    """
+    Checks if process_package stages the package with the current pre-injector config.
+    """
+    if not PRE_INJECTOR_CONFIG["ENABLE_INJECTION"]:
+        return False
+    file_name_list = os.listdir(package_path)
+    if is_package_skipped(dir_name, package_path, file_name_list):
+        return False
+    if check_file_extension(package_path, [".so", ".1", ".2", ".3", ".4", ".5", ".6", ".7", ".8", ".9"], file_name_list):
+        return not PRE_INJECTOR_CONFIG["DISABLE_NATIVE_LIBRARY_INJECTION"]
+    return check_file_extension(package_path, [".apex", ".capex", ".apk"], file_name_list)
+
+
+def get_staged_package_statistics(out_dir, package_dir_dict):
+    """
+    Builds the statistics of included packages from the packages staged in out_dir.
+
+    :param out_dir: str - output directory for injected packages.
+    :param package_dir_dict: dict - lower-case package name -> name of the extracted package directory.
+    :returns: dict - statistics of included packages.
+    """
+    included_package_statistics = {"apps": [], "libs": [], "apex": [], "count": 0}
+    for package_name, staged_path_list in get_staged_package_paths(out_dir).items():
+        if package_name not in package_dir_dict:
+            continue
+        kind = os.path.relpath(staged_path_list[0], out_dir).split(os.sep)[0]
+        if kind == "apex" and not PRE_INJECTOR_CONFIG["ALLOW_APEX_REPACKING_IN_PRE_INJECTOR"]:
+            continue
+        included_package_statistics[kind].append(package_dir_dict[package_name])
+    for kind in ["apps", "libs", "apex"]:
+        included_package_statistics[kind] = sorted(included_package_statistics[kind])
+    included_package_statistics["count"] = sum(len(included_package_statistics[kind])
+                                               for kind in ["apps", "libs", "apex"])
+    return included_package_statistics
+
+
+def start_targeted_rebuild(aosp_path, aosp_packages_path, firmware_id, lunch_target, aosp_version, skip_filtering,
+                           cookies, rebuild_package_names):
+    """
+    Rebuilds the last built firmware after a config change or a package fix. out/, the staging partitions and the
+    unchanged injected packages are kept. Only the packages named in rebuild_package_names or whose injection changes
+    with the pre-injector config are restaged and built with mmm, followed by the post-build injection and the
+    packing of the images. Falls back to an incremental build if out/ does not hold the last build of the firmware.
+
+    :param rebuild_package_names: list(str) - names of the extracted packages to restage and rebuild.
+
+    :returns: bool - True if the build process was successful.
+    """
+    if not has_previous_build(aosp_path, lunch_target, firmware_id):
+        logging.warning(f"No previous build of firmware-id {firmware_id} to rebuild from. Running an incremental "
+                        f"build instead.")
+        clear_source_tree(aosp_path, os.path.join(aosp_path, AOSP_PACKAGES_APPS_PATH), aosp_version)
+        return start_aosp_build(aosp_path, aosp_packages_path, firmware_id, lunch_target, aosp_version,
+                                skip_filtering, cookies, incremental_build=True)
+
+    pre_injector_start_time = time.time()
+    target_out_path = get_target_out_path(aosp_path, lunch_target)
+    state = read_incremental_build_state(target_out_path)
+    out_dir = os.path.join(aosp_path, MODULE_BASE_INJECT_DIR)
+    changed_config_keys = get_changed_config_keys(state.get("pre_injector_config", {}), PRE_INJECTOR_CONFIG)
+    logging.info(f"Targeted rebuild of firmware-id {firmware_id}. Changed pre-injector config keys: "
+                 f"{changed_config_keys}")
+    move_txt_files(EXTRACTED_PACKAGES_PATH, BUILD_OUT_PATH)
+    package_dir_dict = {dir_name.lower(): dir_name for dir_name in os.listdir(EXTRACTED_PACKAGES_PATH)
+                        if os.path.isdir(os.path.join(EXTRACTED_PACKAGES_PATH, dir_name))}
+    unknown_package_names = [package_name for package_name in rebuild_package_names
+                             if package_name.lower() not in package_dir_dict]
+    if unknown_package_names:
+        logging.warning(f"Targeted rebuild: no extracted packages named {unknown_package_names}")
+
+    with trace_span("targeted_restaging", category="staging") as span:
+        staged_package_dict = get_staged_package_paths(out_dir)
+        selected_package_names = {package_name for package_name, dir_name in package_dir_dict.items()
+                                  if is_package_staged(os.path.join(EXTRACTED_PACKAGES_PATH, dir_name), dir_name)}
+        changed_package_names = (selected_package_names ^ set(staged_package_dict)) \
+            | {package_name.lower() for package_name in rebuild_package_names}
+        invalidated_count = invalidate_staged_packages(
+            aosp_path, target_out_path,
+            [staged_path for package_name in changed_package_names
+             for staged_path in staged_package_dict.get(package_name, [])])
+        restaged_package_names = sorted(changed_package_names & selected_package_names)
+        restaging_statistics = {"apps": [], "libs": [], "apex": [], "count": 0, "skipped_apps": [], "skipped_libs": [], "skipped_apex": []}
+        for package_name in restaged_package_names:
+            dir_name = package_dir_dict[package_name]
+            process_package(os.path.join(EXTRACTED_PACKAGES_PATH, dir_name), dir_name, aosp_path, out_dir,
+                            restaging_statistics, lunch_target, aosp_version)
+        span["restaged"] = len(restaged_package_names)
+        span["removed"] = len(changed_package_names - selected_package_names)
+        span["invalidated"] = invalidated_count
+
+    included_package_statistics = get_staged_package_statistics(out_dir, package_dir_dict)
+    package_name_list = included_package_statistics["apps"] + included_package_statistics["libs"] \
+        + included_package_statistics["apex"]
+    inject_meta_files(aosp_path, aosp_version, package_name_list)
+    result = {
+        "hostname": os.uname()[1],
+        "firmware_id": firmware_id,
+        "included_package_statistics": included_package_statistics,
+        "pre_injector_duration": round(time.time() - pre_injector_start_time, 2),
+        "targeted_rebuild": {
+            "changed_config_keys": changed_config_keys,
+            "restaged_packages": [package_dir_dict[package_name] for package_name in restaged_package_names],
+            "removed_packages": sorted(package_dir_dict.get(package_name, package_name)
+                                       for package_name in changed_package_names - selected_package_names),
+            "invalidated_outputs": invalidated_count,
+        },
+    }
+    logging.info(json.dumps(result, indent=4))
+    write_json_output(result, PATH_BUILD_INJECTOR_LOG)
+
+    try:
+        build_start_time = time.time()
+        restaged_path_list = [os.path.relpath(staged_path, aosp_path)
+                              for package_name, staged_path_list in get_staged_package_paths(out_dir).items()
+                              if package_name in restaged_package_names for staged_path in staged_path_list]
+        if restaged_path_list:
+            execute_build_command(aosp_path, firmware_id,
+                                  get_targeted_build_command(aosp_path, lunch_target, restaged_path_list), aosp_path,
+                                  trace_name="mmm")
+        included_package_statistics["main_build_duration"] = round(time.time() - build_start_time, 2)
+        remove_packed_images(target_out_path)
+        inject_and_package_images(aosp_path, firmware_id, lunch_target, aosp_version, cookies,
+                                  included_package_statistics, package_name_list,
+                                  state.get("post_injection_start_time"))
+    except Exception as err:
+        logging.error(err)
+        return False
+    return True
+
+
 def get_target_out_path(aosp_path, lunch_target):
     """
     Returns the target out path based on the lunch target.
@@ -155,13 +458,13 @@ def get_target_out_path(aosp_path, lunch_target):
 
     """
     if lunch_target == SUPPORTED_LUNCH_TARGETS[0]:
-        return os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_x86_64_PATH)
+        return os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_x86_64_PATH))
     elif lunch_target == SUPPORTED_LUNCH_TARGETS[1]:
-        return os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH)
+        return os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH))
     elif lunch_target == SUPPORTED_LUNCH_TARGETS[2]:
-        return os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH)
+        return os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH))
     elif lunch_target == SUPPORTED_LUNCH_TARGETS[3]:
-        return os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH_A14)
+        return os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH_A14))
     else:
         logging.error(f"Unknown lunch target: {lunch_target}")
         raise RuntimeError(f"Unsupported build architecture: {lunch_target}")
@@ -181,17 +484,17 @@ def get_emulator_image_path(aosp_path, lunch_target, aosp_version):
     is_phone_64 = "phone64" in lunch_target
     if aosp_version in ["11", "12"]:
         if is_phone_64:
-            image_source_path = os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH, AOSP_EMU_ZIP_FILENAME_A12_A13)
+            image_source_path = os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH), AOSP_EMU_ZIP_FILENAME_A12_A13)
         else:
             if aosp_version == "11":
-                image_source_path = os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH,
+                image_source_path = os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH),
                                                  AOSP_EMU_ZIP_FILENAME_A11)
             else:
-                image_source_path = os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH, AOSP_EMU_ZIP_FILENAME_A12_A13)
+                image_source_path = os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_PATH), AOSP_EMU_ZIP_FILENAME_A12_A13)
     elif aosp_version == "13":
-        image_source_path = os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH, AOSP_EMU_ZIP_FILENAME_A12_A13)
+        image_source_path = os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH), AOSP_EMU_ZIP_FILENAME_A12_A13)
     elif aosp_version in ["14", "15"]:
-        image_source_path = os.path.join(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH_A14, AOSP_EMU_ZIP_FILENAME)
+        image_source_path = os.path.join(get_aosp_out_path(aosp_path, AOSP_BUILD_OUT_SDK_ARM64_x64_PATH_A14), AOSP_EMU_ZIP_FILENAME)
 
     if not os.path.exists(image_source_path):
         raise RuntimeError(f"Could not find image zip file: {image_source_path}. Something went wrong.")
@@ -277,9 +580,7 @@ def render_template(template_folder_abs_path, base_filename, package_name_list):
     :returns: str - rendered template.
     """
     logging.debug(f"Using template folder: {template_folder_abs_path} with base filename: {base_filename}")
-    environment = Environment(loader=FileSystemLoader(str(template_folder_abs_path)))
-    template = environment.get_template(base_filename)
-    return template.render(package_name_list=package_name_list)
+    return render_template_file(template_folder_abs_path, base_filename, package_name_list=package_name_list)
 
 def get_template_folder_path():
     config_path = PRE_INJECTOR_CONFIG["PRE_INJECTOR_CONFIG_PATH"]
@@ -296,17 +597,17 @@ def get_template_folder_path():
 
 def write_and_copy_file(content, out_file_path, aosp_base_file_path):
     """
-    Writes the rendered aosp build file to the out_file_path and copies it to the aosp source code.
+    Writes the rendered aosp build file to the out_file_path and to the aosp source code. Files that already hold the
+    content are not rewritten, so their mtime does not trigger a regeneration of the build.
 
     :param content: str - rendered aosp build file template to be written to file.
     :param out_file_path: str - path to write the rendered aosp build file to.
     :param aosp_base_file_path: str - path to the aosp base file to copy the rendered file to.
 
     """
-    with open(out_file_path, mode="w", encoding="utf-8") as out_file:
-        out_file.write(content)
-    shutil.copyfile(out_file_path, aosp_base_file_path)
-    logging.debug(f"Placed {os.path.basename(out_file_path)} {aosp_base_file_path} in aosp source")
+    write_file_if_changed(out_file_path, content)
+    if write_file_if_changed(aosp_base_file_path, content):
+        logging.debug(f"Placed {os.path.basename(out_file_path)} {aosp_base_file_path} in aosp source")
 
 
 def delete_directory_if_exists(directory_path):
@@ -342,7 +643,7 @@ def get_directory_size(directory_path):
 
 def get_minimal_partition_size(aosp_path, aosp_packages_path):
     """
-    Calculates the minimal partition size based on the size of the packages to inject.
+    Calculates the minimal partition size in 64 GB steps based on the size of the packages to inject.
 
     :param aosp_path: str - path to the root of the aosp source code.
     :param aosp_packages_path: str - path to the prebuilt package folder of aosp.
@@ -352,48 +653,30 @@ def get_minimal_partition_size(aosp_path, aosp_packages_path):
     """
     packages_abs_path = os.path.join(aosp_path, aosp_packages_path)
     approximate_size = get_directory_size(packages_abs_path)
-    default_size = 4294967296  # 4GB
-    additional_gb_in_bytes = 1073741824 * 64  # 64GB
-    twenty_gb_in_bytes = 1073741824 * 10  # 10GB
-    while default_size < (approximate_size + twenty_gb_in_bytes):
-        default_size += additional_gb_in_bytes
-        logging.debug(f"Increasing partition size to: {default_size} Approximate bytes of packages "
-                      f"to inject is: {approximate_size}")
-    return default_size
+    minimal_partition_size = get_fixed_step_partition_size(approximate_size)
+    logging.debug(f"Partition size: {minimal_partition_size} Approximate bytes of packages to inject is: "
+                  f"{approximate_size}")
+    return minimal_partition_size
 
 
-def overwrite_partition_size(aosp_path, aosp_packages_path, aosp_version):
+def overwrite_partition_size(aosp_path, aosp_packages_path, aosp_version, headroom_percent=PARTITION_HEADROOM_PERCENT):
     """
-    Overwrites the partition size in the aosp source code.
+    Overwrites the partition size in the aosp source code. With FMD_PARTITION_RIGHT_SIZING the partitions are sized
+    from the extracted firmware files, otherwise in 64 GB steps.
 
     :param aosp_path: str - path to the root of the aosp source code.
     :param aosp_packages_path: str - path to the prebuilt package folder of aosp.
+    :param aosp_version: str - version of the aosp build.
+    :param headroom_percent: int - free space to leave in every partition with FMD_PARTITION_RIGHT_SIZING.
 
     """
-    minimal_partition_size = get_minimal_partition_size(aosp_path, aosp_packages_path)
-    super_partition_size = minimal_partition_size + 8388608  # 8MB
-    dynamic_partition_size = minimal_partition_size
-    if aosp_version and int(aosp_version) >= 14:
-        board_config_file_path = os.path.join(aosp_path, "build/make/target/board/BoardConfigGsiCommon.mk")
-        with open(board_config_file_path, 'r') as base_file:
-            lines = base_file.readlines()
-        for i, line in enumerate(lines):
-            if "BOARD_SUPER_PARTITION_SIZE" in line:
-                lines[i] = f"  BOARD_SUPER_PARTITION_SIZE := {super_partition_size}\n"
-            if "BOARD_GSI_DYNAMIC_PARTITIONS_SIZE" in line:
-                lines[i] = f"  BOARD_GSI_DYNAMIC_PARTITIONS_SIZE := {dynamic_partition_size}\n"
+    if PARTITION_RIGHT_SIZING:
+        right_size_partitions_before_build(aosp_path, aosp_version,
+                                           os.path.join(EXTRACTED_PACKAGES_PATH, EXTRACTION_ALL_FILES_DIR_NAME),
+                                           headroom_percent)
     else:
-        board_config_file_path = os.path.join(aosp_path, "build/make/target/board/BoardConfigEmuCommon.mk")
-        logging.debug(f"Overwriting partition size to: {minimal_partition_size} in {board_config_file_path}")
-        with open(board_config_file_path, 'r') as base_file:
-            lines = base_file.readlines()
-        for i, line in enumerate(lines):
-            if "BOARD_SUPER_PARTITION_SIZE" in line:
-                lines[i] = f"  BOARD_SUPER_PARTITION_SIZE := {super_partition_size}\n"
-            if "BOARD_EMULATOR_DYNAMIC_PARTITIONS_SIZE" in line:
-                lines[i] = f"  BOARD_EMULATOR_DYNAMIC_PARTITIONS_SIZE := {dynamic_partition_size}\n"
-        with open(board_config_file_path, 'w') as base_file:
-            base_file.writelines(lines)
+        write_board_partition_sizes(aosp_path, aosp_version,
+                                    get_minimal_partition_size(aosp_path, aosp_packages_path))
 
 
 def move_txt_files(source_directory, destination_directory):
@@ -413,8 +696,10 @@ def move_txt_files(source_directory, destination_directory):
             shutil.copy2(source_file, destination_file, follow_symlinks=False)
 
 
-def check_file_extension(directory, file_extension_list):
-    for filename in os.listdir(directory):
+def check_file_extension(directory, file_extension_list, file_name_list=None):
+    if file_name_list is None:
+        file_name_list = os.listdir(directory)
+    for filename in file_name_list:
         file_extension = os.path.splitext(filename)[1]
         if file_extension in file_extension_list:
             return True
@@ -435,9 +720,30 @@ def get_apex_file(directory_path):
     return None
 
 
+def scan_package(package_path):
+    """
+    Walks a package folder once.
+
+    :param package_path: str - path to the package directory.
+
+    :returns: tuple - (list(str), int) - names in the package directory, size of the package in bytes.
+    """
+    file_name_list = []
+    package_size = 0
+    for dirpath, dirnames, filenames in os.walk(package_path):
+        if dirpath == package_path:
+            file_name_list = dirnames + filenames
+        for f in filenames:
+            fp = os.path.join(dirpath, f)
+            if not os.path.islink(fp):
+                package_size += os.path.getsize(fp)
+    return file_name_list, package_size
+
+
 def move_packages_to_aosp(aosp_path, extracted_packages_path, lunch_target, aosp_version):
     """
-    Moves the prebuilt packages to the AOSP source code.
+    Moves the prebuilt packages to the AOSP source code. The packages are staged concurrently by
+    FMD_STAGING_WORKERS threads.
 
     :param extracted_packages_path: str - path to the extracted packages.
     :param aosp_path: str - path to AOSP root folder.
@@ -445,25 +751,63 @@ def move_packages_to_aosp(aosp_path, extracted_packages_path, lunch_target, aosp
 
     :returns: dict - statistics of included packages.
     """
+    start_time = time.time()
     out_dir = os.path.join(aosp_path, MODULE_BASE_INJECT_DIR)
     os.makedirs(out_dir, exist_ok=True)
     included_package_statistics = {"apps": [], "libs": [], "apex": [], "count": 0, "skipped_apps": [], "skipped_libs": [], "skipped_apex": []}
-    for dir_name in os.listdir(extracted_packages_path):
-        package_path = os.path.join(extracted_packages_path, dir_name)
-        if os.path.isdir(package_path):
-            included_package_statistics = process_package(package_path, dir_name, aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version)
+    dir_name_list = [dir_name for dir_name in os.listdir(extracted_packages_path)
+                     if os.path.isdir(os.path.join(extracted_packages_path, dir_name))]
+    with ThreadPoolExecutor(max_workers=STAGING_WORKERS or None) as executor:
+        future_list = [executor.submit(stage_package, os.path.join(extracted_packages_path, dir_name), dir_name,
+                                       aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version)
+                       for dir_name in dir_name_list]
+        package_timing_list = [future.result() for future in future_list]
+    log_staging_summary(package_timing_list, time.time() - start_time)
 
     included_package_statistics["count"] = len(included_package_statistics["apps"]) + \
                                            len(included_package_statistics["libs"]) + \
                                            len(included_package_statistics["apex"])
-    included_package_statistics["apps"] = sorted(included_package_statistics["apps"])
-    included_package_statistics["libs"] = sorted(included_package_statistics["libs"])
-    included_package_statistics["apex"] = sorted(included_package_statistics["apex"])
+    for statistic_name in ["apps", "libs", "apex", "skipped_apps", "skipped_libs", "skipped_apex"]:
+        included_package_statistics[statistic_name] = sorted(included_package_statistics[statistic_name])
     logging.info(f"Included package statistics: {included_package_statistics}")
     return included_package_statistics
 
 
-def process_package(package_path, dir_name, aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version):
+def stage_package(package_path, dir_name, aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version):
+    """
+    Thread pool routine: stages a single package, see process_package.
+
+    :returns: tuple - (str, int, float) - name of the package, size in bytes, staging duration in seconds.
+    """
+    start_time = time.time()
+    file_name_list, package_size = scan_package(package_path)
+    with trace_span("stage_package", category="staging", package=dir_name, bytes=package_size):
+        process_package(package_path, dir_name, aosp_path, out_dir, included_package_statistics, lunch_target,
+                        aosp_version, file_name_list)
+    duration = time.time() - start_time
+    logging.debug(f"Staged package {dir_name} ({package_size} bytes) in {duration:.3f} seconds.")
+    return dir_name, package_size, duration
+
+
+def log_staging_summary(package_timing_list, duration, slowest_count=10):
+    """
+    Logs the number, size and staging time of the packages and the slowest packages.
+
+    :param package_timing_list: list(tuple) - (name, size in bytes, duration in seconds) per package.
+    :param duration: float - wall time of the staging in seconds.
+    :param slowest_count: int - number of slowest packages to list.
+    """
+    total_size = sum(package_timing[1] for package_timing in package_timing_list)
+    total_package_duration = sum(package_timing[2] for package_timing in package_timing_list)
+    logging.info(f"Staged {len(package_timing_list)} packages ({total_size / 1024 ** 2:.1f} MiB) in "
+                 f"{duration:.2f} seconds, {total_package_duration:.2f} seconds summed over all packages.")
+    slowest_list = sorted(package_timing_list, key=lambda package_timing: package_timing[2], reverse=True)
+    for dir_name, package_size, package_duration in slowest_list[:slowest_count]:
+        logging.info(f"Staging time {package_duration:8.3f} s | {package_size / 1024 ** 2:9.2f} MiB | {dir_name}")
+
+
+def process_package(package_path, dir_name, aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version,
+                    file_name_list=None):
     """
     Processes a single package directory and moves it to the appropriate location.
 
@@ -473,20 +817,23 @@ def process_package(package_path, dir_name, aosp_path, out_dir, included_package
     :param out_dir: str - output directory for injected packages.
     :param included_package_statistics: dict - statistics of included packages.
     :param lunch_target: str - AOSP build argument to select the build arch.
+    :param file_name_list: list(str) - names in the package directory, listed if not given.
     """
+    if file_name_list is None:
+        file_name_list = os.listdir(package_path)
     uuid_dir = str(uuid.uuid4())
-    if is_package_skipped(dir_name, package_path):
+    if is_package_skipped(dir_name, package_path, file_name_list):
         logging.info(f"Skipping package: {dir_name}")
-        included_package_statistics["skipped_apps" if check_file_extension(package_path, [".apk"]) else
-                                    "skipped_libs" if check_file_extension(package_path, [".so", ".1", ".2", ".3", ".4", ".5", ".6", ".7", ".8", ".9"]) else
+        included_package_statistics["skipped_apps" if check_file_extension(package_path, [".apk"], file_name_list) else
+                                    "skipped_libs" if check_file_extension(package_path, [".so", ".1", ".2", ".3", ".4", ".5", ".6", ".7", ".8", ".9"], file_name_list) else
                                     "skipped_apex"].append(dir_name)
         return included_package_statistics
 
-    if check_file_extension(package_path, [".so", ".1", ".2", ".3", ".4", ".5", ".6", ".7", ".8", ".9"]):
+    if check_file_extension(package_path, [".so", ".1", ".2", ".3", ".4", ".5", ".6", ".7", ".8", ".9"], file_name_list):
         included_package_statistics = handle_library_package(package_path, dir_name, uuid_dir, aosp_path, out_dir, included_package_statistics)
-    elif check_file_extension(package_path, [".apex", ".capex"]):
+    elif check_file_extension(package_path, [".apex", ".capex"], file_name_list):
         included_package_statistics = handle_apex_package(package_path, dir_name, uuid_dir, aosp_path, out_dir, included_package_statistics, lunch_target, aosp_version)
-    elif check_file_extension(package_path, [".apk"]):
+    elif check_file_extension(package_path, [".apk"], file_name_list):
         included_package_statistics = handle_app_package(package_path, dir_name, uuid_dir, out_dir, included_package_statistics)
     else:
         logging.error(f"Skipping package: {dir_name} as it does not match any known file type.")
@@ -504,18 +851,19 @@ def clean_package_name(package_name):
     """
     return package_name.replace("\\", "").replace("_FMD_APEX", "").replace("_fmd", "").strip()
 
-def is_package_skipped(dir_name, package_path):
+def is_package_skipped(dir_name, package_path, file_name_list=None):
     """
     Checks if a package should be skipped based on its name.
 
     :param dir_name: str - name of the package directory.
+    :param file_name_list: list(str) - names in the package directory, listed if not given.
 
     :returns: bool - True if the package should be skipped, False otherwise.
     """
     dir_name_cleaned = clean_package_name(dir_name)
     if dir_name_cleaned in SKIPPED_MODULE_NAMES or any(keyword in dir_name_cleaned for keyword in PRE_INJECTOR_CONFIG["BLACKLISTED_KEYWORDS"]):
         return True
-    elif check_file_extension(package_path, [".apk"]):
+    elif check_file_extension(package_path, [".apk"], file_name_list):
         if not "_FMD_APEX" in dir_name:
             if any(keyword in dir_name_cleaned for keyword in PRE_INJECTOR_CONFIG["ALLOW_APP_KEYWORD_ALWAYS_LIST"]):
                 logging.info(f"Injecting APK package due to always allow keyword: {dir_name_cleaned}")
@@ -544,6 +892,16 @@ def is_package_skipped(dir_name, package_path):
     return False
 
 
+def copy_package_tree(package_path, destination_path):
+    """
+    Copies a package folder. With FMD_STAGING_LINK_FILES the files are hardlinked or cloned instead of copied.
+    """
+    if STAGING_LINK_FILES:
+        copy_tree_linked(package_path, destination_path)
+    else:
+        shutil.copytree(package_path, destination_path, dirs_exist_ok=True)
+
+
 def handle_library_package(package_path, dir_name, uuid_dir, aosp_path, out_dir, included_package_statistics):
     """
     Handles the injection of library packages.
@@ -558,7 +916,7 @@ def handle_library_package(package_path, dir_name, uuid_dir, aosp_path, out_dir,
     if not PRE_INJECTOR_CONFIG["DISABLE_NATIVE_LIBRARY_INJECTION"]:
         framework_lib_path = os.path.join(aosp_path, f"{out_dir}libs/", f"{dir_name}_{uuid_dir}")
         logging.debug(f"Copying library package: {package_path} to {framework_lib_path}")
-        shutil.copytree(package_path, framework_lib_path, dirs_exist_ok=True)
+        copy_package_tree(package_path, framework_lib_path)
         included_package_statistics["libs"].append(dir_name)
     else:
         logging.debug(f"Native library injection disabled for package: {dir_name}")
@@ -583,7 +941,8 @@ def handle_apex_package(package_path, dir_name, uuid_dir, aosp_path, out_dir, in
     logging.debug(f"Copying APEX package: {package_path} to {modules_path}")
     shutil.copytree(package_path, modules_path, dirs_exist_ok=True)
     if PRE_INJECTOR_CONFIG["ALLOW_APEX_REPACKING_IN_PRE_INJECTOR"]:
-        is_success, log_message = repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version)
+        with apex_repackaging_lock:
+            is_success, log_message = repackage_apex_file(aosp_path, apex_file_path, lunch_target, aosp_version)
         if is_success:
             logging.debug(f"Repackaged APEX package: {apex_file_path} successfully.")
             included_package_statistics["apex"].append(dir_name)
@@ -605,7 +964,7 @@ def handle_app_package(package_path, dir_name, uuid_dir, out_dir, included_packa
     """
     app_modules_path = os.path.join(out_dir, "apps", f"{dir_name}_{uuid_dir}")
     logging.debug(f"Moving app package: {dir_name} from {package_path} to {app_modules_path}")
-    shutil.copytree(package_path, app_modules_path, dirs_exist_ok=True)
+    copy_package_tree(package_path, app_modules_path)
     included_package_statistics["apps"].append(dir_name)
     return included_package_statistics
 
@@ -628,10 +987,11 @@ def inject_meta_files(aosp_path, aosp_version, package_name_list):
             if meta_build_filename == META_BUILD_SYSTEM_FILENAME:
                 raise RuntimeError(f"Could not find file: {meta_build_filename} from {meta_build_path}. Somethings wrong.")
         base_filename = get_base_filename(meta_build_filename)
-        content = read_and_render_template(meta_build_path, base_filename, aosp_version, package_name_list)
-        aosp_base_file_path = os.path.join(aosp_path, BASE_PATH, base_filename)
-        out_file_path = os.path.join(BUILD_OUT_PATH, base_filename)
-        write_and_copy_file(content, out_file_path, aosp_base_file_path)
+        with trace_span("render_template", category="staging", template=base_filename):
+            content = read_and_render_template(meta_build_path, base_filename, aosp_version, package_name_list)
+            aosp_base_file_path = os.path.join(aosp_path, BASE_PATH, base_filename)
+            out_file_path = os.path.join(BUILD_OUT_PATH, base_filename)
+            write_and_copy_file(content, out_file_path, aosp_base_file_path)
         if not os.path.exists(aosp_base_file_path):
             raise RuntimeError(f"AOSP build file does not exist: {aosp_base_file_path}. Something went wrong injecting "
                                f"the packages into the aosp source code.")
@@ -653,33 +1013,51 @@ def get_aosp_build_command(lunch_target, aosp_version, aosp_root):
     if lunch_target not in SUPPORTED_LUNCH_TARGETS:
         raise RuntimeError("Unsupported build CPU architecture specified.")
 
+    make_command = get_make_command()
     if aosp_version in ["11", "12"]:
         command = f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
                   f"&& lunch {lunch_target} " \
-                  "&& m " \
-                  "&& m sdk'"
+                  f"&& {make_command} " \
+                  f"&& {make_command} sdk'"
     else:
         command = f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
                   f"&& lunch {lunch_target} " \
-                  "&& m '"
+                  f"&& {make_command} '"
     return command
 
 
+def get_targeted_build_command(aosp_root, lunch_target, module_path_list):
+    """
+    Creates the build command that builds only the modules in the given folders.
+
+    :param aosp_root: str - path to aosp root folder.
+    :param lunch_target: str - aosp build argument to select the build arch.
+    :param module_path_list: list(str) - module folders relative to the aosp root.
+
+    :returns: str - aosp build command.
+    """
+    jobs_argument = f" -j{BUILD_JOBS}" if BUILD_JOBS > 0 else ""
+    return f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
+           f"&& lunch {lunch_target} " \
+           f"&& mmm {' '.join(module_path_list)}{jobs_argument}'"
+
+
 def get_aosp_repo_build_command(aosp_root, lunch_target, aosp_version):
+    make_command = get_make_command()
     if aosp_version in ["11"]:
         command = f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
                   f"&& lunch {lunch_target} " \
-                  "&& m sdk_repo " \
-                  "&& m dist'"
+                  f"&& {make_command} sdk_repo " \
+                  f"&& {make_command} dist'"
     elif aosp_version in ["12"]:
         command = f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
                   f"&& lunch {lunch_target} " \
-                  "&& m sdk_repo " \
-                  "&& m emu_img_zip'"
+                  f"&& {make_command} sdk_repo " \
+                  f"&& {make_command} emu_img_zip'"
     else:
         command = f"bash -c 'cd {aosp_root} && source {aosp_root}/build/envsetup.sh " \
                   f"&& lunch {lunch_target} " \
-                  "&& m emu_img_zip'"
+                  f"&& {make_command} emu_img_zip'"
     return command
 
 
@@ -704,7 +1082,7 @@ def get_rebuild_jar_modules_command(aosp_root, lunch_target, included_package_na
     return command_list
 
 
-def execute_build_command(firmware_id, lunch_target, command, aosp_root_path):
+def execute_build_command(firmware_id, lunch_target, command, aosp_root_path, trace_name="m"):
     """
     Start the aosp build process. Pack all Android images with ("m emu_img_zip"). Copy the artefacts to the
     local image folder.
@@ -713,10 +1091,10 @@ def execute_build_command(firmware_id, lunch_target, command, aosp_root_path):
     :param firmware_id: str - object-id of the firmware
     :param command: str - aosp build command to execute.
     :param aosp_root_path: str - root path of the AOSP source code.
+    :param trace_name: str - name of the build step in the trace.
 
+    :raises BuildFailureError: if the command fails or its output matches a fatal build pattern, see build_failure.
     """
-    current_directory = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(aosp_root_path)
     try:
         firmware_id = re.sub(r'\W+', '', firmware_id)
         lunch_target = re.sub(r'\W+', '', lunch_target)
@@ -725,12 +1103,23 @@ def execute_build_command(firmware_id, lunch_target, command, aosp_root_path):
         log_path = os.path.join(BUILD_OUT_PATH, log_name)
         logging.info(f"Executing command: {command}")
         logging.info(f"Build logs will be written to: {log_path}")
-        with open(log_path, "w") as outfile:
-            subprocess.run(command, shell=True, check=True, stdout=outfile, stderr=outfile)
+        stats_log_path = log_path + ".ccache-stats"
+        build_cache_environment = get_build_cache_environment(aosp_root_path, stats_log_path)
+        counters_before = read_ccache_counters()
+        with trace_span(trace_name, category="subprocess", command=command, log_path=log_path) as span:
+            returncode, failure = run_build_command_streamed(command, aosp_root_path, log_path,
+                                                             env=dict(os.environ, **build_cache_environment))
+            span["returncode"] = returncode
+            if build_cache_environment:
+                span["build_cache"] = record_build_cache_statistics(counters_before, stats_log_path)
+            if failure:
+                span["failure_class"] = failure["class"]
+        if failure:
+            record_build_failure(failure, trace_name)
+            raise BuildFailureError(returncode, command, failure)
     except subprocess.CalledProcessError as err:
         logging.error(f"Got an error building firmware: {err}")
         raise err
-    os.chdir(current_directory)
 
 
 def delete_unlisted_directories(directory_path, directory_names):
@@ -781,12 +1170,8 @@ def clear_base_files(aosp_path, aosp_version):
             logging.debug(f"Clearing base file: {base_filename} for version {aosp_version}")
             aosp_base_file_path = os.path.join(aosp_path, BASE_PATH, base_filename)
             if os.path.exists(aosp_base_file_path):
-                template_folder_abs_path = get_template_folder_path()
-                environment = Environment(loader=FileSystemLoader(str(template_folder_abs_path)))
-                template = environment.get_template(base_filename)
-                base_file_content = template.render(package_name_list=[])
-                with open(aosp_base_file_path, 'w') as base_file:
-                    base_file.write(base_file_content)
+                base_file_content = render_template(get_template_folder_path(), base_filename, [])
+                write_file_if_changed(aosp_base_file_path, base_file_content)
             else:
                 logging.warning(f"Could not find base file in template folder: {aosp_base_file_path}")
     except Exception as err:
@@ -820,7 +1205,7 @@ def clear_extracted_packages():
 def reset_post_injection_files(aosp_path):
     # TODO: Implement reset of post injection files
     build_image_file_path = os.path.join(aosp_path, "build/make/tools/releasetools/build_image.py")
-    template_goldfish_mk_path = os.path.join(TEMPLATE_FOLDER, "goldfish_tools/Android.mk")
+    template_goldfish_mk_path = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "goldfish_tools/Android.mk")
     logging.info(f"Resetting post injection files for {build_image_file_path} with {template_goldfish_mk_path}")
     try:
         shutil.copyfile(build_image_file_path, template_goldfish_mk_path)
@@ -830,28 +1215,90 @@ def reset_post_injection_files(aosp_path):
 
 def replace_build_image_file(aosp_path):
     build_image_file_path = os.path.join(aosp_path, "build/make/tools/releasetools/build_image.py")
-    template_build_image_path = os.path.join(TEMPLATE_FOLDER, "build_image.py")
+    template_build_image_path = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "build_image.py")
     logging.info(f"Restore build image file {build_image_file_path} with {template_build_image_path}")
     try:
         shutil.copyfile(template_build_image_path, build_image_file_path)
     except Exception as err:
         logging.error(err)
 
-def clear_environment(aosp_path, aosp_packages_apps_path, aosp_version):
+def clear_staged_packages(aosp_path, aosp_packages_apps_path):
     """
-    Reverts the build environment
-    Returns:
+    Removes the packages staged for the previous firmware. Between firmwares they are kept together with the base
+    files listing them, so the environment build of the next firmware sees a consistent and unchanged product config,
+    and are only removed right before the packages of the next firmware are staged. inject_meta_files then only
+    rewrites the base files whose package list changed.
 
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param aosp_packages_apps_path: str - path to the prebuilt package folder of aosp.
     """
-    logging.debug("Clearing injection environment...")
     clear_packages(aosp_packages_apps_path)
     clear_intermediate_files(aosp_path)
-    clear_extracted_packages()
-    clear_base_files(aosp_path, aosp_version)
+
+
+def clear_source_tree(aosp_path, aosp_packages_apps_path, aosp_version, keep_injection=False):
+    """
+    Reverts the injected files of the aosp source tree.
+
+    :param keep_injection: bool - keep the staged packages and the base files of a successful firmware for the next
+        firmware, see clear_staged_packages.
+    """
+    if not keep_injection:
+        clear_staged_packages(aosp_path, aosp_packages_apps_path)
+        clear_base_files(aosp_path, aosp_version)
     if aosp_version and int(aosp_version) == 12:
         replace_build_image_file(aosp_path)
 
 
+def acquire_source_tree(args):
+    """
+    Returns the aosp tree to inject and build the next firmware from. With source overlays this is the merged view of
+    a fresh copy-on-write layer over the checkout, otherwise the checkout itself.
+
+    :param args: argparse.Namespace - command line arguments.
+
+    :returns: str - path to the aosp tree.
+
+    """
+    if not args.source_overlay:
+        return args.aosp_path
+    aosp_build_path = mount_source_overlay(args.aosp_path, SOURCE_OVERLAY_DIR)
+    if aosp_build_path is None:
+        raise RuntimeError(f"Could not mount source overlay over {args.aosp_path}")
+    return aosp_build_path
+
+
+def release_source_tree(args, aosp_build_path, aosp_version, keep_injection=False):
+    """
+    Reverts the build environment after a firmware. With source overlays the layer is unmounted and discarded,
+    otherwise the injected files are removed from the checkout.
+
+    :param args: argparse.Namespace - command line arguments.
+    :param aosp_build_path: str - path to the aosp tree returned by acquire_source_tree.
+    :param aosp_version: str - Android (AOSP) version
+    :param keep_injection: bool - keep the staged packages and base files for the next firmware.
+
+    """
+    if args.source_overlay:
+        unmount_source_overlay(SOURCE_OVERLAY_DIR)
+        clear_extracted_packages()
+    else:
+        with source_tree_lock(aosp_build_path):
+            clear_environment(aosp_build_path, os.path.join(aosp_build_path, AOSP_PACKAGES_APPS_PATH), aosp_version,
+                              keep_injection)
+
+
+def clear_environment(aosp_path, aosp_packages_apps_path, aosp_version, keep_injection=False):
+    """
+    Reverts the build environment
+    Returns:
+
+    """
+    logging.debug("Clearing injection environment...")
+    clear_source_tree(aosp_path, aosp_packages_apps_path, aosp_version, keep_injection)
+    clear_extracted_packages()
+
+
 def fetch_build_files(firmware_id, cookies, fmd_url, extract_destination_folder):
     """
     Main wrapper routine to download and extract firmware build files for aosp.
@@ -859,7 +1306,9 @@ def fetch_build_files(firmware_id, cookies, fmd_url, extract_destination_folder)
         firmware_id: str - id of the firmware packages to fetch.
         cookies: cookie jar for requests.
         fmd_url: str - url to the main fmd backend
-        extract_destination_folder: str - path to extract the app packages to.
+        extract_destination_folder: str - folder to download the build files to. They are extracted into its
+            PACKAGE_EXTRACTION_DIR_NAME subfolder while they are downloaded. The archive itself is only written
+            with FMD_KEEP_BUILD_FILES_ARCHIVE=True.
 
     """
     logging.debug(f"Process firmware: {firmware_id}")
@@ -868,14 +1317,21 @@ def fetch_build_files(firmware_id, cookies, fmd_url, extract_destination_folder)
     while not is_successful and max_attempts > 0:
         try:
             max_attempts -= 1
-            zip_file_path = download_firmware_build_files(fmd_url,
-                                                          firmware_id,
-                                                          cookies,
-                                                          extract_destination_folder)
-            tmp_path = os.path.join(BUILD_OUT_PATH, PACKAGE_EXTRACTION_DIR_NAME)
-            os.makedirs(tmp_path, exist_ok=True)
-            extract_zip(zip_file_path, tmp_path)
-            os.remove(zip_file_path)
+            tmp_path = os.path.join(extract_destination_folder, PACKAGE_EXTRACTION_DIR_NAME)
+            stream_extractor = StreamingZipExtractor(tmp_path)
+            with trace_span("fetch_build_files", category="fetch", firmware_id=firmware_id) as span:
+                zip_file_path = download_firmware_build_files(fmd_url,
+                                                              firmware_id,
+                                                              cookies,
+                                                              extract_destination_folder,
+                                                              stream_extractor=stream_extractor,
+                                                              keep_archive=KEEP_BUILD_FILES_ARCHIVE)
+                extracted_count = stream_extractor.close()
+                span["bytes"] = stream_extractor.offset
+                span["entries"] = extracted_count
+            logging.info(f"Extracted {extracted_count} entries of the firmware build files to {tmp_path}")
+            if KEEP_BUILD_FILES_ARCHIVE:
+                logging.info(f"Kept firmware build files archive: {zip_file_path}")
             is_successful = True
         except Exception as err:
             logging.error(f"Error fetching firmware build files: {err}")
@@ -910,6 +1366,26 @@ def parse_arguments():
                         help='If set, the aosp build environment will be reset.')
     parser.add_argument("-c", "--skip-clean", action='store_true', default=False,
                         help='If set, skips the cleanup of the aosp build environment.')
+    parser.add_argument("-b", "--incremental-build", action='store_true', default=INCREMENTAL_BUILD,
+                        help='If set, out/ is kept between firmware builds and only the outputs affected by the '
+                             'injection are rebuilt instead of running "m clean".')
+    parser.add_argument("-w", "--parallel-jobs", type=int, default=1,
+                        help='Number of firmware build jobs to run concurrently. Every job gets its own OUT_DIR, '
+                             'extraction, log and metrics directory.')
+    parser.add_argument("-j", "--build-jobs", type=int, default=BUILD_JOBS,
+                        help='Global -j budget for "m". Split evenly across the parallel jobs. 0 lets "m" decide.')
+    parser.add_argument("-o", "--source-overlay", action='store_true', default=SOURCE_OVERLAY,
+                        help='If set, every firmware is injected into a copy-on-write overlayfs layer over the aosp '
+                             'checkout instead of the checkout itself. Requires sudo for mount/umount.')
+    parser.add_argument("--firmware-id", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("-t", "--rebuild-firmware", type=str, default=None,
+                        help='Targeted rebuild of the firmware with this id, which must be the last one built with '
+                             '--skip-clean. Keeps out/ and the injected packages and only restages and rebuilds the '
+                             'packages given by --rebuild-modules or changed by the pre-injector config. Implies '
+                             '--skip-clean.')
+    parser.add_argument("--rebuild-modules", type=str, nargs="+", default=[],
+                        help='Names of the extracted packages to restage and rebuild with --rebuild-firmware.')
     parser.add_argument("-p", "--pk-filter", type=str, default=None, help='Set a specific aecs job id '
                                                                           'to process. Other jobs will be ignored '
                                                                           'when set.')
@@ -920,10 +1396,20 @@ def parse_arguments():
                         type=str,
                         default="./device_configs/development/post_injector_config_v1.json",)
     args = parser.parse_args()
+    args.pre_injector_config = os.path.abspath(args.pre_injector_config)
+    args.post_injector_config = os.path.abspath(args.post_injector_config)
 
     if not (args.fmd_url.startswith("https://") or args.fmd_url.startswith("http://")):
         logging.error(f"Error: Incorrect FMD URL: {args.fmd_url}")
         exit(1)
+    if args.rebuild_firmware:
+        if args.source_overlay:
+            logging.error("Error: --rebuild-firmware needs the injected packages of the last build and cannot be "
+                          "used with --source-overlay.")
+            exit(1)
+        args.firmware_id = args.rebuild_firmware
+        args.parallel_jobs = 1
+        args.skip_clean = True
 
     return args
 
@@ -961,6 +1447,8 @@ def fetch_firmware_ids(args, fmd_password, csrf_cookie):
     """
     graphql_url = get_graphql_url(args.fmd_url)
     cookies = authenticate_fmd(graphql_url, args.fmd_username, fmd_password, csrf_cookie)
+    if args.firmware_id:
+        return [args.firmware_id], cookies
     firmware_id_list = get_firmware_ids(graphql_url, cookies, args.arch, args.pk_filter)
     logging.info(f"Got {len(firmware_id_list)} firmware ids to process...")
     return firmware_id_list, cookies
@@ -984,11 +1472,14 @@ def upload_build_artefact(repo_url, username, password, artefact_path, filename)
     while not is_upload_success and max_attempts > 0:
         logging.debug(f"Uploading image {filename} to repo {repo_url}.")
         try:
-            is_upload_success, download_url = upload_image_as_raw(repo_url,
-                                                    username,
-                                                    password,
-                                                    artefact_path,
-                                                    filename)
+            with trace_span("upload", category="upload", filename=filename,
+                            bytes=os.path.getsize(artefact_path)) as span:
+                is_upload_success, download_url = upload_image_as_raw(repo_url,
+                                                        username,
+                                                        password,
+                                                        artefact_path,
+                                                        filename)
+                span["is_success"] = is_upload_success
         except Exception as err:
             logging.error(f"Error uploading image: {err}")
         max_attempts -= 1
@@ -1018,29 +1509,13 @@ def setup_firmware_logger(firmware_id):
 
 def write_json_output(result, output_file):
     """
-    Writes the build result to a JSON file.
+    Appends the build result to the metrics store of the JSON file. The JSON file itself is exported at the end of
+    the run, see metrics_store.py.
 
     :param result: dict - The result to write to the JSON file.
     :param output_file: str - Path to the JSON output file.
     """
-
-    # Append the result to the JSON file
-    try:
-        with open(output_file, "r") as file:
-            data = json.load(file)
-    except FileNotFoundError:
-        data = []
-    except Exception as err:
-        logging.error(f"Error writing to file: {err}")
-        data = []
-
-    data.append(result)
-    try:
-        with open(output_file, "w") as file:
-            json.dump(data, file, indent=4)
-            file.write("\n")  # Add a newline
-    except Exception as err:
-        logging.error(f"Error writing to file: {err}")
+    append_metrics_record(result, output_file)
 
 
 def process_firmware_ids(args, firmware_id_list, cookies, docker_repo_password):
@@ -1064,78 +1539,132 @@ def process_firmware_ids(args, firmware_id_list, cookies, docker_repo_password):
     failed_firmware_ids = []
     succeed_firmware_ids = []
     download_url_list = []
-    clear_environment(args.aosp_path, aosp_packages_abs_path, aosp_version)
+    if args.source_overlay:
+        os.environ.setdefault("OUT_DIR", os.path.join(args.aosp_path, "out"))
+    if not args.rebuild_firmware:
+        release_source_tree(args, args.aosp_path, aosp_version)
     logging.info(f"Building for lunch target: {lunch_target} with aosp version: {aosp_version}")
-    for firmware_id in tqdm(firmware_id_list):
+    prefetcher = FirmwarePrefetcher(firmware_id_list,
+                                    lambda prefetch_id, destination_folder: fetch_build_files(prefetch_id,
+                                                                                              cookies,
+                                                                                              args.fmd_url,
+                                                                                              destination_folder))
+    is_previous_build_failed = False
+    for firmware_index, firmware_id in enumerate(tqdm(firmware_id_list)):
+        aosp_build_path = args.aosp_path
+        start_trace(firmware_id)
         try:
-            logging.info(f"Start fetching build files for firmware-id: {firmware_id}")
-            fetch_build_files(firmware_id, cookies, args.fmd_url, BUILD_OUT_PATH)
-            logging.debug(f"Start emulator image build process for firmware-id: {firmware_id}")
-
-            file_handler = setup_firmware_logger(firmware_id)
-            try:
-                logging.getLogger().addHandler(file_handler)
-                start_time = time.time()  # Record the start time
-                is_build_success = start_aosp_build(args.aosp_path,
-                                                    AOSP_PACKAGES_APPS_PATH,
-                                                    firmware_id=firmware_id,
-                                                    lunch_target=lunch_target,
-                                                    aosp_version=args.version,
-                                                    skip_filtering=args.skip_filtering,
-                                                    cookies=cookies)
-                end_time = time.time()
-                duration = end_time - start_time
-
-                status = "success" if is_build_success else "failure"
-                result = {
-                    "hostname": os.uname()[1],
-                    "firmware_id": firmware_id,
-                    "duration": round(duration, 2),
-                    "status": status
-                }
-                write_json_output(result, PATH_BUILD_FILE_LOG)
-
-                logging.info(f"Build process for firmware-id: {firmware_id} took {duration:.2f} seconds.")
-            finally:
-                logging.getLogger().removeHandler(file_handler)
-                file_handler.close()
-                if os.environ.get("FMD_DEBUG") == "True":
-                    setup_logger(logging.DEBUG)
+            with trace_span("firmware", category="firmware", firmware_id=firmware_id, lunch_target=lunch_target):
+                logging.info(f"Start fetching build files for firmware-id: {firmware_id}")
+                with trace_span("take_build_files", category="fetch", firmware_id=firmware_id):
+                    if args.rebuild_firmware and os.path.isdir(EXTRACTED_PACKAGES_PATH) \
+                            and has_previous_build(args.aosp_path, lunch_target, firmware_id):
+                        logging.info(f"Reusing the extracted build files of firmware-id: {firmware_id}")
+                    else:
+                        prefetcher.take(firmware_id)
+                logging.debug(f"Start emulator image build process for firmware-id: {firmware_id}")
+
+                file_handler = setup_firmware_logger(firmware_id)
+                try:
+                    logging.getLogger().addHandler(file_handler)
+                    reset_firmware_build_cache_statistics()
+                    reset_firmware_build_failures()
+                    start_time = time.time()  # Record the start time
+                    with trace_span("acquire_source_tree", category="source_tree"):
+                        aosp_build_path = acquire_source_tree(args)
+                    with source_tree_lock(aosp_build_path):
+                        logging.info(f"Acquired aosp source tree {aosp_build_path} after "
+                                     f"{time.time() - start_time:.2f} seconds.")
+                        if args.rebuild_firmware:
+                            is_build_success = start_targeted_rebuild(aosp_build_path,
+                                                                      AOSP_PACKAGES_APPS_PATH,
+                                                                      firmware_id=firmware_id,
+                                                                      lunch_target=lunch_target,
+                                                                      aosp_version=args.version,
+                                                                      skip_filtering=args.skip_filtering,
+                                                                      cookies=cookies,
+                                                                      rebuild_package_names=args.rebuild_modules)
+                        else:
+                            if not args.source_overlay:
+                                with trace_span("clear_source_tree", category="source_tree"):
+                                    clear_source_tree(aosp_build_path, aosp_packages_abs_path, aosp_version,
+                                                      keep_injection=not is_previous_build_failed)
+                            is_build_success = start_aosp_build(aosp_build_path,
+                                                                AOSP_PACKAGES_APPS_PATH,
+                                                                firmware_id=firmware_id,
+                                                                lunch_target=lunch_target,
+                                                                aosp_version=args.version,
+                                                                skip_filtering=args.skip_filtering,
+                                                                cookies=cookies,
+                                                                incremental_build=args.incremental_build)
+                    end_time = time.time()
+                    duration = end_time - start_time
+
+                    status = "success" if is_build_success else "failure"
+                    result = {
+                        "hostname": os.uname()[1],
+                        "firmware_id": firmware_id,
+                        "duration": round(duration, 2),
+                        "status": status
+                    }
+                    build_cache_statistics = pop_firmware_build_cache_statistics()
+                    if build_cache_statistics:
+                        result["build_cache"] = build_cache_statistics
+                    build_failure_list = pop_firmware_build_failures()
+                    if build_failure_list:
+                        result["build_failures"] = build_failure_list
+                    write_json_output(result, PATH_BUILD_FILE_LOG)
+
+                    logging.info(f"Build process for firmware-id: {firmware_id} took {duration:.2f} seconds.")
+                finally:
+                    logging.getLogger().removeHandler(file_handler)
+                    file_handler.close()
+                    if os.environ.get("FMD_DEBUG") == "True":
+                        setup_logger(logging.DEBUG)
+                    else:
+                        setup_logger()
+
+                if is_build_success:
+                    logging.info(f"Build process for firmware-id: {firmware_id} was successful.")
+                    emulator_image_zip_path = get_emulator_image_path(aosp_build_path, lunch_target, args.version)
+                    filename = f"{firmware_id}_v{args.version}_{lunch_target}.zip".replace('-', '_')
+                    is_upload_success, download_url = upload_build_artefact(args.docker_repo_url,
+                                                              args.docker_repo_username,
+                                                              docker_repo_password,
+                                                              emulator_image_zip_path,
+                                                              filename)
+                    if is_upload_success:
+                        logging.info(f"Upload of firmware-id: {firmware_id} was successful.")
+                        with open(os.path.join(ROOT_PATH, "docker_images.txt"), "a") as file:
+                            file.write(f"{filename.replace('.zip', '')}\n")
+                        succeed_firmware_ids.append(firmware_id)
+                        download_url_list.append(download_url)
+                    else:
+                        raise RuntimeError(f"Upload process for firmware-id: {firmware_id} failed.")
                 else:
-                    setup_logger()
-
-            if is_build_success:
-                logging.info(f"Build process for firmware-id: {firmware_id} was successful.")
-                emulator_image_zip_path = get_emulator_image_path(args.aosp_path, lunch_target, args.version)
-                filename = f"{firmware_id}_v{args.version}_{lunch_target}.zip".replace('-', '_')
-                is_upload_success, download_url = upload_build_artefact(args.docker_repo_url,
-                                                          args.docker_repo_username,
-                                                          docker_repo_password,
-                                                          emulator_image_zip_path,
-                                                          filename)
-                if is_upload_success:
-                    logging.info(f"Upload of firmware-id: {firmware_id} was successful.")
-                    with open("docker_images.txt", "a") as file:
-                        file.write(f"{filename.replace('.zip', '')}\n")
-                    succeed_firmware_ids.append(firmware_id)
-                    download_url_list.append(download_url)
-                else:
-                    raise RuntimeError(f"Upload process for firmware-id: {firmware_id} failed.")
-            else:
-                raise RuntimeError(f"Build process for firmware-id: {firmware_id} failed.")
+                    raise RuntimeError(f"Build process for firmware-id: {firmware_id} failed.")
         except Exception as err:
             logging.error(f"Got an error processing firmware-id: {firmware_id}. Error: {err}")
             traceback.print_exc()
             traceback.print_stack()
             failed_firmware_ids.append(firmware_id)
         finally:
+            # The checkout is reverted completely after a failed firmware, which may leave it half injected, and
+            # after the last firmware
+            is_previous_build_failed = firmware_id in failed_firmware_ids
             if not args.skip_clean:
-                clear_environment(args.aosp_path, aosp_packages_abs_path, aosp_version)
+                with trace_span("release_source_tree", category="source_tree"):
+                    release_source_tree(args, aosp_build_path, aosp_version,
+                                        keep_injection=not is_previous_build_failed
+                                        and firmware_index < len(firmware_id_list) - 1)
+            stop_trace()
+    prefetcher.close()
 
     if len(failed_firmware_ids) > 0:
         logging.error(f"Failed to build {len(failed_firmware_ids)} of the following firmware ids: {failed_firmware_ids} for arch: {args.arch}")
     logging.info(f"Successfully built {len(succeed_firmware_ids)} of the following firmware ids: {succeed_firmware_ids} for arch: {args.arch}")
     logging.info(f"Download URLs: {download_url_list}")
+    return failed_firmware_ids
 
 
 
@@ -1156,6 +1685,7 @@ def main():
     logging.info("=======================BUILD INJECTOR=======================")
     args = parse_arguments()
     if args.reset_aosp:
+        unmount_source_overlay(SOURCE_OVERLAY_DIR)
         aosp_packages_apps_abs_path = os.path.join(args.aosp_path, AOSP_PACKAGES_APPS_PATH)
         clear_environment(args.aosp_path, aosp_packages_apps_abs_path, args.version)
         logging.info("Reset aosp build environment.")
@@ -1174,17 +1704,27 @@ def main():
     global POST_INJECTOR_CONFIG
     global PRE_INJECTOR_CONFIG_PATH
     global POST_INJECTOR_CONFIG_PATH
+    global BUILD_JOBS
     PRE_INJECTOR_CONFIG = pre_injector_config
     POST_INJECTOR_CONFIG = post_injector_config
     PRE_INJECTOR_CONFIG_PATH = args.pre_injector_config
     POST_INJECTOR_CONFIG_PATH = args.post_injector_config
     PRE_INJECTOR_CONFIG["PRE_INJECTOR_CONFIG_PATH"] = args.pre_injector_config
+    BUILD_JOBS = args.build_jobs
     logging.info(f"Pre-injector config: {PRE_INJECTOR_CONFIG_PATH}, Post-injector config: {POST_INJECTOR_CONFIG_PATH}")
     set_skipped_module_names()
     fmd_password, docker_repo_password = get_passwords(args)
     csrf_cookie = get_csrf_token(args.fmd_url)
     firmware_id_list, cookies = fetch_firmware_ids(args, fmd_password, csrf_cookie)
-    process_firmware_ids(args, firmware_id_list, cookies, docker_repo_password)
+    if args.parallel_jobs > 1 and not args.firmware_id:
+        failed_firmware_ids = run_build_jobs(args, firmware_id_list, fmd_password, docker_repo_password)
+        if failed_firmware_ids:
+            exit(1)
+    else:
+        failed_firmware_ids = process_firmware_ids(args, firmware_id_list, cookies, docker_repo_password)
+        export_all_metrics()
+        if args.firmware_id and failed_firmware_ids:
+            exit(1)
     logging.info("===============================================================")
 
 
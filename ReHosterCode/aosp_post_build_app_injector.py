@@ -4,7 +4,8 @@ import shutil
 import traceback
 
 from ConfigManager import ConfigManager
-from common import get_md5_from_file
+from apk_manifest import read_apk_manifest
+from common import get_md5_from_file, get_aosp_out_path
 from fmd_backend_requests import fetch_app_manifest
 from shell_command import execute_command
 from config_post_injector import *
@@ -76,20 +77,37 @@ def get_signing_key_from_module(android_apk_file_path, firmware_id, cookies):
                     return signing_key.lower()
     else:
         logging.warning(f"Android.mk/Android.bp Module not found: {module_name} path {android_mk_file_path}."
-                        f"File {android_apk_file_path} - fallback to FMD API.")
-        shared_user_id = get_shared_user_from_manifest(firmware_id, android_apk_file_path, cookies)
-        if shared_user_id in POST_INJECTOR_CONFIG["SHARED_USER_ID_MAPPING_DICT"].values():
-            logging.debug(f"Shared User ID from FMD API for {android_apk_file_path}: {shared_user_id}")
-            for key, value in POST_INJECTOR_CONFIG["SHARED_USER_ID_MAPPING_DICT"].items():
-                if value == shared_user_id:
-                    signing_key = key
-                    return signing_key.lower()
+                        f"File {android_apk_file_path} - fallback to APK manifest.")
+        shared_user_id = read_apk_manifest(android_apk_file_path)["sharedUserId"]
+        if not shared_user_id:
+            logging.info(f"No shared User ID in APK manifest of {android_apk_file_path} - fallback to FMD API.")
+            shared_user_id = get_shared_user_from_manifest(firmware_id, android_apk_file_path, cookies)
+        signing_key = get_signing_key_from_shared_user_id(shared_user_id)
+        if signing_key:
+            logging.debug(f"Shared User ID for {android_apk_file_path}: {shared_user_id} | key: {signing_key}")
+            return signing_key.lower()
         else:
             logging.error(f"APK SIGNING ERROR: Shared User ID not found or not mapped for {android_apk_file_path}: {shared_user_id}. "
                          f"Fallback to default signing key 'platform'.")
     return "platform"
 
 
+def get_signing_key_from_shared_user_id(shared_user_id):
+    """
+    Maps a shared user id to a signing key name by using the SHARED_USER_ID_MAPPING_DICT of the post-injector config.
+
+    :param shared_user_id: str - shared user id from the APK manifest.
+    :return: str - name of the signing key or None if the shared user id is not mapped.
+    """
+    if not shared_user_id:
+        return None
+    shared_user_id_mapping = ConfigManager.get_config("POST_INJECTOR_CONFIG")["SHARED_USER_ID_MAPPING_DICT"]
+    for key, shared_uid_list in shared_user_id_mapping.items():
+        if shared_user_id in shared_uid_list:
+            return key
+    return None
+
+
 def get_signing_key_path(aosp_path, signing_key_name):
     key_file_path = f"{aosp_path}build/target/product/security/{signing_key_name}.p12"
     key_file_path = key_file_path.replace("//", "/")
@@ -195,14 +213,11 @@ def sign_apex_container_signapk(apex_file_path,
     elif not os.path.exists(aosp_path):
         return False, f"AOSP path not found for signing: {aosp_path}"
 
-    current_directory = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(aosp_path)
-
     try:
         apex_out_file_path = f"{apex_file_path}.signed"
         env_setup_command = f"bash -c 'cd {aosp_path} && source {aosp_path}build/envsetup.sh && lunch {lunch_target} && "
-        sign_command = env_setup_command +  f"java -Djava.library.path={aosp_path}out/host/linux-x86/lib64/ " \
-                                            f"-jar out/host/linux-x86/framework/signapk.jar " \
+        sign_command = env_setup_command +  f"java -Djava.library.path={get_aosp_out_path(aosp_path, 'out/host/linux-x86/lib64/')} " \
+                                            f"-jar {get_aosp_out_path(aosp_path, 'out/host/linux-x86/framework/signapk.jar')} " \
                                             f"--min-sdk-version 28 " \
                                             f"-a 4096 " \
                                             f"{signing_key_certificate_path} " \
@@ -229,6 +244,4 @@ def sign_apex_container_signapk(apex_file_path,
         success = False
         traceback.print_exc()
         log_message = f"Error signing APEX container file: {apex_file_path} with key: {signing_key_path} - {e}"
-    finally:
-        os.chdir(current_directory)
     return success, log_message
\ No newline at end of file
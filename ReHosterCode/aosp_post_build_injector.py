@@ -11,7 +11,6 @@ import logging
 import subprocess
 import threading
 import time
-import json
 import os
 import stat
 import traceback
@@ -20,14 +19,17 @@ from concurrent.futures import ProcessPoolExecutor as Executor, as_completed
 from http import cookies
 
 from filelock import FileLock
-from aosp_apex_injector import handle_apex_modules, prepare_capex, rename_file, repackage_apex_file, \
+from aosp_apex_injector import handle_apex_modules, prepare_capex, predecompress_capex, rename_file, repackage_apex_file, \
     POST_INJECTOR_CONFIG, add_new_apex_file
 from aosp_module_type import get_module_type
+from apex_name_resolver import init_apex_name_resolver
 from aosp_post_build_app_injector import handle_apk_signing
 from common import extract_vendor_name, remove_vendor_name_from_path, load_configs, is_elf_binary, \
-    check_shared_object_architecture, get_path_up_to_first_term
+    check_shared_object_architecture, get_path_up_to_first_term, get_aosp_out_path
 from config_post_injector import *
 from fmd_backend_requests import get_csrf_token, authenticate_fmd
+from metrics_store import append_metrics_record, export_metrics
+from pipeline_trace import trace_span
 from setup_logger import setup_logger
 from tqdm import tqdm
 
@@ -43,31 +45,12 @@ processed_files_lock = threading.Lock()
 
 def write_json_output(data, output_file):
     """
-    Writes the measurement data to a JSON file.
+    Appends the measurement data to the metrics store of the JSON file, see metrics_store.py.
 
     :param data: dict - The measurement data to write.
     :param output_file: str - Path to the JSON output file.
     """
-    try:
-        # Read existing data if the file exists
-        try:
-            with open(output_file, "r") as file:
-                existing_data = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            existing_data = []
-
-        # Ensure the existing data is a list
-        if not isinstance(existing_data, list):
-            existing_data = []
-
-        # Append the new data
-        existing_data.append(data)
-
-        # Write the updated data back to the file
-        with open(output_file, "w") as file:
-            json.dump(existing_data, file, indent=4)
-    except Exception as e:
-        print(f"Error writing JSON output: {e}")
+    append_metrics_record(data, output_file)
 
 
 def start_post_build_injector(aosp_path,
@@ -113,8 +96,13 @@ def start_post_build_injector(aosp_path,
         raise FileNotFoundError(f"Post-Injection Source folder does not exist or is empty: {source_folder_path}")
 
     if POST_INJECTOR_CONFIG["ENABLE_INJECTION"]:
-        with Executor() as executor:
-            inject(aosp_path, source_folder_path, target_out_path, executor, lunch_target, firmware_id, pre_injector_package_list, cookies, aosp_version)
+        apex_lane_workers = get_apex_lane_size()
+        file_lane_workers = max(1, (os.cpu_count() or 1) - apex_lane_workers)
+        logging.info(f"Post-injection lanes: {file_lane_workers} file workers | {apex_lane_workers} APEX workers")
+        with trace_span("post_injection", category="post_injection", firmware_id=firmware_id,
+                        file_workers=file_lane_workers, apex_workers=apex_lane_workers), \
+                Executor(max_workers=file_lane_workers) as executor, Executor(max_workers=apex_lane_workers) as apex_executor:
+            inject(aosp_path, source_folder_path, target_out_path, executor, apex_executor, lunch_target, firmware_id, pre_injector_package_list, cookies, aosp_version)
     else:
         logging.info(f"Post-Injection is disabled by configuration: {POST_INJECTOR_CONFIG['ENABLE_INJECTION']}")
         logging.info(f"Skipping post build injection for {source_folder_path} into {target_out_path}")
@@ -177,18 +165,104 @@ def count_number_of_extracted_files(source_folder_path):
     return file_count_per_partition
 
 
-def inject(aosp_path, source_folder_path, target_out_path, executor, lunch_target, firmware_id, pre_injector_package_list, cookies, aosp_version):
+def get_available_memory():
+    """
+    Returns the available memory of the host in bytes.
+    """
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def get_apex_lane_size():
+    """
+    Calculates the number of concurrent APEX jobs. Every APEX job fans out into several heavy subprocesses
+    (deapexer, apexer, signapk, openssl), so the lane is sized by CPU and memory instead of one job per core.
+
+    :return: int - number of APEX workers.
+    """
+    if APEX_LANE_MAX_WORKERS > 0:
+        return APEX_LANE_MAX_WORKERS
+    cpu_slots = (os.cpu_count() or 1) // APEX_LANE_CPUS_PER_JOB
+    memory_slots = get_available_memory() // APEX_LANE_MEMORY_PER_JOB
+    return max(1, min(cpu_slots, memory_slots))
+
+
+def is_apex_lane_file(file_path):
+    """
+    Checks if the file is processed in the APEX lane (APEX merge, repack or new-APEX creation).
+
+    :param file_path: str - path to the file.
+    :return: bool - True if the file is an APEX job.
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension in [".apex", ".capex"]:
+        return True
+    return os.path.basename(file_path) in POST_INJECTOR_CONFIG["APEX_BINARY_ISOLATED_NAMESPACE_LIST"]
+
+
+def predecompress_capex_files(source_folder_path, executor):
+    """
+    Decompresses all capex files of the firmware in parallel before the injection pass. The results are picked up
+    by replace_capex_with_apex.
+
+    :param source_folder_path: str - path to the extracted firmware files.
+    :param executor: ProcessPoolExecutor - executor to run the decompression on.
+    """
+    capex_file_list = [os.path.join(root, file_name) for root, _, file_name_list in scandir_walk(source_folder_path)
+                       for file_name in file_name_list if file_name.endswith(".capex")]
+    if not capex_file_list:
+        return
+    capex_file_list.sort(key=os.path.getsize, reverse=True)
+    logging.info(f"Predecompressing {len(capex_file_list)} capex files")
+    future_dict = {executor.submit(predecompress_capex, file_path): file_path for file_path in capex_file_list}
+    for future in as_completed(future_dict):
+        try:
+            if not future.result():
+                logging.warning(f"Predecompression failed for capex: {future_dict[future]}")
+        except Exception as err:
+            logging.error(f"Predecompression error for capex {future_dict[future]}: {err}")
+
+
+def resolve_apex_names(source_folder_path, target_out_path):
+    """
+    Resolves all vendor APEX files that are candidates for a merge to their emulator APEX folders before the
+    injection starts, so unresolvable merges are reported up front.
+
+    :param source_folder_path: str - path to the extracted firmware files.
+    :param target_out_path: str - path to the emulator build output.
+    :return: list(str) - APEX files without emulator folder.
+    """
+    apex_file_list = [os.path.join(root, file_name) for root, _, file_name_list in scandir_walk(source_folder_path)
+                      for file_name in file_name_list
+                      if file_name.endswith((".apex", ".capex"))
+                      and any(keyword in file_name for keyword in POST_INJECTOR_CONFIG["ALLOW_APEX_MERGE_KEYWORD_LIST"])]
+    return init_apex_name_resolver(target_out_path, POST_INJECTOR_CONFIG, apex_file_list)
+
+
+def inject(aosp_path, source_folder_path, target_out_path, executor, apex_executor, lunch_target, firmware_id, pre_injector_package_list, cookies, aosp_version):
     start_time = time.time()
     logging.info(f"Injection started at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
+    with trace_span("predecompress_capex_files", category="post_injection"):
+        predecompress_capex_files(source_folder_path, executor)
+    with trace_span("resolve_apex_names", category="post_injection"):
+        resolve_apex_names(source_folder_path, target_out_path)
     error_list, inj_obj_list, inj_partition_list = process_partitions(aosp_path,
                                                                       source_folder_path,
                                                                       target_out_path,
                                                                       executor,
+                                                                      apex_executor,
                                                                       lunch_target,
                                                                       pre_injector_package_list,
                                                                       firmware_id,
                                                                       cookies,
                                                                       aosp_version)
+    shutil.rmtree(CAPEX_PREDECOMPRESS_DIR, ignore_errors=True)
     end_time = time.time()
     logging.info(f"Injection ended at {end_time}")
     execution_time = end_time - start_time
@@ -298,7 +372,7 @@ def get_folders(directory_path):
     return folders
 
 
-def process_partitions(aosp_path, source_folder_path, target_out_path, executor, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
+def process_partitions(aosp_path, source_folder_path, target_out_path, executor, apex_executor, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
     folder_path_list = get_folders(source_folder_path)
     logging.info(f"Folder path list: {folder_path_list}")
     combined_error_list = []
@@ -306,15 +380,19 @@ def process_partitions(aosp_path, source_folder_path, target_out_path, executor,
     combined_inj_partition_list = []
 
     for folder_path in tqdm(folder_path_list, desc="Processing partitions"):
-        error_list, inj_obj_list, inj_partition_list = process_partition_files(aosp_path,
-                                                                               folder_path,
-                                                                               target_out_path,
-                                                                               executor,
-                                                                               lunch_target,
-                                                                               pre_injector_package_list,
-                                                                               firmware_id,
-                                                                               cookies,
-                                                                               aosp_version)
+        with trace_span("partition", category="post_injection", partition=os.path.basename(folder_path)) as span:
+            error_list, inj_obj_list, inj_partition_list = process_partition_files(aosp_path,
+                                                                                   folder_path,
+                                                                                   target_out_path,
+                                                                                   executor,
+                                                                                   apex_executor,
+                                                                                   lunch_target,
+                                                                                   pre_injector_package_list,
+                                                                                   firmware_id,
+                                                                                   cookies,
+                                                                                   aosp_version)
+            span["errors"] = len(error_list)
+            span["files_injected"] = len(inj_obj_list) + len(inj_partition_list)
         combined_error_list.extend(error_list)
         combined_inj_obj_list.extend(inj_obj_list)
         combined_inj_partition_list.extend(inj_partition_list)
@@ -323,6 +401,22 @@ def process_partitions(aosp_path, source_folder_path, target_out_path, executor,
 
 
 def process_file_concurrently(aosp_path, file_path, partition_name, target_out_path, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
+    """
+    Worker entry point of the post-injection of a single file. Records the file as a span of the worker process.
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+    except OSError:
+        file_size = 0
+    with trace_span(os.path.basename(file_path), category="post_injection_file", file_path=file_path,
+                    partition=partition_name, bytes=file_size) as span:
+        result = process_file(aosp_path, file_path, partition_name, target_out_path, lunch_target,
+                              pre_injector_package_list, firmware_id, cookies, aosp_version)
+        span["message"] = result[0]
+        return result
+
+
+def process_file(aosp_path, file_path, partition_name, target_out_path, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
     inj_obj = None
     inj_partition = None
     error_message = None
@@ -607,7 +701,7 @@ def cleanup_files(directory):
                     logging.error(f"Error removing file {file_path}: {e}")
 
 
-def process_partition_files(aosp_path, folder_path, target_out_path, executor, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
+def process_partition_files(aosp_path, folder_path, target_out_path, executor, apex_executor, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version):
     logging.debug(f"Processing {folder_path} into {target_out_path}")
     logging.debug(f"AOSP Path: {aosp_path} "
                   f"| Target Out Path: {target_out_path} "
@@ -623,6 +717,14 @@ def process_partition_files(aosp_path, folder_path, target_out_path, executor, l
                           for file_name in file_name_list))
     logging.debug(f"Found {len(file_paths)} files in {folder_path} for post-injection...")
 
+    # APEX jobs run in their own lane, largest payload first, so they start as soon as the inventory is known.
+    apex_file_paths = sorted((file_path for file_path in file_paths if is_apex_lane_file(file_path)),
+                             key=lambda file_path: os.path.getsize(file_path) if os.path.isfile(file_path) else 0,
+                             reverse=True)
+    apex_file_path_set = set(apex_file_paths)
+    file_paths = apex_file_paths + [file_path for file_path in file_paths if file_path not in apex_file_path_set]
+    logging.info(f"APEX lane jobs in partition {partition_name}: {len(apex_file_paths)}")
+
     # Initialize tqdm progress bar
     progress_bar = tqdm(total=len(file_paths), desc=f"Processing files in partition: {partition_name}")
 
@@ -637,7 +739,8 @@ def process_partition_files(aosp_path, folder_path, target_out_path, executor, l
 
         logging.debug(f"Submitting file for injection: {file_path} | Partition: {partition_name} "
                      f"| Target Out Path: {target_out_path} | Lunch Target: {lunch_target} | Length of pre_injector_package_list: {len(pre_injector_package_list)}")
-        future = executor.submit(process_file_concurrently, aosp_path, file_path, partition_name, target_out_path, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version)
+        lane_executor = apex_executor if file_path in apex_file_path_set else executor
+        future = lane_executor.submit(process_file_concurrently, aosp_path, file_path, partition_name, target_out_path, lunch_target, pre_injector_package_list, firmware_id, cookies, aosp_version)
         future_dict[future] = file_path
 
     logging.debug(f"Finished processing {len(processed_files)}/{len(file_paths)} files in partition: {partition_name}. "
@@ -1022,10 +1125,10 @@ def inject_file_into_partition(source_file_path, target_file_injection_path, aos
 
     if filename in POST_INJECTOR_CONFIG["DIRECT_INJECTION_TARGET_PATH_OVERWRITE"]:
         if "phone64" in  lunch_target:
-            target_file_injection_path = os.path.join(aosp_path, "out/target/product/emulator64_arm64", POST_INJECTOR_CONFIG["DIRECT_INJECTION_TARGET_PATH_OVERWRITE"][filename])
+            target_file_injection_path = os.path.join(get_aosp_out_path(aosp_path, "out/target/product/emulator64_arm64"), POST_INJECTOR_CONFIG["DIRECT_INJECTION_TARGET_PATH_OVERWRITE"][filename])
             logging.info(f"Direct Injection via specific target path overwrite for file: {filename} into {target_file_injection_path}")
         else:
-            target_file_injection_path = os.path.join(aosp_path, "out/target/product/emulator_arm64", POST_INJECTOR_CONFIG["DIRECT_INJECTION_TARGET_PATH_OVERWRITE"][filename])
+            target_file_injection_path = os.path.join(get_aosp_out_path(aosp_path, "out/target/product/emulator_arm64"), POST_INJECTOR_CONFIG["DIRECT_INJECTION_TARGET_PATH_OVERWRITE"][filename])
             logging.info(f"Direct Injection via specific target path overwrite for file: {filename} into {target_file_injection_path}")
 
 
@@ -1137,11 +1240,11 @@ def inject_apex_symlink_file(filename, source_file_path, original_file_path, aos
     logging.info(f"{source_file_path} - Root path: {root_path}")
     relative_source_path = source_file_path.replace(root_path, "")
     if aosp_version and int(aosp_version) == 13:
-        abs_source_path = os.path.join(aosp_path, "out/target/product/emulator64_arm64", relative_source_path)
+        abs_source_path = os.path.join(get_aosp_out_path(aosp_path, "out/target/product/emulator64_arm64"), relative_source_path)
     elif aosp_version and int(aosp_version) >= 14:
-        abs_source_path = os.path.join(aosp_path, "out/target/product/emu64a", relative_source_path)
+        abs_source_path = os.path.join(get_aosp_out_path(aosp_path, "out/target/product/emu64a"), relative_source_path)
     else:
-        abs_source_path = os.path.join(aosp_path, "out/target/product/emulator_arm64", relative_source_path)
+        abs_source_path = os.path.join(get_aosp_out_path(aosp_path, "out/target/product/emulator_arm64"), relative_source_path)
 
     inject_commands = [f"os.remove('{abs_source_path}')",f"subprocess.call(['ln', '-s', '{target_path}', '{abs_source_path}'])"]
     injection_marker = "####### FMD INJECTION MARKER #######"
@@ -1305,6 +1408,7 @@ def main():
                               firmware_id=firmware_id,
                               cookies=fmd_cookies,
                               aosp_version=aosp_version)
+    export_metrics(PATH_EXECUTION_TIME_LOG)
 
     logging.info("=======================AOSP POST BUILD INJECTOR EXIT=======================")
 
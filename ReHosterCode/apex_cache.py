@@ -0,0 +1,206 @@
+"""
+Content-addressed on-disk cache for merged and repacked APEX files. Firmwares of the same vendor and release often
+ship byte-identical APEX files. Instead of extracting, merging, rebuilding, signing and verifying them again, the final
+signed APEX and its key material are stored once and restored by a simple copy for every later firmware.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from filelock import FileLock
+from config_post_injector import APEX_CACHE_DIR, APEX_CACHE_MAX_BYTES, APEX_CACHE_ENABLED, APEX_CACHE_CONFIG_KEYS
+
+CACHE_APEX_FILENAME = "signed.apex"
+CACHE_META_FILENAME = "meta.json"
+CACHE_LOCK_FILENAME = ".apex_cache.lock"
+CACHE_KEY_ROLES = ["avb_pub_key", "priv_pem", "private_key", "cert"]
+_folder_digest_memo = {}
+
+
+def get_file_digest(file_path):
+    """
+    Computes the sha256 digest of a file.
+
+    :param file_path: str - path to the file.
+    :return: str - hex digest of the file content.
+    """
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+def get_folder_digest(folder_path):
+    """
+    Computes a digest over the relative paths, symlink targets and file contents of a folder. The emulator APEX
+    folders are rebuilt for every firmware, so timestamps cannot be used. The result is memoized per process as long
+    as the folder's stat signature does not change.
+
+    :param folder_path: str - path to the folder.
+    :return: str - hex digest of the folder.
+    """
+    entry_list = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            file_stat = os.lstat(file_path)
+            entry_list.append((file_path, file_stat.st_size, file_stat.st_mtime_ns))
+    signature = (folder_path, tuple(entry_list))
+    if signature in _folder_digest_memo:
+        return _folder_digest_memo[signature]
+
+    hash_sha256 = hashlib.sha256()
+    for file_path, _, _ in entry_list:
+        hash_sha256.update(os.path.relpath(file_path, folder_path).encode("utf-8", errors="ignore"))
+        if os.path.islink(file_path):
+            hash_sha256.update(b"->" + os.readlink(file_path).encode("utf-8", errors="ignore"))
+        else:
+            hash_sha256.update(get_file_digest(file_path).encode())
+    digest = hash_sha256.hexdigest()
+    _folder_digest_memo[signature] = digest
+    return digest
+
+
+def get_config_digest(post_injector_config):
+    """
+    Computes a digest over the subset of the post-injector config that changes the content of an APEX.
+
+    :param post_injector_config: dict - the post-injector config.
+    :return: str - hex digest of the config subset.
+    """
+    config_subset = {key: post_injector_config.get(key) for key in APEX_CACHE_CONFIG_KEYS}
+    return hashlib.sha256(json.dumps(config_subset, sort_keys=True).encode()).hexdigest()
+
+
+def get_apex_cache_key(mode, apex_file_path, apex_emulator_folder, post_injector_config, aosp_version, lunch_target):
+    """
+    Creates the cache key for an APEX file.
+
+    :param mode: str - "merge" or "repack".
+    :param apex_file_path: str - path to the vendor APEX file.
+    :param apex_emulator_folder: str - path to the emulator APEX folder or None for repacks.
+    :param post_injector_config: dict - the post-injector config.
+    :param aosp_version: str - version of the AOSP build.
+    :param lunch_target: str - lunch target for the AOSP build.
+
+    :return: str - cache key or None if the cache is disabled.
+    """
+    if not APEX_CACHE_ENABLED:
+        return None
+    key_parts = [mode,
+                 os.path.basename(apex_file_path),
+                 get_file_digest(apex_file_path),
+                 get_folder_digest(apex_emulator_folder) if apex_emulator_folder else "",
+                 get_config_digest(post_injector_config),
+                 str(aosp_version),
+                 str(lunch_target)]
+    cache_key = hashlib.sha256("|".join(key_parts).encode()).hexdigest()
+    logging.debug(f"APEX cache key for {apex_file_path}: {cache_key} | {key_parts}")
+    return cache_key
+
+
+def get_cache_entry_path(cache_key):
+    return os.path.join(APEX_CACHE_DIR, cache_key[:2], cache_key)
+
+
+def restore_apex_from_cache(cache_key, apex_out_file):
+    """
+    Copies a cached APEX file to the output path and marks the entry as recently used.
+
+    :param cache_key: str - cache key of the APEX.
+    :param apex_out_file: str - path to write the cached APEX file to.
+
+    :return: tuple - (bool, dict) - True on a cache hit. Dict mapping key roles to the cached key files.
+    """
+    if not cache_key:
+        return False, {}
+    entry_path = get_cache_entry_path(cache_key)
+    meta_path = os.path.join(entry_path, CACHE_META_FILENAME)
+    if not os.path.exists(meta_path):
+        logging.info(f"APEX cache miss: {cache_key} for {apex_out_file}")
+        return False, {}
+    try:
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+        shutil.copyfile(os.path.join(entry_path, CACHE_APEX_FILENAME), apex_out_file)
+        key_artefacts = {role: os.path.join(entry_path, file_name) for role, file_name in meta["keys"].items()}
+        os.utime(meta_path)
+    except Exception as err:
+        logging.warning(f"APEX cache entry {cache_key} could not be restored: {err}")
+        return False, {}
+    logging.info(f"APEX cache hit: {cache_key} ({meta['source']}) restored to {apex_out_file}")
+    return True, key_artefacts
+
+
+def store_apex_in_cache(cache_key, apex_file_path, key_path_list):
+    """
+    Stores a signed APEX file and its key material in the cache and evicts old entries afterwards.
+
+    :param cache_key: str - cache key of the APEX.
+    :param apex_file_path: str - path to the final signed APEX file.
+    :param key_path_list: list(str) - avb public key, private pem, private key and certificate paths.
+    """
+    if not cache_key or not os.path.exists(apex_file_path):
+        return
+    entry_path = get_cache_entry_path(cache_key)
+    if os.path.exists(os.path.join(entry_path, CACHE_META_FILENAME)):
+        return
+    staging_path = os.path.join(APEX_CACHE_DIR, f".staging_{uuid.uuid4()}")
+    try:
+        os.makedirs(staging_path)
+        shutil.copyfile(apex_file_path, os.path.join(staging_path, CACHE_APEX_FILENAME))
+        key_files = {}
+        for role, key_path in zip(CACHE_KEY_ROLES, key_path_list):
+            if key_path and os.path.exists(key_path):
+                key_files[role] = f"{role}_{os.path.basename(key_path)}"
+                shutil.copyfile(key_path, os.path.join(staging_path, key_files[role]))
+        size = sum(os.path.getsize(os.path.join(staging_path, name)) for name in os.listdir(staging_path))
+        meta = {"source": os.path.basename(apex_file_path), "keys": key_files, "size": size, "created": time.time()}
+        with open(os.path.join(staging_path, CACHE_META_FILENAME), "w") as meta_file:
+            json.dump(meta, meta_file, indent=4)
+        with FileLock(os.path.join(APEX_CACHE_DIR, CACHE_LOCK_FILENAME)):
+            if os.path.exists(entry_path):
+                shutil.rmtree(staging_path)
+                return
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            os.rename(staging_path, entry_path)
+            logging.info(f"APEX cache stored: {cache_key} for {apex_file_path} ({size} bytes)")
+            evict_apex_cache(APEX_CACHE_MAX_BYTES)
+    except Exception as err:
+        logging.warning(f"APEX cache store failed for {apex_file_path}: {err}")
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def evict_apex_cache(max_bytes):
+    """
+    Removes the least recently used cache entries until the cache fits into the size budget. Must be called while
+    holding the cache lock.
+
+    :param max_bytes: int - size budget of the cache in bytes.
+    """
+    entry_list = []
+    total_size = 0
+    for root, dirs, files in os.walk(APEX_CACHE_DIR):
+        if CACHE_META_FILENAME in files and not os.path.basename(root).startswith(".staging_"):
+            meta_path = os.path.join(root, CACHE_META_FILENAME)
+            try:
+                with open(meta_path, "r") as meta_file:
+                    size = json.load(meta_file)["size"]
+            except Exception:
+                size = sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            entry_list.append((os.path.getmtime(meta_path), size, root))
+            total_size += size
+            dirs.clear()
+
+    for last_used, size, entry_path in sorted(entry_list):
+        if total_size <= max_bytes:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= size
+        logging.info(f"APEX cache evicted: {entry_path} ({size} bytes) | cache size: {total_size}/{max_bytes}")
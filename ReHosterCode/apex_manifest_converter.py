@@ -0,0 +1,130 @@
+"""
+Conversion of apex_manifest.json files to the apex_manifest.pb protobuf format. The conversion runs in-process with
+the protobuf package and the ApexManifest schema of system/apex/proto/apex_manifest.proto. Manifests with keys unknown
+to the schema are left to the conv_apex_manifest tool, whose outputs are memoized on disk by the hash of the cleaned
+JSON and the tool version.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+
+from config_post_injector import APEX_MANIFEST_MEMO_DIR
+
+try:
+    from google.protobuf import descriptor_pb2, descriptor_pool, json_format, message_factory
+    IS_PROTOBUF_AVAILABLE = True
+except ImportError:
+    IS_PROTOBUF_AVAILABLE = False
+
+# (field name, field number, type, label) of the ApexManifest message
+APEX_MANIFEST_FIELD_LIST = [
+    ("name", 1, "TYPE_STRING", "LABEL_OPTIONAL"),
+    ("version", 2, "TYPE_INT64", "LABEL_OPTIONAL"),
+    ("preInstallHook", 3, "TYPE_STRING", "LABEL_OPTIONAL"),
+    ("postInstallHook", 4, "TYPE_STRING", "LABEL_OPTIONAL"),
+    ("versionName", 5, "TYPE_STRING", "LABEL_OPTIONAL"),
+    ("noCode", 6, "TYPE_BOOL", "LABEL_OPTIONAL"),
+    ("provideNativeLibs", 7, "TYPE_STRING", "LABEL_REPEATED"),
+    ("requireNativeLibs", 8, "TYPE_STRING", "LABEL_REPEATED"),
+    ("jniLibs", 9, "TYPE_STRING", "LABEL_REPEATED"),
+    ("requireSharedApexLibs", 10, "TYPE_STRING", "LABEL_REPEATED"),
+    ("provideSharedApexLibs", 11, "TYPE_BOOL", "LABEL_OPTIONAL"),
+    ("supportsRebootlessUpdate", 13, "TYPE_BOOL", "LABEL_OPTIONAL"),
+]
+_apex_manifest_class = []
+
+
+def get_cleaned_manifest_json(apex_manifest_path):
+    """
+    Removes the placeholder comments of AOSP manifest templates and replaces the placeholder version 0.
+
+    :param apex_manifest_path: str - path to the apex_manifest.json file.
+    :return: str - the cleaned JSON content.
+    """
+    with open(apex_manifest_path, 'r') as f:
+        lines = f.readlines()
+    cleaned_lines = [
+        line for line in lines
+        if "Placeholder module version to be replaced during build." not in line
+        and "Do not change!" not in line
+    ]
+    for i, line in enumerate(cleaned_lines):
+        if "\"version\": 0" in line:
+            cleaned_lines[i] = line.replace("0", "999")
+    cleaned_json = "".join(cleaned_lines)
+    json.loads(cleaned_json)
+    return cleaned_json
+
+
+def get_apex_manifest_class():
+    """
+    Builds the ApexManifest message class from APEX_MANIFEST_FIELD_LIST.
+    """
+    if _apex_manifest_class:
+        return _apex_manifest_class[0]
+    file_descriptor = descriptor_pb2.FileDescriptorProto(name="fmd_apex_manifest.proto", package="apex.proto",
+                                                         syntax="proto3")
+    message_descriptor = file_descriptor.message_type.add(name="ApexManifest")
+    for field_name, field_number, field_type, field_label in APEX_MANIFEST_FIELD_LIST:
+        message_descriptor.field.add(name=field_name,
+                                     json_name=field_name,
+                                     number=field_number,
+                                     type=descriptor_pb2.FieldDescriptorProto.Type.Value(field_type),
+                                     label=descriptor_pb2.FieldDescriptorProto.Label.Value(field_label))
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_descriptor)
+    descriptor = pool.FindMessageTypeByName("apex.proto.ApexManifest")
+    if hasattr(message_factory, "GetMessageClass"):
+        manifest_class = message_factory.GetMessageClass(descriptor)
+    else:
+        manifest_class = message_factory.MessageFactory(pool).GetPrototype(descriptor)
+    _apex_manifest_class.append(manifest_class)
+    return manifest_class
+
+
+def convert_manifest_in_process(cleaned_json):
+    """
+    Serializes a cleaned apex_manifest.json to protobuf like `conv_apex_manifest proto` does.
+
+    :param cleaned_json: str - the cleaned manifest JSON.
+    :return: bytes - the serialized ApexManifest or None if protobuf is missing or the manifest has unknown keys.
+    """
+    if not IS_PROTOBUF_AVAILABLE:
+        return None
+    try:
+        apex_manifest = json_format.ParseDict(json.loads(cleaned_json), get_apex_manifest_class()())
+        return apex_manifest.SerializeToString()
+    except Exception as err:
+        logging.info(f"APEX manifest not convertible in-process, using conv_apex_manifest: {err}")
+        return None
+
+
+def get_converter_version(converter_path):
+    converter_stat = os.stat(converter_path)
+    return f"{os.path.basename(converter_path)}-{converter_stat.st_size}-{converter_stat.st_mtime_ns}"
+
+
+def get_memoized_manifest_path(cleaned_json, converter_version):
+    """
+    Returns the memo path of a conv_apex_manifest output.
+
+    :param cleaned_json: str - the cleaned manifest JSON.
+    :param converter_version: str - version string of the conv_apex_manifest binary.
+    :return: tuple - (bool, str) - True if the memoized output exists, path of the memoized output.
+    """
+    memo_key = hashlib.sha256(f"{converter_version}|{cleaned_json}".encode()).hexdigest()
+    memo_path = os.path.join(APEX_MANIFEST_MEMO_DIR, f"{memo_key}.pb")
+    return os.path.exists(memo_path), memo_path
+
+
+def store_memoized_manifest(memo_path, apex_manifest_path_pb):
+    try:
+        os.makedirs(APEX_MANIFEST_MEMO_DIR, exist_ok=True)
+        staging_path = f"{memo_path}.{uuid.uuid4().hex}"
+        shutil.copyfile(apex_manifest_path_pb, staging_path)
+        os.replace(staging_path, memo_path)
+    except OSError as err:
+        logging.warning(f"APEX manifest could not be memoized: {memo_path} | {err}")
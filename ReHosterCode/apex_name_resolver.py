@@ -0,0 +1,99 @@
+"""
+Resolver from vendor APEX file names to emulator APEX folders (APEX_DEFAULT_EMULATOR_PATHS_DICT) and AOSP source
+paths (APEX_DEFAULT_PATHS_DICT). The resolver is built once from the post-injector config and the listing of the
+emulator's apex folder. Every name is resolved at most once per process; misses are cached as well.
+"""
+import logging
+import os
+import re
+
+from common import remove_vendor_name_from_filename
+
+_resolver_state = {"apex_folder_path": None, "emulator_folder_set": set(), "emulator_cache": {}, "source_key_cache": {}}
+
+
+def normalize_apex_name(file_path):
+    """
+    Removes vendor words, the APEX extension and the tzdata version from an APEX file name.
+
+    :param file_path: str - path or name of the APEX file.
+    :return: str - the normalized APEX name.
+    """
+    filename_no_vendor = remove_vendor_name_from_filename(str(os.path.basename(file_path)))
+    filename_no_vendor = filename_no_vendor.replace(".apex", "").replace(".capex", "")
+    if "tzdata" in filename_no_vendor:
+        filename_no_vendor = re.sub(r'tzdata\d+', 'tzdata', filename_no_vendor)
+    return filename_no_vendor
+
+
+def match_emulator_folder_name(filename_no_vendor, emulator_paths_dict):
+    for key in emulator_paths_dict:
+        if key in filename_no_vendor:
+            if key == "media" and ("mediaprovider" in filename_no_vendor or "swcodec" in filename_no_vendor):
+                continue
+            return emulator_paths_dict[key]
+    return None
+
+
+def init_apex_name_resolver(target_out_path, post_injector_config, apex_file_list=None):
+    """
+    Builds the resolver for the emulator apex folder of target_out_path and resolves the given APEX files up front.
+
+    :param target_out_path: str - path to the emulator build output.
+    :param post_injector_config: dict - the post-injector config.
+    :param apex_file_list: list(str) - vendor APEX files to resolve ahead of the injection.
+    :return: list(str) - the APEX files that cannot be resolved to an emulator folder.
+    """
+    apex_folder_path = os.path.join(target_out_path, "apex")
+    emulator_folder_set = set(os.listdir(apex_folder_path)) if os.path.isdir(apex_folder_path) else set()
+    _resolver_state.update({"apex_folder_path": apex_folder_path,
+                            "emulator_folder_set": emulator_folder_set,
+                            "emulator_cache": {},
+                            "source_key_cache": {}})
+    unresolved_file_list = []
+    for file_path in apex_file_list or []:
+        if not resolve_emulator_apex_folder(target_out_path, file_path, post_injector_config):
+            unresolved_file_list.append(file_path)
+    logging.info(f"APEX name resolver built: {len(emulator_folder_set)} emulator APEX folders | "
+                 f"{len(apex_file_list or []) - len(unresolved_file_list)} vendor APEX files resolved")
+    if unresolved_file_list:
+        logging.warning(f"APEX files without emulator folder (merges will be skipped): {unresolved_file_list}")
+    return unresolved_file_list
+
+
+def resolve_emulator_apex_folder(target_out_path, file_path, post_injector_config):
+    """
+    Resolves a vendor APEX file to its emulator APEX folder.
+
+    :param target_out_path: str - path to the emulator build output.
+    :param file_path: str - path to the vendor APEX file.
+    :param post_injector_config: dict - the post-injector config.
+    :return: str - path to the emulator APEX folder or None if there is no matching folder.
+    """
+    if _resolver_state["apex_folder_path"] != os.path.join(target_out_path, "apex"):
+        init_apex_name_resolver(target_out_path, post_injector_config)
+    filename_no_vendor = normalize_apex_name(file_path)
+    emulator_cache = _resolver_state["emulator_cache"]
+    if filename_no_vendor not in emulator_cache:
+        folder_name = match_emulator_folder_name(filename_no_vendor,
+                                                 post_injector_config["APEX_DEFAULT_EMULATOR_PATHS_DICT"])
+        if folder_name and folder_name in _resolver_state["emulator_folder_set"]:
+            emulator_cache[filename_no_vendor] = os.path.join(_resolver_state["apex_folder_path"], folder_name)
+        else:
+            emulator_cache[filename_no_vendor] = None
+            logging.warning(f"APEX module folder not found: {filename_no_vendor} ({folder_name}) for apex {file_path}")
+    return emulator_cache[filename_no_vendor]
+
+
+def resolve_apex_source_key(filename, apex_default_paths_dict):
+    """
+    Returns the first key of APEX_DEFAULT_PATHS_DICT that is a substring of the filename.
+
+    :param filename: str - name of the APEX file.
+    :param apex_default_paths_dict: dict - the APEX_DEFAULT_PATHS_DICT of the post-injector config.
+    :return: str - the matching key or None.
+    """
+    source_key_cache = _resolver_state["source_key_cache"]
+    if filename not in source_key_cache:
+        source_key_cache[filename] = next((key for key in apex_default_paths_dict if key in filename), None)
+    return source_key_cache[filename]
@@ -0,0 +1,202 @@
+"""
+Scoped scratch workspaces for the APEX pipeline. Every APEX merge, repack or creation gets one workspace root that
+holds all its temporary trees and files. The root is placed on a tmpfs as long as the RAM budget shared by all worker
+processes allows it, otherwise it spills to disk. The workspace is removed when the APEX operation finishes, on success
+and on failure, and its peak scratch usage is logged.
+"""
+import functools
+import inspect
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from filelock import FileLock
+from config_post_injector import APEX_WORKSPACE_TMPFS_DIR, APEX_WORKSPACE_TMPFS_BUDGET, APEX_WORKSPACE_DISK_DIR, \
+    APEX_WORKSPACE_SIZE_FACTOR, APEX_WORKSPACE_MIN_RESERVATION, APEX_WORKSPACE_KEEP
+
+RESERVATION_FOLDER_NAME = ".reservations"
+_workspace_state = threading.local()
+
+
+class ApexWorkspace:
+    """
+    Scratch root of a single APEX operation. Use apex_workspace() to create one.
+    """
+    def __init__(self, name, root_path, is_tmpfs, reservation_path=None):
+        self.name = name
+        self.root_path = root_path
+        self.is_tmpfs = is_tmpfs
+        self.reservation_path = reservation_path
+        self.peak_usage = 0
+
+    def mkdtemp(self, suffix="", dir=None):
+        return tempfile.mkdtemp(suffix=suffix, dir=dir or self.root_path)
+
+    def mkstemp_path(self, suffix="", dir=None):
+        file_descriptor, file_path = tempfile.mkstemp(suffix=suffix, dir=dir or self.root_path)
+        os.close(file_descriptor)
+        return file_path
+
+    def checkpoint(self, label=""):
+        """
+        Measures the current scratch usage and updates the peak usage.
+
+        :param label: str - name of the pipeline step, for logging.
+        :return: int - current usage in bytes.
+        """
+        usage = get_tree_size(self.root_path)
+        self.peak_usage = max(self.peak_usage, usage)
+        logging.debug(f"APEX workspace {self.name} at {label}: {usage} bytes | peak: {self.peak_usage} bytes")
+        return usage
+
+
+def get_tree_size(folder_path):
+    total_size = 0
+    for root, dirs, files in os.walk(folder_path):
+        for file_name in files:
+            try:
+                total_size += os.lstat(os.path.join(root, file_name)).st_blocks * 512
+            except OSError:
+                pass
+    return total_size
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reserve_tmpfs(size_hint):
+    """
+    Reserves space of the tmpfs budget. Reservations are files named <pid>_<uuid> holding the reserved bytes, so the
+    budget is shared by all worker processes. Reservations of dead processes are removed.
+
+    :param size_hint: int - expected peak usage in bytes.
+    :return: str - path of the reservation file or None if the budget or the free tmpfs space is exceeded.
+    """
+    if APEX_WORKSPACE_TMPFS_BUDGET <= 0 or not APEX_WORKSPACE_TMPFS_DIR:
+        return None
+    reservation_dir = os.path.join(APEX_WORKSPACE_TMPFS_DIR, RESERVATION_FOLDER_NAME)
+    try:
+        os.makedirs(reservation_dir, exist_ok=True)
+        with FileLock(os.path.join(APEX_WORKSPACE_TMPFS_DIR, ".workspace.lock")):
+            reserved_bytes = 0
+            for reservation_name in os.listdir(reservation_dir):
+                reservation_file = os.path.join(reservation_dir, reservation_name)
+                if not is_process_alive(int(reservation_name.split("_")[0])):
+                    os.remove(reservation_file)
+                    continue
+                with open(reservation_file, "r") as f:
+                    reserved_bytes += int(f.read() or 0)
+            free_bytes = shutil.disk_usage(APEX_WORKSPACE_TMPFS_DIR).free
+            if reserved_bytes + size_hint > APEX_WORKSPACE_TMPFS_BUDGET or size_hint > free_bytes:
+                logging.info(f"APEX workspace tmpfs budget exceeded: reserved {reserved_bytes} + {size_hint} bytes "
+                             f"| budget {APEX_WORKSPACE_TMPFS_BUDGET} | free {free_bytes}. Spilling to disk.")
+                return None
+            reservation_path = os.path.join(reservation_dir, f"{os.getpid()}_{uuid.uuid4().hex}")
+            with open(reservation_path, "w") as f:
+                f.write(str(size_hint))
+            return reservation_path
+    except Exception as err:
+        logging.warning(f"APEX workspace tmpfs not usable at {APEX_WORKSPACE_TMPFS_DIR}: {err}")
+        return None
+
+
+@contextmanager
+def apex_workspace(name, size_hint=0):
+    """
+    Creates a scratch workspace for an APEX operation and makes it the active workspace of the current thread.
+
+    :param name: str - name of the APEX, used as suffix of the workspace folder.
+    :param size_hint: int - expected peak usage in bytes, used for the tmpfs budget.
+    """
+    size_hint = max(size_hint, APEX_WORKSPACE_MIN_RESERVATION)
+    reservation_path = reserve_tmpfs(size_hint)
+    base_dir = APEX_WORKSPACE_TMPFS_DIR if reservation_path else APEX_WORKSPACE_DISK_DIR
+    os.makedirs(base_dir, exist_ok=True)
+    workspace = ApexWorkspace(name, tempfile.mkdtemp(suffix=f"_{name}", dir=base_dir), bool(reservation_path),
+                              reservation_path)
+    logging.info(f"APEX workspace created: {workspace.root_path} | tmpfs: {workspace.is_tmpfs} | reserved: {size_hint}")
+    stack = getattr(_workspace_state, "stack", [])
+    _workspace_state.stack = stack
+    stack.append(workspace)
+    try:
+        yield workspace
+    finally:
+        stack.pop()
+        workspace.checkpoint("cleanup")
+        logging.info(f"APEX workspace {name}: peak scratch usage {workspace.peak_usage} bytes "
+                     f"| reserved: {size_hint} | tmpfs: {workspace.is_tmpfs}")
+        if APEX_WORKSPACE_KEEP:
+            logging.info(f"APEX workspace kept for debugging: {workspace.root_path}")
+        else:
+            shutil.rmtree(workspace.root_path, ignore_errors=True)
+        if reservation_path and os.path.exists(reservation_path):
+            os.remove(reservation_path)
+
+
+def scoped_apex_workspace(path_argument):
+    """
+    Decorator that runs an APEX entry point inside its own apex_workspace. The workspace is named after the file
+    passed in `path_argument` and sized by its file size.
+
+    :param path_argument: str - name of the parameter holding the APEX or binary file path.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            file_path = signature.bind(*args, **kwargs).arguments[path_argument]
+            try:
+                size_hint = os.path.getsize(file_path) * APEX_WORKSPACE_SIZE_FACTOR
+            except OSError:
+                size_hint = 0
+            with apex_workspace(os.path.basename(file_path), size_hint):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_active_workspace():
+    stack = getattr(_workspace_state, "stack", [])
+    return stack[-1] if stack else None
+
+
+def workspace_mkdtemp(suffix="", dir=None):
+    """
+    Creates a temporary directory in the active workspace, or in the default temp directory if none is active.
+    """
+    workspace = get_active_workspace()
+    if workspace:
+        return workspace.mkdtemp(suffix=suffix, dir=dir)
+    return tempfile.mkdtemp(suffix=suffix, dir=dir)
+
+
+def workspace_temp_file_path(suffix="", dir=None):
+    """
+    Creates an empty temporary file in the active workspace, or in the default temp directory if none is active.
+
+    :return: str - path to the file.
+    """
+    workspace = get_active_workspace()
+    if workspace:
+        return workspace.mkstemp_path(suffix=suffix, dir=dir)
+    file_descriptor, file_path = tempfile.mkstemp(suffix=suffix, dir=dir)
+    os.close(file_descriptor)
+    return file_path
+
+
+def workspace_checkpoint(label):
+    workspace = get_active_workspace()
+    if workspace:
+        workspace.checkpoint(label)
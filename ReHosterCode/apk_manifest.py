@@ -0,0 +1,123 @@
+"""
+Minimal reader for the binary AndroidManifest.xml (AXML) of APK files. Only the attributes of the root <manifest>
+element are decoded, which is all that is needed to select the signing key of an APK.
+"""
+import logging
+import struct
+import zipfile
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_XML_START_ELEMENT_TYPE = 0x0102
+UTF8_FLAG = 0x100
+TYPE_STRING = 0x03
+NO_INDEX = 0xFFFFFFFF
+ATTRIBUTE_RESOURCE_ID_DICT = {0x0101000b: "sharedUserId", 0x0101021b: "versionCode", 0x0101021c: "versionName"}
+_apk_manifest_memo = {}
+
+
+def read_string_pool(data, chunk_offset):
+    """
+    Decodes a string pool chunk.
+
+    :param data: bytes - AXML file content.
+    :param chunk_offset: int - offset of the string pool chunk.
+    :return: list(str) - the decoded strings.
+    """
+    header_size, _, string_count, _, flags, strings_start = struct.unpack_from("<HIIIII", data, chunk_offset + 2)
+    is_utf8 = flags & UTF8_FLAG
+    string_list = []
+    for i in range(string_count):
+        string_offset, = struct.unpack_from("<I", data, chunk_offset + header_size + i * 4)
+        position = chunk_offset + strings_start + string_offset
+        if is_utf8:
+            # UTF-16 length first, then UTF-8 byte length, each one or two bytes
+            if data[position] & 0x80:
+                position += 1
+            position += 1
+            length = data[position]
+            if length & 0x80:
+                length = ((length & 0x7F) << 8) | data[position + 1]
+                position += 1
+            position += 1
+            string_list.append(data[position:position + length].decode("utf-8", errors="ignore"))
+        else:
+            length, = struct.unpack_from("<H", data, position)
+            if length & 0x8000:
+                length = ((length & 0x7FFF) << 16) | struct.unpack_from("<H", data, position + 2)[0]
+                position += 2
+            position += 2
+            string_list.append(data[position:position + length * 2].decode("utf-16-le", errors="ignore"))
+    return string_list
+
+
+def parse_axml_manifest_attributes(data):
+    """
+    Parses the attributes of the root <manifest> element of a binary AndroidManifest.xml.
+
+    :param data: bytes - AXML file content.
+    :return: dict - attribute name -> string value, e.g. "package" and "sharedUserId".
+    """
+    string_list = []
+    resource_id_list = []
+    position = 8
+    while position + 8 <= len(data):
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, position)
+        if chunk_size == 0:
+            break
+        if chunk_type == RES_STRING_POOL_TYPE:
+            string_list = read_string_pool(data, position)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_id_count = (chunk_size - header_size) // 4
+            resource_id_list = list(struct.unpack_from(f"<{resource_id_count}I", data, position + header_size))
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            _, name_index, attribute_start, attribute_size, attribute_count = \
+                struct.unpack_from("<IIHHH", data, position + header_size)
+            if name_index >= len(string_list) or string_list[name_index] != "manifest":
+                break
+            attributes = {}
+            attribute_offset = position + header_size + attribute_start
+            for i in range(attribute_count):
+                _, attr_name_index, raw_value_index, _, _, data_type, value = \
+                    struct.unpack_from("<IIIHBBI", data, attribute_offset + i * attribute_size)
+                attr_name = string_list[attr_name_index] if attr_name_index < len(string_list) else ""
+                if not attr_name and attr_name_index < len(resource_id_list):
+                    attr_name = ATTRIBUTE_RESOURCE_ID_DICT.get(resource_id_list[attr_name_index], "")
+                if raw_value_index != NO_INDEX and raw_value_index < len(string_list):
+                    attributes[attr_name] = string_list[raw_value_index]
+                elif data_type == TYPE_STRING and value < len(string_list):
+                    attributes[attr_name] = string_list[value]
+                else:
+                    attributes[attr_name] = value
+            return attributes
+        position += chunk_size
+    return {}
+
+
+def read_apk_manifest(apk_file_path):
+    """
+    Reads the package name and the shared user id of an APK with a single read of its AndroidManifest.xml. Results
+    are memoized per process by the CRC32 and size of the manifest entry, so re-signed copies of the same APK are
+    not parsed again.
+
+    :param apk_file_path: str - path to the APK file.
+    :return: dict - {"package": str or None, "sharedUserId": str or None}.
+    """
+    manifest = {"package": None, "sharedUserId": None}
+    try:
+        with zipfile.ZipFile(apk_file_path, "r") as apk:
+            manifest_info = apk.getinfo("AndroidManifest.xml")
+            cache_key = (manifest_info.CRC, manifest_info.file_size)
+            if cache_key in _apk_manifest_memo:
+                return dict(_apk_manifest_memo[cache_key])
+            attributes = parse_axml_manifest_attributes(apk.read(manifest_info))
+    except Exception as err:
+        logging.warning(f"Could not parse AndroidManifest.xml of {apk_file_path}: {err}")
+        return manifest
+
+    for attribute_name in manifest.keys():
+        if isinstance(attributes.get(attribute_name), str):
+            manifest[attribute_name] = attributes[attribute_name]
+    _apk_manifest_memo[cache_key] = dict(manifest)
+    logging.debug(f"APK manifest of {apk_file_path}: {manifest}")
+    return manifest
@@ -0,0 +1,170 @@
+"""
+Shared compiler cache for the AOSP builds. Every firmware build runs `m clean` (or invalidates most of out/), so the
+C/C++ sources of the emulator tree are compiled again and again although they do not change between firmwares. With
+USE_CCACHE and CCACHE_EXEC set, Soong wraps every clang call with ccache, which keeps the object files in a cache
+directory outside of out/ that is shared by all firmwares and build jobs.
+
+The hits and misses of every build command are read from a per-build ccache stats log (ccache 4), or from the
+difference of the global counters for older versions, and are summed per firmware for the build metrics.
+"""
+import logging
+import os
+import shutil
+from collections import Counter
+
+from config import BUILD_CACHE_DIR, BUILD_CACHE_ENABLED, BUILD_CACHE_EXEC, BUILD_CACHE_MAX_SIZE
+from shell_command import execute_command
+
+CCACHE_HIT_COUNTERS = ["direct_cache_hit", "preprocessed_cache_hit"]
+CCACHE_MISS_COUNTERS = ["cache_miss"]
+_build_cache_memo = {}
+_firmware_cache_counters = Counter()
+
+
+def get_ccache_executable():
+    return BUILD_CACHE_EXEC or shutil.which("ccache")
+
+
+def run_ccache(ccache_path, arguments):
+    """
+    :return: tuple - (bool, str) - True if ccache succeeded, its output.
+    """
+    return execute_command([ccache_path] + arguments, env=dict(os.environ, CCACHE_DIR=BUILD_CACHE_DIR))
+
+
+def setup_build_cache():
+    """
+    Creates and configures the cache directory once per process.
+
+    :return: str - path to the ccache executable or None if the cache is disabled or ccache is not installed.
+    """
+    if "ccache_path" in _build_cache_memo:
+        return _build_cache_memo["ccache_path"]
+    ccache_path = None
+    if BUILD_CACHE_ENABLED:
+        ccache_path = get_ccache_executable()
+        if not ccache_path:
+            logging.warning("ccache is not installed, building without compiler cache. Set FMD_BUILD_CACHE=False to "
+                            "silence this warning.")
+        else:
+            os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+            # Prebuilt clang binaries of different checkouts have different mtimes, their content is the same. The
+            # working directory only ends up in the debug info and must not split the cache between checkouts.
+            for setting in [f"max_size={BUILD_CACHE_MAX_SIZE}", "compiler_check=content", "hash_dir=false"]:
+                is_success, log = run_ccache(ccache_path, ["-o", setting])
+                if not is_success:
+                    logging.warning(f"Could not set ccache option {setting}: {log}")
+            logging.info(f"Using ccache {ccache_path} with cache {BUILD_CACHE_DIR} ({BUILD_CACHE_MAX_SIZE})")
+    _build_cache_memo["ccache_path"] = ccache_path
+    return ccache_path
+
+
+def get_build_cache_environment(aosp_root_path, stats_log_path):
+    """
+    :param aosp_root_path: str - root path of the AOSP source code. Paths below it are hashed relative to it, so
+        different checkouts and source overlays share the cache entries.
+    :param stats_log_path: str - file ccache logs the statistics of this build to.
+    :return: dict - environment variables for the build command, empty without cache.
+    """
+    ccache_path = setup_build_cache()
+    if not ccache_path:
+        return {}
+    return {
+        "USE_CCACHE": "1",
+        "CCACHE_EXEC": ccache_path,
+        "CCACHE_DIR": BUILD_CACHE_DIR,
+        "CCACHE_BASEDIR": os.path.abspath(aosp_root_path),
+        "CCACHE_STATSLOG": stats_log_path,
+    }
+
+
+def read_ccache_counters():
+    """
+    :return: Counter - global counters of the cache, empty if ccache is not available.
+    """
+    ccache_path = setup_build_cache()
+    counters = Counter()
+    if not ccache_path:
+        return counters
+    is_success, log = run_ccache(ccache_path, ["--print-stats"])
+    if not is_success:
+        logging.debug(f"Could not read ccache statistics: {log}")
+        return counters
+    for line in log.splitlines():
+        key, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            counters[key.strip()] = int(value)
+    return counters
+
+
+def read_stats_log(stats_log_path):
+    """
+    Counts the statistics of a ccache stats log, which lists the counters of every compilation below a "# <file>"
+    line.
+
+    :return: Counter - counters of the logged compilations.
+    """
+    counters = Counter()
+    with open(stats_log_path, "r", errors="ignore") as stats_log_file:
+        for line in stats_log_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                counters[line] += 1
+    return counters
+
+
+def get_hit_statistics(counters, cache_counters):
+    """
+    :param counters: Counter - hit and miss counters of one or more builds.
+    :param cache_counters: Counter - global counters of the cache, for the average object size.
+    :return: dict - hits, misses, hit rate and the estimated bytes of object files that were not compiled.
+    """
+    hits = sum(counters[key] for key in CCACHE_HIT_COUNTERS)
+    misses = sum(counters[key] for key in CCACHE_MISS_COUNTERS)
+    cache_size = cache_counters.get("cache_size_kibibyte", 0) * 1024
+    files_in_cache = cache_counters.get("files_in_cache", 0)
+    average_object_size = cache_size // files_in_cache if files_in_cache else 0
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0,
+        "estimated_bytes_saved": hits * average_object_size,
+        "cache_size": cache_size,
+    }
+
+
+def record_build_cache_statistics(counters_before, stats_log_path):
+    """
+    Reads the hits and misses of a finished build command and adds them to the counters of the firmware.
+
+    :param counters_before: Counter - global counters read before the build, used without stats log.
+    :param stats_log_path: str - stats log of the build.
+    :return: dict - statistics of the build, see get_hit_statistics.
+    """
+    cache_counters = read_ccache_counters()
+    if os.path.exists(stats_log_path):
+        counters = read_stats_log(stats_log_path)
+        os.remove(stats_log_path)
+    else:
+        counters = cache_counters - counters_before
+    _firmware_cache_counters.update({key: counters[key] for key in CCACHE_HIT_COUNTERS + CCACHE_MISS_COUNTERS})
+    statistics = get_hit_statistics(counters, cache_counters)
+    logging.info(f"ccache: {statistics['hits']} hits, {statistics['misses']} misses, hit rate "
+                 f"{statistics['hit_rate']:.1%}, ~{statistics['estimated_bytes_saved'] / 1024 ** 2:.1f} MiB "
+                 f"of objects not compiled")
+    return statistics
+
+
+def reset_firmware_build_cache_statistics():
+    _firmware_cache_counters.clear()
+
+
+def pop_firmware_build_cache_statistics():
+    """
+    :return: dict - statistics of all build commands since the last call, None without cache.
+    """
+    if not setup_build_cache():
+        return None
+    statistics = get_hit_statistics(_firmware_cache_counters, read_ccache_counters())
+    reset_firmware_build_cache_statistics()
+    return statistics
@@ -0,0 +1,170 @@
+"""
+Early detection of fatal AOSP build failures. The output of a build command is streamed line by line into its log and
+matched against a library of known fatal patterns (duplicate modules, undefined dependencies, images too large for
+their partition, a full disk, ...). On the first match the build is aborted right away instead of after the remaining
+hours of the build, and the failure is classified, so the caller can apply the fix of a retryable class before the
+next attempt. The failures of a firmware are collected for its build result record.
+"""
+import logging
+import os
+import re
+import signal
+import subprocess
+
+from config import BUILD_FAIL_FAST, MODULE_BASE_INJECT_DIR
+
+BUILD_TERMINATE_TIMEOUT = 30
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+INJECTED_PATH_PATTERN = re.compile(rf"(?P<path>{re.escape(MODULE_BASE_INJECT_DIR)}[^\s:'\"]+)")
+FATAL_BUILD_PATTERNS = [
+    # Soong and Kati report a module name that is defined twice
+    {"class": "duplicate_module", "retryable": True,
+     "pattern": re.compile(r'module "(?P<module>[^"]+)" already defined')},
+    {"class": "duplicate_module", "retryable": True,
+     "pattern": re.compile(r"MODULE\.[A-Z_]+\.[A-Z_]+\.(?P<module>\S+) already defined by")},
+    {"class": "missing_dependency", "retryable": True,
+     "pattern": re.compile(r'"(?P<module>[^"]+)" depends on undefined module "(?P<dependency>[^"]+)"')},
+    {"class": "missing_dependency", "retryable": True,
+     "pattern": re.compile(r"(?P<module>[\w.+-]+) \([A-Z_]+ [\w-]+\) missing (?P<dependency>[\w.+-]+) \([A-Z_]+ "
+                           r"[\w-]+\)")},
+    {"class": "partition_too_large", "retryable": True,
+     "pattern": re.compile(r"(?P<module>[\w.-]+\.img) too large \(\d+ > \d+\)")},
+    {"class": "partition_too_large", "retryable": True,
+     "pattern": re.compile(r"Out of space\? Out of inodes\?")},
+    {"class": "partition_too_large", "retryable": True,
+     "pattern": re.compile(r"(larger than|exceeds?) BOARD_\w*SIZE")},
+    {"class": "disk_full", "retryable": False,
+     "pattern": re.compile(r"No space left on device")},
+    {"class": "out_of_memory", "retryable": False,
+     "pattern": re.compile(r"Killed signal terminated program|java\.lang\.OutOfMemoryError|Cannot allocate memory")},
+]
+_firmware_build_failures = []
+
+
+class BuildFailureError(subprocess.CalledProcessError):
+    """
+    Raised for a failed build command, with the classified failure as dict in the failure attribute.
+    """
+    def __init__(self, returncode, command, failure):
+        super().__init__(returncode, command)
+        self.failure = failure
+
+    def __str__(self):
+        return f"Build failed with {self.failure['class']}: {self.failure['line']}"
+
+
+def match_fatal_pattern(line):
+    """
+    :param line: str - line of the build output.
+    :return: dict - failure with "class", "retryable", "line" and the "module", "dependency" and injected "path" found
+        in the line, None if the line matches no fatal pattern.
+    """
+    line = ANSI_ESCAPE_PATTERN.sub("", line).strip()
+    # e.g. missing dependencies are only reported as warnings with ALLOW_MISSING_DEPENDENCIES
+    if "warning:" in line.lower():
+        return None
+    for fatal_pattern in FATAL_BUILD_PATTERNS:
+        match = fatal_pattern["pattern"].search(line)
+        if match:
+            path_match = INJECTED_PATH_PATTERN.search(line)
+            return {
+                "class": fatal_pattern["class"],
+                "retryable": fatal_pattern["retryable"],
+                "line": line,
+                "module": match.groupdict().get("module"),
+                "dependency": match.groupdict().get("dependency"),
+                "path": path_match.group("path") if path_match else None,
+            }
+    return None
+
+
+def terminate_process_group(process):
+    """
+    Stops the build with all its children (soong_ui, ninja, compilers), which run in the session of the process.
+    """
+    for kill_signal in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, kill_signal)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout=BUILD_TERMINATE_TIMEOUT)
+            return
+        except subprocess.TimeoutExpired:
+            logging.warning(f"Build process {process.pid} did not stop on {kill_signal.name}")
+
+
+def run_build_command_streamed(command, cwd, log_path, env=None):
+    """
+    Runs a build command and writes its output to log_path while matching every line against the fatal patterns.
+    With FMD_BUILD_FAIL_FAST the build is stopped on the first match.
+
+    :param command: str - shell command to execute.
+    :param cwd: str - working directory of the command.
+    :param log_path: str - path of the build log.
+    :param env: dict - environment of the command.
+    :return: tuple - (int, dict) - return code, classified failure or None if the command succeeded.
+    """
+    failure = None
+    last_error_line = None
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
+                                   env=env, start_new_session=True)
+        try:
+            for raw_line in process.stdout:
+                log_file.write(raw_line)
+                if failure:
+                    continue
+                line = raw_line.decode("utf-8", errors="ignore")
+                if "error" in line.lower():
+                    last_error_line = ANSI_ESCAPE_PATTERN.sub("", line).strip()
+                failure = match_fatal_pattern(line)
+                if failure and BUILD_FAIL_FAST:
+                    logging.error(f"Aborting build on fatal {failure['class']}: {failure['line']}")
+                    terminate_process_group(process)
+                    break
+            returncode = process.wait()
+        except BaseException:
+            # The build runs in its own session and does not get the SIGINT of the terminal
+            terminate_process_group(process)
+            raise
+        finally:
+            process.stdout.close()
+    if returncode == 0:
+        return returncode, None
+    if not failure:
+        failure = {"class": "unknown", "retryable": True, "line": last_error_line, "module": None,
+                   "dependency": None, "path": None}
+    return returncode, failure
+
+
+def record_build_failure(failure, step):
+    """
+    Adds a failure to the failures of the current firmware.
+
+    :param step: str - name of the failed build step, e.g. "m".
+    """
+    _firmware_build_failures.append(dict(failure, step=step))
+
+
+def record_build_fix(fix):
+    """
+    Adds the fix applied before the next attempt to the last recorded failure.
+
+    :param fix: str - description of the fix.
+    """
+    if _firmware_build_failures:
+        _firmware_build_failures[-1]["fix"] = fix
+
+
+def reset_firmware_build_failures():
+    _firmware_build_failures.clear()
+
+
+def pop_firmware_build_failures():
+    """
+    :return: list(dict) - failures recorded since the last call.
+    """
+    failure_list = list(_firmware_build_failures)
+    reset_firmware_build_failures()
+    return failure_list
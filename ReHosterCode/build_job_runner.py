@@ -0,0 +1,118 @@
+"""
+Runs several firmware build pipelines concurrently against one AOSP checkout. Every job is a separate
+aosp_build_injector.py process for a single firmware with its own OUT_DIR, extraction directory, log directory and
+metrics records (FMD_BUILD_OUT_PATH). Job slots are reused, so consecutive firmwares of a slot share an OUT_DIR and
+profit from incremental builds. The phases that modify or build from the shared source tree are serialized by the
+source tree lock of the build injector, unless every job works on its own source overlay (--source-overlay).
+"""
+import logging
+import os
+import queue
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import ROOT_PATH, BUILD_OUT_PATH, BUILD_JOB_OUT_DIR_ROOT, BUILD_JOBS_DIR_NAME
+
+
+def get_job_slot_paths(aosp_path, slot):
+    """
+    Returns the directories of a job slot.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param slot: int - index of the job slot.
+    :return: tuple - (str, str) - build out path of the injector, aosp OUT_DIR.
+    """
+    job_name = f"job_{slot}"
+    job_build_out_path = os.path.join(BUILD_OUT_PATH, BUILD_JOBS_DIR_NAME, job_name, "")
+    job_out_dir_root = BUILD_JOB_OUT_DIR_ROOT or f"{os.path.normpath(aosp_path)}_out_{BUILD_JOBS_DIR_NAME}"
+    return job_build_out_path, os.path.join(job_out_dir_root, job_name)
+
+
+def get_build_jobs_share(build_jobs, job_count):
+    """
+    Splits the global -j budget across the jobs.
+
+    :param build_jobs: int - global -j budget, 0 if "m" decides.
+    :param job_count: int - number of concurrent jobs.
+    :return: int - -j of a single job, 0 if "m" decides.
+    """
+    if build_jobs <= 0:
+        return 0
+    return max(1, build_jobs // job_count)
+
+
+def run_build_job(firmware_id, slot_queue, aosp_path, build_jobs_share, fmd_password, docker_repo_password):
+    """
+    Runs the build pipeline of a single firmware in a free job slot.
+
+    :return: tuple - (str, bool, int) - firmware id, True if the job succeeded, job slot.
+    """
+    slot = slot_queue.get()
+    try:
+        job_build_out_path, job_out_dir = get_job_slot_paths(aosp_path, slot)
+        os.makedirs(job_build_out_path, exist_ok=True)
+        os.makedirs(job_out_dir, exist_ok=True)
+        env = os.environ.copy()
+        env.update({"FMD_BUILD_OUT_PATH": job_build_out_path,
+                    "OUT_DIR": job_out_dir,
+                    "FMD_PASSWORD": fmd_password,
+                    "DOCKER_REPO_PASSWORD": docker_repo_password})
+        command = [sys.executable, os.path.join(ROOT_PATH, "aosp_build_injector.py")] + sys.argv[1:] \
+            + ["--parallel-jobs", "1", "--build-jobs", str(build_jobs_share), "--firmware-id", firmware_id]
+        log_path = os.path.join(job_build_out_path, f"{firmware_id}_job.log")
+        logging.info(f"Build job {slot} started for firmware-id: {firmware_id} | OUT_DIR: {job_out_dir} "
+                     f"| log: {log_path}")
+        start_time = time.time()
+        with open(log_path, "a") as log_file:
+            result = subprocess.run(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        logging.info(f"Build job {slot} finished for firmware-id: {firmware_id} with exit code {result.returncode} "
+                     f"after {time.time() - start_time:.2f} seconds.")
+        return firmware_id, result.returncode == 0, slot
+    finally:
+        slot_queue.put(slot)
+
+
+def run_build_jobs(args, firmware_id_list, fmd_password, docker_repo_password):
+    """
+    Builds the firmwares with args.parallel_jobs concurrent jobs.
+
+    :param args: argparse.Namespace - command line arguments of the build injector.
+    :param firmware_id_list: list(str) - object-ids of the firmwares to build.
+    :param fmd_password: str - password for the FirmwareDroid service.
+    :param docker_repo_password: str - password for the docker registry.
+    :return: list(str) - firmware ids of the failed jobs.
+    """
+    job_count = max(1, min(args.parallel_jobs, len(firmware_id_list)))
+    build_jobs_share = get_build_jobs_share(args.build_jobs, job_count)
+    logging.info(f"Running {len(firmware_id_list)} firmware builds with {job_count} parallel jobs "
+                 f"| -j per job: {build_jobs_share or 'default'}")
+    slot_queue = queue.Queue()
+    for slot in range(job_count):
+        slot_queue.put(slot)
+
+    failed_firmware_ids = []
+    succeed_firmware_ids = []
+    with ThreadPoolExecutor(max_workers=job_count) as executor:
+        future_dict = {executor.submit(run_build_job, firmware_id, slot_queue, args.aosp_path, build_jobs_share,
+                                       fmd_password, docker_repo_password): firmware_id
+                       for firmware_id in firmware_id_list}
+        for future in as_completed(future_dict):
+            firmware_id = future_dict[future]
+            try:
+                _, is_success, _ = future.result()
+            except Exception as err:
+                logging.error(f"Build job error for firmware-id: {firmware_id}: {err}")
+                is_success = False
+            if is_success:
+                succeed_firmware_ids.append(firmware_id)
+            else:
+                failed_firmware_ids.append(firmware_id)
+
+    if len(failed_firmware_ids) > 0:
+        logging.error(f"Failed to build {len(failed_firmware_ids)} of the following firmware ids: "
+                      f"{failed_firmware_ids} for arch: {args.arch}")
+    logging.info(f"Successfully built {len(succeed_firmware_ids)} of the following firmware ids: "
+                 f"{succeed_firmware_ids} for arch: {args.arch}")
+    return failed_firmware_ids
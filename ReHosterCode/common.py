@@ -1,16 +1,79 @@
 import logging
 import os
 import re
-import zipfile
+import shutil
 from ConfigManager import ConfigManager
 from config import VENDOR_NAMES
+from parallel_unzip import extract_zip_parallel
 import hashlib
 
 
-def extract_zip(file_path, destination):
+def get_aosp_out_path(aosp_path, out_relative_path="out"):
+    """
+    Resolves a path below the AOSP out/ folder. Honors OUT_DIR, which is set per job by the build job runner and
+    for source overlays.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param out_relative_path: str - path relative to the aosp root, starting with "out".
+    :return: str - absolute path.
+    """
+    aosp_out_dir = os.environ.get("OUT_DIR")
+    if aosp_out_dir and (out_relative_path == "out" or out_relative_path.startswith("out/")):
+        return os.path.join(aosp_out_dir, out_relative_path[4:])
+    return os.path.join(aosp_path, out_relative_path)
+
+
+def extract_zip(file_path, destination, skip_unchanged=False):
     print(f"Extracting {file_path} to {destination}")
-    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        zip_ref.extractall(destination)
+    extract_zip_parallel(file_path, destination, skip_unchanged=skip_unchanged)
+
+
+def clone_file(source_path, destination_path):
+    """
+    Copies a file with copy_file_range, which shares the data blocks on filesystems with reflink support
+    (btrfs, XFS). Falls back to a regular copy.
+    """
+    try:
+        with open(source_path, "rb") as source_file, open(destination_path, "wb") as destination_file:
+            remaining = os.fstat(source_file.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        shutil.copystat(source_path, destination_path)
+    except (AttributeError, OSError):
+        shutil.copy2(source_path, destination_path)
+    return destination_path
+
+
+def link_or_copy_file(source_path, destination_path):
+    """
+    copy_function for shutil.copytree: hardlinks the file if source and destination are on the same filesystem,
+    otherwise clones or copies it.
+
+    :param source_path: str - path of the file to copy.
+    :param destination_path: str - path of the copy.
+    :return: str - destination_path.
+    """
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+    if os.path.islink(source_path):
+        # link() would link the symlink itself, copytree copies the target
+        return clone_file(source_path, destination_path)
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        clone_file(source_path, destination_path)
+    return destination_path
+
+
+def copy_tree_linked(source_path, destination_path):
+    """
+    Copies a folder like shutil.copytree, but hardlinks or clones the files instead of copying their data. Only use
+    it for files that are neither modified in the source nor in the copy afterwards.
+    """
+    return shutil.copytree(source_path, destination_path, copy_function=link_or_copy_file, dirs_exist_ok=True)
 
 
 def extract_vendor_name(filename, directory=None):
@@ -38,7 +38,13 @@ BASE_FILENAMES = [BASE_PRODUCT_FILE_NAME,
                   BASE_HANDHELD_SYSTEM_EXE_FILE_NAME,
                   BASE_HANDHELD_PRODUCT_FILE_NAME,
                   BASE_HANDHELD_VENDOR_FILE_NAME]
-BUILD_OUT_PATH = os.path.join(ROOT_PATH, "out/")
+BUILD_OUT_PATH = os.path.join(os.environ.get("FMD_BUILD_OUT_PATH", os.path.join(ROOT_PATH, "out")), "")
+BUILD_JOBS = int(os.environ.get("FMD_BUILD_JOBS", "0"))
+BUILD_JOB_OUT_DIR_ROOT = os.environ.get("FMD_BUILD_JOB_OUT_DIR", "")
+BUILD_JOBS_DIR_NAME = "jobs"
+SOURCE_TREE_LOCK_FILENAME = ".fmd-source-tree.lock"
+SOURCE_OVERLAY = os.environ.get("FMD_SOURCE_OVERLAY") == "True"
+SOURCE_OVERLAY_DIR = os.environ.get("FMD_SOURCE_OVERLAY_DIR", os.path.join(BUILD_OUT_PATH, "source_overlay"))
 AOSP_BUILD_OUT_SDK_ARM64_PATH = "out/target/product/emulator_arm64/"
 AOSP_BUILD_OUT_SDK_ARM64_x64_PATH = "out/target/product/emulator64_arm64/"
 AOSP_BUILD_OUT_SDK_ARM64_x64_PATH_A14 = "out/target/product/emu64a/"
@@ -62,6 +68,8 @@ NAME_BUILD_FILE_LOG = "results_build_times.json"
 NAME_BUILD_INJECTOR_LOG = "results_build_injector.json"
 PATH_BUILD_FILE_LOG = os.path.join(BUILD_OUT_PATH, NAME_BUILD_FILE_LOG)
 PATH_BUILD_INJECTOR_LOG = os.path.join(BUILD_OUT_PATH, NAME_BUILD_INJECTOR_LOG)
+NAME_PARTITION_SIZE_LOG = "results_partition_sizes.json"
+PATH_PARTITION_SIZE_LOG = os.path.join(BUILD_OUT_PATH, NAME_PARTITION_SIZE_LOG)
 FILE_CONTEXT_TEMPLATE_PATH = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "file_contexts")
 APEX_PRIVATE_KEY_PATH = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "apex.key")
 APEX_PUBKEY_PATH = os.path.join(ROOT_PATH, TEMPLATE_FOLDER, "apex.x509.pem")
@@ -87,9 +95,33 @@ FMD_CSRF_URL_TEMPLATE = "${url}/csrf/"
 PACKAGE_EXTRACTION_DIR_NAME = "extracted_packages"
 EXTRACTION_ALL_FILES_DIR_NAME = "ALL_FILES"
 EXTRACTED_PACKAGES_PATH = str(os.path.join(BUILD_OUT_PATH, PACKAGE_EXTRACTION_DIR_NAME))
+PREFETCH_DIR = os.path.join(BUILD_OUT_PATH, "prefetch")
+PREFETCH_DEPTH = int(os.environ.get("FMD_PREFETCH_DEPTH", "1"))
+PREFETCH_DISK_BUDGET = int(os.environ.get("FMD_PREFETCH_DISK_BUDGET", str(64 * 1024 ** 3)))
+KEEP_BUILD_FILES_ARCHIVE = os.environ.get("FMD_KEEP_BUILD_FILES_ARCHIVE") == "True"
+EXTRACT_ZIP_WORKERS = int(os.environ.get("FMD_EXTRACT_ZIP_WORKERS", "0"))
+TRACE_DIR = os.path.join(BUILD_OUT_PATH, "traces")
+TRACE_ENABLED = os.environ.get("FMD_TRACE", "True") == "True"
+TEMPLATE_BYTECODE_CACHE_DIR = os.path.join(BUILD_OUT_PATH, "template_cache")
+STAGING_WORKERS = int(os.environ.get("FMD_STAGING_WORKERS", "0"))
+STAGING_LINK_FILES = os.environ.get("FMD_STAGING_LINK_FILES", "True") == "True"
+PARTITION_RIGHT_SIZING = os.environ.get("FMD_PARTITION_RIGHT_SIZING", "True") == "True"
+PARTITION_HEADROOM_PERCENT = int(os.environ.get("FMD_PARTITION_HEADROOM_PERCENT", "10"))
+PARTITION_MIN_HEADROOM = int(os.environ.get("FMD_PARTITION_MIN_HEADROOM", str(64 * 1024 ** 2)))
+PARTITION_BASE_SIZE = int(os.environ.get("FMD_PARTITION_BASE_SIZE", str(4 * 1024 ** 3)))
+BUILD_CACHE_ENABLED = os.environ.get("FMD_BUILD_CACHE", "True") == "True"
+# Not below BUILD_OUT_PATH, which is separate for every build job
+BUILD_CACHE_DIR = os.environ.get("FMD_BUILD_CACHE_DIR", os.path.join(ROOT_PATH, "out", "ccache"))
+BUILD_CACHE_MAX_SIZE = os.environ.get("FMD_BUILD_CACHE_MAX_SIZE", "100G")
+BUILD_CACHE_EXEC = os.environ.get("FMD_BUILD_CACHE_EXEC")
+BUILD_FAIL_FAST = os.environ.get("FMD_BUILD_FAIL_FAST", "True") == "True"
+BUILD_FAILURE_MAX_FIXES = int(os.environ.get("FMD_BUILD_FAILURE_MAX_FIXES", "3"))
 VERIFY_SSL = False  # You can suppress warnings with: export PYTHONWARNINGS="ignore:Unverified HTTPS request"
 
 MODULE_BASE_INJECT_DIR = "packages/modules/fmd/"
+INCREMENTAL_BUILD = os.environ.get("FMD_INCREMENTAL_BUILD") == "True"
+INCREMENTAL_BUILD_STATE_FILENAME = ".fmd-incremental-build-state.json"
+INCREMENTAL_BUILD_STAGING_DIRS = ["system", "system_ext", "vendor", "product", "odm", "apex", "data"]
 
 VENDOR_NAMES = [
     "Google", "Samsung", "Apple", "Huawei", "Xiaomi", "Oppo", "Vivo", "OnePlus",
@@ -19,3 +19,34 @@ MODULE_TYPE_ABI_COMPATIBLE = ["SHARED_LIBRARIES", "EXECUTABLES", "ETC"]
 NAME_EXECUTION_TIME_LOG = "results_post_build_injector_metrics.json"
 PATH_EXECUTION_TIME_LOG = os.path.join(BUILD_OUT_PATH, NAME_EXECUTION_TIME_LOG)
 
+# The caches are shared by all build jobs, so they are not below BUILD_OUT_PATH, which is separate for every job
+APEX_CACHE_DIR = os.environ.get("FMD_APEX_CACHE_DIR", os.path.join(ROOT_PATH, "out", "apex_cache"))
+APEX_CACHE_MAX_BYTES = int(os.environ.get("FMD_APEX_CACHE_MAX_BYTES", 1073741824 * 20))  # 20GB
+APEX_CACHE_ENABLED = os.environ.get("FMD_APEX_CACHE_DISABLED") != "True"
+APEX_CACHE_CONFIG_KEYS = ["CHECK_VNDK_VERSION_MISMATCH",
+                          "EMULATOR_VNDK_VERSION",
+                          "ALLOW_MIXED_APEX_FILES",
+                          "ALLOW_MIXED_APEX_KEYWORD_LIST",
+                          "INJECT_APEX_VENDOR_FILES",
+                          "INJECT_APEX_VENDOR_APPS",
+                          "DISABLE_APEX_BINARY_INJECTION",
+                          "DISALLOW_APEX_FILE_OVERWRITE",
+                          "ALLOWED_APEX_FILE_INJECTION_EXTENSIONS",
+                          "DISALLOW_APEX_FILE_INJECTION_EXTENSIONS",
+                          "APEX_DEFAULT_PATHS_DICT",
+                          "APEX_DEFAULT_EMULATOR_PATHS_DICT",
+                          "SHARED_USER_ID_MAPPING_DICT"]
+APEX_LANE_MAX_WORKERS = int(os.environ.get("FMD_APEX_LANE_MAX_WORKERS", 0))  # 0 = derive from CPU and memory
+APEX_LANE_CPUS_PER_JOB = 4
+APEX_LANE_MEMORY_PER_JOB = 1073741824 * 3  # 3GB
+CAPEX_PREDECOMPRESS_DIR = os.environ.get("FMD_CAPEX_PREDECOMPRESS_DIR", os.path.join(BUILD_OUT_PATH, "capex_predecompressed"))
+APEX_WORKSPACE_TMPFS_DIR = os.environ.get("FMD_APEX_TMPFS_DIR", "/dev/shm/fmd_apex_workspace")
+APEX_WORKSPACE_TMPFS_BUDGET = int(os.environ.get("FMD_APEX_TMPFS_BUDGET", 1073741824 * 8))  # 8GB, 0 = disk only
+APEX_WORKSPACE_DISK_DIR = os.environ.get("FMD_APEX_WORKSPACE_DIR", os.path.join(BUILD_OUT_PATH, "apex_workspace"))
+APEX_WORKSPACE_SIZE_FACTOR = 4  # extracted vendor tree + merged tree + payload image + output
+APEX_WORKSPACE_MIN_RESERVATION = 1073741824 // 2  # 512MB
+APEX_WORKSPACE_KEEP = os.environ.get("FMD_APEX_KEEP_WORKSPACE", "False") == "True"
+EMULATOR_APEX_CACHE_DIR = os.environ.get("FMD_EMULATOR_APEX_CACHE_DIR", os.path.join(ROOT_PATH, "out", "emulator_apex_cache"))
+# Only helps with a disk APEX workspace on a reflink-capable filesystem shared with EMULATOR_APEX_CACHE_DIR
+EMULATOR_APEX_CACHE_ENABLED = os.environ.get("FMD_EMULATOR_APEX_CACHE", "False") == "True"
+APEX_MANIFEST_MEMO_DIR = os.environ.get("FMD_APEX_MANIFEST_MEMO_DIR", os.path.join(ROOT_PATH, "out", "apex_manifest_memo"))
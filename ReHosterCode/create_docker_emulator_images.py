@@ -12,6 +12,7 @@ from werkzeug.utils import secure_filename
 import platform
 from common import extract_zip
 from fmd_backend_requests import download_file, fetch_emulator_image_list
+from pipeline_trace import start_trace, stop_trace, trace_span
 from setup_logger import setup_logger
 
 setup_logger()
@@ -272,25 +273,34 @@ def process_images(input_dir, docker_repo_url, repository_username, build_local)
     logging.info(f"Processing images: {len(emulator_zip_file_list)}")
     for emulator_zip_path in emulator_zip_file_list:
         logging.info(f"Processing emulator image: {emulator_zip_path}")
-        extract_emulator_images_to_image_artefacts(emulator_zip_path)
         filename = os.path.basename(emulator_zip_path)
-        if "arm64" in filename:
-            docker_build_arch = "linux/arm64"
-        elif "x86_64" in filename:
-            docker_build_arch = "linux/amd64"
-        else:
-            logging.error(f"Unsupported architecture in filename: {filename}. Skipping.")
-            continue
-        logging.info(f"Building emulator image: {filename} for architecture: {docker_build_arch}")
-        build_container_image(filename.replace(".zip", ""), docker_build_arch)
-        if not build_local:
-            repository_password = get_repo_password(repository_username)
-            authenticate_docker_registry(docker_repo_url, repository_username, repository_password)
-            push_container_image(docker_repo_url, filename.replace(".zip", ""))
-        else:
-            logging.info("Skipped pushing the image to the docker repository. Only local build.")
-        clear_image_artefacts()
-        clear_docker_builder()
+        start_trace(filename.replace(".zip", ""))
+        try:
+            with trace_span("emulator_image", category="docker", filename=filename,
+                            bytes=os.path.getsize(emulator_zip_path)):
+                extract_emulator_images_to_image_artefacts(emulator_zip_path)
+                if "arm64" in filename:
+                    docker_build_arch = "linux/arm64"
+                elif "x86_64" in filename:
+                    docker_build_arch = "linux/amd64"
+                else:
+                    logging.error(f"Unsupported architecture in filename: {filename}. Skipping.")
+                    continue
+                logging.info(f"Building emulator image: {filename} for architecture: {docker_build_arch}")
+                with trace_span("docker build", category="subprocess", arch=docker_build_arch):
+                    build_container_image(filename.replace(".zip", ""), docker_build_arch)
+                if not build_local:
+                    repository_password = get_repo_password(repository_username)
+                    authenticate_docker_registry(docker_repo_url, repository_username, repository_password)
+                    with trace_span("docker push", category="subprocess", repository_url=docker_repo_url):
+                        push_container_image(docker_repo_url, filename.replace(".zip", ""))
+                else:
+                    logging.info("Skipped pushing the image to the docker repository. Only local build.")
+                with trace_span("clear_docker_builder", category="docker"):
+                    clear_image_artefacts()
+                    clear_docker_builder()
+        finally:
+            stop_trace()
     logging.info("Finished processing images.")
 
 
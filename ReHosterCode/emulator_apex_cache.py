@@ -0,0 +1,100 @@
+"""
+Per-(aosp_path, lunch_target) cache of emulator-side APEX trees. The emulator side of an APEX merge is the same for
+every firmware built with the same AOSP tree, so the tree is materialized once and reflinked into each merge workspace.
+Snapshots are immutable: every content digest of the emulator folder gets its own snapshot folder, which is published
+with a rename and never replaced or removed by the pipeline, so concurrent clones cannot see a half-written or
+half-deleted tree. Snapshots of older emulator builds stay until the cache folder is deleted.
+
+A snapshot only pays off if it can be reflinked, so the cache is off by default: the default APEX workspace is on tmpfs,
+which cannot share reflinks with the cache. With FMD_EMULATOR_APEX_CACHE=True the emulator folder is still copied
+directly if the workspace is on another filesystem than the cache or the filesystem does not support reflinks.
+Converted manifests are memoized by apex_manifest_converter.
+"""
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+
+from filelock import FileLock
+from apex_cache import get_folder_digest
+from config_post_injector import EMULATOR_APEX_CACHE_DIR, EMULATOR_APEX_CACHE_ENABLED
+
+REFLINK_UNSUPPORTED_MESSAGES = ["not supported", os.strerror(errno.EXDEV).lower()]
+# st_dev of the workspace filesystem -> bool, False once a reflink from the cache failed
+_reflink_support_memo = {}
+
+
+def get_cache_root(aosp_path, lunch_target):
+    cache_key = hashlib.sha1(f"{os.path.abspath(aosp_path)}|{lunch_target}".encode()).hexdigest()[:16]
+    return os.path.join(EMULATOR_APEX_CACHE_DIR, cache_key)
+
+
+def is_reflink_possible(dst_folder_path):
+    """
+    :param dst_folder_path: str - existing destination folder of a clone.
+    :return: bool - True if the cache and the destination share a filesystem and no reflink onto it failed yet.
+    """
+    os.makedirs(EMULATOR_APEX_CACHE_DIR, exist_ok=True)
+    dst_device = os.stat(dst_folder_path).st_dev
+    if os.stat(EMULATOR_APEX_CACHE_DIR).st_dev != dst_device:
+        return False
+    return _reflink_support_memo.get(dst_device, True)
+
+
+def materialize_emulator_apex_tree(aosp_path, lunch_target, apex_emulator_folder):
+    """
+    Returns the snapshot of the emulator APEX folder for its current content. The snapshot is created on the first
+    call for a content digest.
+
+    :param aosp_path: str - path to the AOSP source tree.
+    :param lunch_target: str - lunch target of the AOSP build.
+    :param apex_emulator_folder: str - path to the emulator APEX folder.
+    :return: str - path to the snapshot, or the emulator folder itself if the cache is not writable.
+    """
+    snapshot_path = os.path.join(get_cache_root(aosp_path, lunch_target),
+                                 os.path.basename(os.path.normpath(apex_emulator_folder)),
+                                 get_folder_digest(apex_emulator_folder))
+    if os.path.isdir(snapshot_path):
+        return snapshot_path
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with FileLock(f"{snapshot_path}.lock"):
+            if os.path.isdir(snapshot_path):
+                return snapshot_path
+            staging_path = f"{snapshot_path}.staging_{uuid.uuid4().hex}"
+            shutil.copytree(apex_emulator_folder, staging_path)
+            os.rename(staging_path, snapshot_path)
+            logging.info(f"Emulator APEX tree cached: {apex_emulator_folder} -> {snapshot_path}")
+    except Exception as err:
+        logging.warning(f"Emulator APEX tree cache not usable for {apex_emulator_folder}: {err}")
+        return apex_emulator_folder
+    return snapshot_path
+
+
+def clone_emulator_apex_tree(aosp_path, lunch_target, apex_emulator_folder, dst_folder_path):
+    """
+    Clones the emulator APEX folder into an existing merge workspace folder. Reflinks the cached snapshot where
+    possible and copies the emulator folder otherwise. Hardlinks are not used: the vendor injection overwrites and
+    chmods files of the merge workspace in place, which would write through into the cache.
+
+    :param aosp_path: str - path to the AOSP source tree.
+    :param lunch_target: str - lunch target of the AOSP build.
+    :param apex_emulator_folder: str - path to the emulator APEX folder.
+    :param dst_folder_path: str - destination folder.
+    :return: str - "reflink" or "copy".
+    """
+    if EMULATOR_APEX_CACHE_ENABLED and is_reflink_possible(dst_folder_path):
+        snapshot_path = materialize_emulator_apex_tree(aosp_path, lunch_target, apex_emulator_folder)
+        result = subprocess.run(["cp", "-a", "--reflink=always", f"{snapshot_path}/.", dst_folder_path],
+                                capture_output=True, text=True)
+        if result.returncode == 0:
+            return "reflink"
+        logging.info(f"Reflink clone failed for {snapshot_path} -> {dst_folder_path}: {result.stderr.strip()}")
+        if any(message in result.stderr.lower() for message in REFLINK_UNSUPPORTED_MESSAGES):
+            _reflink_support_memo[os.stat(dst_folder_path).st_dev] = False
+    # Files a failed cp left behind have the same content and are overwritten
+    shutil.copytree(apex_emulator_folder, dst_folder_path, dirs_exist_ok=True)
+    return "copy"
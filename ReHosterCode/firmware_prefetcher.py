@@ -0,0 +1,120 @@
+"""
+Bounded prefetch queue for firmware build files. While firmware N is built, the build files of the next firmwares are
+downloaded and extracted into isolated staging directories. When it is a firmware's turn its staging directory is
+moved into EXTRACTED_PACKAGES_PATH with a rename. Prefetches are only started as long as the staged data stays within
+a disk-space budget; firmwares that were not prefetched are fetched synchronously on their turn.
+"""
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from config import EXTRACTED_PACKAGES_PATH, PACKAGE_EXTRACTION_DIR_NAME, PREFETCH_DEPTH, PREFETCH_DISK_BUDGET, \
+    PREFETCH_DIR
+
+
+def get_tree_size(folder_path):
+    total_size = 0
+    for root, dirs, files in os.walk(folder_path):
+        for file_name in files:
+            try:
+                total_size += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                pass
+    return total_size
+
+
+class FirmwarePrefetcher:
+    """
+    Prefetches the build files of the firmwares following the one that is taken.
+
+    :param firmware_id_list: list(str) - object-ids of the firmwares in build order.
+    :param fetch_function: callable(firmware_id, destination_folder) - downloads the build files of a firmware and
+        extracts them into destination_folder/PACKAGE_EXTRACTION_DIR_NAME.
+    :param depth: int - number of firmwares to prefetch ahead. 0 disables prefetching.
+    :param disk_budget: int - maximum bytes of staged build files.
+    """
+    def __init__(self, firmware_id_list, fetch_function, depth=PREFETCH_DEPTH, disk_budget=PREFETCH_DISK_BUDGET):
+        self.firmware_id_list = list(firmware_id_list)
+        self.fetch_function = fetch_function
+        self.depth = max(0, depth)
+        self.disk_budget = disk_budget
+        self.executor = ThreadPoolExecutor(max_workers=self.depth) if self.depth > 0 else None
+        self.future_dict = {}
+        self.next_position = 0
+        self.estimated_size = 0
+
+    @staticmethod
+    def get_staging_path(firmware_id):
+        return os.path.join(PREFETCH_DIR, re.sub(r'\W+', '', firmware_id))
+
+    def fetch(self, firmware_id):
+        """
+        Fetches the build files of a firmware into its staging directory.
+
+        :return: int - size of the staged build files in bytes.
+        """
+        staging_path = self.get_staging_path(firmware_id)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path, exist_ok=True)
+        self.fetch_function(firmware_id, staging_path)
+        return get_tree_size(staging_path)
+
+    def is_within_budget(self):
+        staged_size = get_tree_size(PREFETCH_DIR) if os.path.exists(PREFETCH_DIR) else 0
+        os.makedirs(PREFETCH_DIR, exist_ok=True)
+        free_space = shutil.disk_usage(PREFETCH_DIR).free
+        if staged_size + self.estimated_size > self.disk_budget or self.estimated_size > free_space:
+            logging.info(f"Prefetch paused: staged {staged_size} + estimated {self.estimated_size} bytes "
+                         f"| budget {self.disk_budget} | free {free_space}")
+            return False
+        return True
+
+    def schedule(self):
+        if not self.executor:
+            return
+        for firmware_id in self.firmware_id_list[self.next_position:self.next_position + self.depth]:
+            if firmware_id in self.future_dict:
+                continue
+            if not self.is_within_budget():
+                break
+            logging.info(f"Prefetching build files for firmware-id: {firmware_id}")
+            self.future_dict[firmware_id] = self.executor.submit(self.fetch, firmware_id)
+
+    def take(self, firmware_id):
+        """
+        Makes the build files of the firmware available in EXTRACTED_PACKAGES_PATH and starts prefetching the next
+        firmwares. Waits for a running prefetch and falls back to a synchronous fetch if the firmware was not
+        prefetched or the prefetch failed.
+
+        :param firmware_id: str - object-id of the firmware to build next.
+        """
+        if firmware_id in self.firmware_id_list[self.next_position:]:
+            self.next_position = self.firmware_id_list.index(firmware_id, self.next_position) + 1
+        future = self.future_dict.pop(firmware_id, None)
+        staged_size = None
+        if future:
+            try:
+                staged_size = future.result()
+                logging.info(f"Using prefetched build files for firmware-id: {firmware_id}")
+            except BaseException as err:
+                logging.warning(f"Prefetch failed for firmware-id: {firmware_id}: {err}. Fetching synchronously.")
+        if staged_size is None:
+            staged_size = self.fetch(firmware_id)
+        self.estimated_size = max(self.estimated_size, staged_size)
+
+        staging_path = self.get_staging_path(firmware_id)
+        shutil.rmtree(EXTRACTED_PACKAGES_PATH, ignore_errors=True)
+        os.makedirs(os.path.dirname(os.path.normpath(EXTRACTED_PACKAGES_PATH)), exist_ok=True)
+        os.rename(os.path.join(staging_path, PACKAGE_EXTRACTION_DIR_NAME), EXTRACTED_PACKAGES_PATH)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        self.schedule()
+
+    def close(self):
+        """
+        Stops prefetching and removes all staged build files.
+        """
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(PREFETCH_DIR, ignore_errors=True)
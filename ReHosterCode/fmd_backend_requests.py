@@ -4,6 +4,7 @@ import logging
 import os
 import re
 import requests
+from contextlib import nullcontext
 from werkzeug.utils import secure_filename
 from string import Template
 from tqdm import tqdm
@@ -113,7 +114,8 @@ def get_firmware_ids(graphql_url, cookies, arch=None, pk_filter=None):
     return object_id_list
 
 
-def download_firmware_build_files(fmd_url, firmware_id, cookies, aosp_packages_abs_path, max_attempts=10):
+def download_firmware_build_files(fmd_url, firmware_id, cookies, aosp_packages_abs_path, max_attempts=10,
+                                  stream_extractor=None, keep_archive=True):
     """
     Downloads the build files for the given Android app (object id) and shows a progress bar of the download.
 
@@ -122,8 +124,10 @@ def download_firmware_build_files(fmd_url, firmware_id, cookies, aosp_packages_a
     :param cookies: str - cookie jar for http requests.
     :param aosp_packages_abs_path: str - folder of the aosp app packages.
     :param max_attempts: int - maximum number of download attempts.
+    :param stream_extractor: StreamingZipExtractor - optional extractor that is fed with the downloaded bytes.
+    :param keep_archive: bool - write the downloaded archive to aosp_packages_abs_path.
 
-    :return: str - path to the downloaded file.
+    :return: str - path to the downloaded file. The file only exists if keep_archive is set.
 
     """
     temp_obj = Template(FMD_FIRMWARE_BUILD_FILES_DOWNLOAD_TEMPLATE)
@@ -147,8 +151,12 @@ def download_firmware_build_files(fmd_url, firmware_id, cookies, aosp_packages_a
     while attempt < max_attempts and not is_successful:
         try:
             logging.info(f"Attempt {attempt} to download build file from {download_url}...")
-            if output_file_path and os.path.exists(output_file_path):
+            current_size = 0
+            if stream_extractor:
+                current_size = stream_extractor.offset
+            elif output_file_path and os.path.exists(output_file_path):
                 current_size = os.path.getsize(output_file_path)
+            if current_size > 0:
                 headers["Range"] = f"bytes={current_size}-"
             response = requests.post(download_url,
                                      data=request_body,
@@ -165,10 +173,21 @@ def download_firmware_build_files(fmd_url, firmware_id, cookies, aosp_packages_a
             total_size_in_bytes = int(response.headers.get('Content-Length', 0))
             progress_bar = tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True)
             logging.info(f"Downloading firmware build files to {output_file_path}...")
-            with open(output_file_path, mode="ab") as file:
-                for chunk in response.iter_content(chunk_size=10 * 1024):
+            # A server that ignores the Range header sends the whole archive again
+            skip_length = current_size if response.status_code == 200 else 0
+            with open(output_file_path, mode="ab") if keep_archive else nullcontext() as file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024 if stream_extractor else 10 * 1024):
                     progress_bar.update(len(chunk))
-                    file.write(chunk)
+                    if skip_length > 0:
+                        skipped_length = min(skip_length, len(chunk))
+                        chunk = chunk[skipped_length:]
+                        skip_length -= skipped_length
+                        if not chunk:
+                            continue
+                    if file:
+                        file.write(chunk)
+                    if stream_extractor:
+                        stream_extractor.feed(chunk)
             progress_bar.close()
             is_successful = True
         except Exception as err:
@@ -0,0 +1,215 @@
+"""
+Incremental build support for the build injector. Instead of running `m clean` for every firmware, out/ is kept and
+only the outputs affected by the injection are invalidated:
+
+- the intermediates of the modules injected into packages/modules/fmd,
+- the staging partitions, images and packaging outputs of the target, which depend on the rendered base_*.mk files,
+  the BoardConfig partition sizes and build_image.py and are modified in place by the post-build injector,
+- the obj/ files overwritten by the post-build injector.
+
+The state of the last injection is stored in the target out folder. Without a state file out/ is of unknown origin
+and the caller falls back to a clean build.
+
+A targeted rebuild of the same firmware goes further and keeps the staging partitions as well: only the packages that
+were changed are restaged, and only their intermediates and installed files plus the packed images are invalidated.
+The modules of a staged package are looked up by their source path in module-info.json.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+
+from common import get_aosp_out_path
+from config import INCREMENTAL_BUILD_STATE_FILENAME, INCREMENTAL_BUILD_STAGING_DIRS, MODULE_BASE_INJECT_DIR
+
+SOONG_INTERMEDIATES_PATH = "out/soong/.intermediates"
+
+
+def get_state_file_path(target_out_path):
+    return os.path.join(target_out_path, INCREMENTAL_BUILD_STATE_FILENAME)
+
+
+def write_incremental_build_state(target_out_path, firmware_id, module_name_list, pre_injector_config=None,
+                                  post_injection_start_time=None):
+    """
+    Records the start of the post-build injection and the injected module names. Must be called before the
+    post-build injector modifies the target out folder.
+
+    :param target_out_path: str - path to the AOSP target out folder.
+    :param firmware_id: str - object-id of the firmware.
+    :param module_name_list: list(str) - names of the modules injected into the aosp source code.
+    :param pre_injector_config: dict - pre-injector config of the build, compared by a targeted rebuild.
+    :param post_injection_start_time: float - start of the first post-build injection into this out folder. A
+        targeted rebuild keeps the time of the build it is based on. Defaults to now.
+    """
+    state = {
+        "firmware_id": firmware_id,
+        "post_injection_start_time": post_injection_start_time or time.time(),
+        "module_name_list": sorted(set(module_name_list)),
+        "pre_injector_config": pre_injector_config or {},
+    }
+    try:
+        os.makedirs(target_out_path, exist_ok=True)
+        with open(get_state_file_path(target_out_path), "w") as state_file:
+            json.dump(state, state_file, indent=4)
+    except OSError as err:
+        logging.warning(f"Could not write incremental build state to {target_out_path}: {err}")
+
+
+def read_incremental_build_state(target_out_path):
+    try:
+        with open(get_state_file_path(target_out_path), "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_path(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        return 0
+    return 1
+
+
+def remove_modified_obj_files(obj_folder_path, since_time):
+    """
+    Removes all files in obj/ that were changed after since_time. The post-build injector overwrites obj files with
+    vendor files (copyfile or copy2), which keeps or sets an mtime older than the build outputs, so the inode change
+    time is used to find them.
+
+    :param obj_folder_path: str - path to the obj folder of the target.
+    :param since_time: float - start time of the last post-build injection.
+    :return: int - number of removed files.
+    """
+    removed_count = 0
+    for root, dirs, files in os.walk(obj_folder_path):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            try:
+                if os.lstat(file_path).st_ctime >= since_time:
+                    os.remove(file_path)
+                    removed_count += 1
+            except OSError as err:
+                logging.debug(f"Could not invalidate {file_path}: {err}")
+    return removed_count
+
+
+def remove_packed_images(target_out_path):
+    """
+    Removes the images, image zips and packaging outputs of the target, so they are packed again from the staging
+    partitions.
+
+    :return: int - number of removed outputs.
+    """
+    removed_count = 0
+    for image_path in glob.glob(os.path.join(glob.escape(target_out_path), "*.img")) \
+            + glob.glob(os.path.join(glob.escape(target_out_path), "*.zip")):
+        removed_count += remove_path(image_path)
+    removed_count += remove_path(os.path.join(target_out_path, "obj", "PACKAGING"))
+    return removed_count
+
+
+def invalidate_incremental_build(aosp_path, target_out_path):
+    """
+    Invalidates the outputs of the last injected build so the next `m` rebuilds only the affected modules and images.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param target_out_path: str - path to the AOSP target out folder.
+    :return: bool - True if out/ was invalidated, False if a clean build is required.
+    """
+    state = read_incremental_build_state(target_out_path)
+    if state is None:
+        logging.info(f"No incremental build state in {target_out_path}. A clean build is required.")
+        return False
+
+    start_time = time.time()
+    removed_count = 0
+    soong_intermediates_path = get_aosp_out_path(aosp_path, SOONG_INTERMEDIATES_PATH)
+    removed_count += remove_path(os.path.join(soong_intermediates_path, MODULE_BASE_INJECT_DIR))
+    obj_folder_path = os.path.join(target_out_path, "obj")
+    for module_name in state.get("module_name_list", []):
+        for intermediates_path in glob.glob(os.path.join(glob.escape(obj_folder_path), "*",
+                                                         f"{glob.escape(module_name)}_intermediates")):
+            removed_count += remove_path(intermediates_path)
+    for staging_dir_name in INCREMENTAL_BUILD_STAGING_DIRS:
+        removed_count += remove_path(os.path.join(target_out_path, staging_dir_name))
+    removed_count += remove_packed_images(target_out_path)
+    removed_count += remove_modified_obj_files(obj_folder_path, state["post_injection_start_time"])
+    os.remove(get_state_file_path(target_out_path))
+    logging.info(f"Incremental build: invalidated {removed_count} outputs of firmware {state.get('firmware_id')} "
+                 f"in {round(time.time() - start_time, 2)} seconds.")
+    return True
+
+
+def get_changed_config_keys(previous_config, config):
+    """
+    :param previous_config: dict - config of the previous build.
+    :param config: dict - current config.
+    :return: list(str) - keys whose values differ.
+    """
+    return sorted(key for key in set(previous_config) | set(config) if previous_config.get(key) != config.get(key))
+
+
+def get_staged_package_paths(staging_path):
+    """
+    Lists the packages staged into packages/modules/fmd by the last injection. Apps and libraries are staged as
+    <kind>/<package>_<uuid>, APEX packages as apex/<package>/<uuid>.
+
+    :param staging_path: str - absolute path of packages/modules/fmd.
+    :return: dict - lower-case package name -> list of staged folders.
+    """
+    staged_package_dict = {}
+    for kind in ["apps", "libs"]:
+        for staged_path in glob.glob(os.path.join(glob.escape(staging_path), kind, "*_*")):
+            package_name = os.path.basename(staged_path).rsplit("_", 1)[0]
+            staged_package_dict.setdefault(package_name.lower(), []).append(staged_path)
+    for staged_path in glob.glob(os.path.join(glob.escape(staging_path), "apex", "*", "*")):
+        package_name = os.path.basename(os.path.dirname(staged_path))
+        staged_package_dict.setdefault(package_name.lower(), []).append(staged_path)
+    return staged_package_dict
+
+
+def read_module_info(target_out_path):
+    try:
+        with open(os.path.join(target_out_path, "module-info.json"), "r") as module_info_file:
+            return json.load(module_info_file)
+    except (OSError, ValueError) as err:
+        logging.warning(f"Could not read module-info.json of {target_out_path}: {err}")
+        return {}
+
+
+def invalidate_staged_packages(aosp_path, target_out_path, staged_path_list):
+    """
+    Removes staged packages together with the Soong intermediates, the obj intermediates and the installed files of
+    their modules.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param target_out_path: str - path to the AOSP target out folder.
+    :param staged_path_list: list(str) - staged package folders to remove.
+    :return: int - number of removed outputs.
+    """
+    removed_count = 0
+    module_info = read_module_info(target_out_path)
+    obj_folder_path = os.path.join(target_out_path, "obj")
+    soong_intermediates_path = get_aosp_out_path(aosp_path, SOONG_INTERMEDIATES_PATH)
+    for staged_path in staged_path_list:
+        relative_staged_path = os.path.relpath(staged_path, aosp_path)
+        for module_name, module in module_info.items():
+            if not any(path == relative_staged_path or path.startswith(relative_staged_path + os.sep)
+                       for path in module.get("path", [])):
+                continue
+            for intermediates_path in glob.glob(os.path.join(glob.escape(obj_folder_path), "*",
+                                                             f"{glob.escape(module_name)}_intermediates")):
+                removed_count += remove_path(intermediates_path)
+            for installed_path in module.get("installed", []):
+                removed_count += remove_path(get_aosp_out_path(aosp_path, installed_path)
+                                             if not os.path.isabs(installed_path) else installed_path)
+            logging.debug(f"Targeted rebuild: invalidated module {module_name} of {relative_staged_path}")
+        removed_count += remove_path(os.path.join(soong_intermediates_path, relative_staged_path))
+        removed_count += remove_path(staged_path)
+    return removed_count
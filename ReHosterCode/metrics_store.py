@@ -0,0 +1,177 @@
+"""
+Append-only metrics store for the build and injection results. Every record is appended as one JSON line to a .jsonl
+file next to the JSON array file it belongs to (results_build_times.json -> results_build_times.jsonl), under a file
+lock and followed by fsync, so concurrent runs can neither lose nor corrupt records and an append costs O(1).
+
+The JSON array files read by the Evaluation notebook are exports of the stores. They are written at the end of a
+build injector run and can be regenerated at any time with:
+
+    python metrics_store.py [--compact] [results_build_times.json ...]
+
+--compact additionally rewrites the stores without torn or corrupt lines. An array file that exists without a store,
+e.g. from older runs, is migrated into the store on the first append.
+"""
+import argparse
+import json
+import logging
+import os
+
+from filelock import FileLock
+
+from config import BUILD_OUT_PATH, NAME_BUILD_FILE_LOG, NAME_BUILD_INJECTOR_LOG, NAME_PARTITION_SIZE_LOG
+from config_post_injector import NAME_EXECUTION_TIME_LOG
+from setup_logger import setup_logger
+
+METRICS_STORE_SUFFIX = ".jsonl"
+METRICS_LOCK_SUFFIX = ".lock"
+METRICS_FILE_NAMES = [NAME_BUILD_FILE_LOG, NAME_BUILD_INJECTOR_LOG, NAME_PARTITION_SIZE_LOG, NAME_EXECUTION_TIME_LOG]
+
+
+def get_metrics_store_path(output_file):
+    """
+    :param output_file: str - path to the JSON array file of the metrics.
+    :return: str - path to the JSONL store of the metrics.
+    """
+    return f"{os.path.splitext(output_file)[0]}{METRICS_STORE_SUFFIX}"
+
+
+def get_metrics_lock(output_file):
+    return FileLock(f"{get_metrics_store_path(output_file)}{METRICS_LOCK_SUFFIX}")
+
+
+def write_file_atomically(file_path, content):
+    temp_file_path = f"{file_path}.tmp{os.getpid()}"
+    with open(temp_file_path, "w") as temp_file:
+        temp_file.write(content)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_file_path, file_path)
+
+
+def migrate_array_file(output_file):
+    """
+    Moves the records of an array file without store into a new store. Must be called with the metrics lock held.
+    """
+    store_path = get_metrics_store_path(output_file)
+    if os.path.exists(store_path) or not os.path.exists(output_file):
+        return
+    try:
+        with open(output_file, "r") as array_file:
+            record_list = json.load(array_file)
+    except (OSError, ValueError) as err:
+        logging.warning(f"Could not migrate metrics file {output_file}: {err}")
+        return
+    if not isinstance(record_list, list):
+        return
+    write_file_atomically(store_path, "".join(json.dumps(record) + "\n" for record in record_list))
+    logging.info(f"Migrated {len(record_list)} metrics records from {output_file} to {store_path}")
+
+
+def append_metrics_record(record, output_file):
+    """
+    Appends a record to the metrics store of output_file.
+
+    :param record: dict - the record to append.
+    :param output_file: str - path to the JSON array file of the metrics.
+    :return: bool - True if the record was written.
+    """
+    try:
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        with get_metrics_lock(output_file):
+            migrate_array_file(output_file)
+            with open(get_metrics_store_path(output_file), "a+b") as store_file:
+                # A line torn by a crash must not swallow the new record
+                if store_file.seek(0, os.SEEK_END) > 0:
+                    store_file.seek(-1, os.SEEK_END)
+                    if store_file.read(1) != b"\n":
+                        line = b"\n" + line
+                store_file.write(line)
+                store_file.flush()
+                os.fsync(store_file.fileno())
+        return True
+    except Exception as err:
+        logging.error(f"Error writing metrics record to {output_file}: {err}")
+        return False
+
+
+def read_metrics_records(output_file):
+    """
+    Reads all records of a metrics store. Lines that are not valid JSON, e.g. a line torn by a crash, are skipped.
+
+    :param output_file: str - path to the JSON array file of the metrics.
+    :return: tuple - (list(dict), int) - records, number of skipped lines.
+    """
+    record_list = []
+    skipped_count = 0
+    store_path = get_metrics_store_path(output_file)
+    if not os.path.exists(store_path):
+        return record_list, skipped_count
+    with open(store_path, "r") as store_file:
+        for line in store_file:
+            if not line.strip():
+                continue
+            try:
+                record_list.append(json.loads(line))
+            except ValueError:
+                skipped_count += 1
+    if skipped_count:
+        logging.warning(f"Skipped {skipped_count} corrupt lines in {store_path}")
+    return record_list, skipped_count
+
+
+def export_metrics(output_file, compact=False):
+    """
+    Writes the records of the metrics store as JSON array to output_file.
+
+    :param output_file: str - path to the JSON array file of the metrics.
+    :param compact: bool - also rewrite the store without corrupt lines.
+    :return: int - number of exported records.
+    """
+    with get_metrics_lock(output_file):
+        migrate_array_file(output_file)
+        if not os.path.exists(get_metrics_store_path(output_file)):
+            return 0
+        record_list, skipped_count = read_metrics_records(output_file)
+        if compact and skipped_count:
+            write_file_atomically(get_metrics_store_path(output_file),
+                                  "".join(json.dumps(record) + "\n" for record in record_list))
+        write_file_atomically(output_file, json.dumps(record_list, indent=4) + "\n")
+    logging.info(f"Exported {len(record_list)} metrics records to {output_file}")
+    return len(record_list)
+
+
+def export_all_metrics(metrics_folder_path=BUILD_OUT_PATH, compact=False):
+    """
+    Exports all metrics stores of the build and post-build injector in metrics_folder_path.
+    """
+    for file_name in METRICS_FILE_NAMES:
+        try:
+            export_metrics(os.path.join(metrics_folder_path, file_name), compact)
+        except Exception as err:
+            logging.error(f"Error exporting metrics {file_name}: {err}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog="metrics_store",
+                                     description="Exports the JSONL metrics stores to the JSON array files read by "
+                                                 "the evaluation.")
+    parser.add_argument("output_files", nargs="*",
+                        help=f"JSON array files to export. Defaults to the metrics files in {BUILD_OUT_PATH}.")
+    parser.add_argument("-c", "--compact", action="store_true", default=False,
+                        help="Rewrite the stores without corrupt lines.")
+    return parser.parse_args()
+
+
+def main():
+    setup_logger()
+    args = parse_arguments()
+    if args.output_files:
+        for output_file in args.output_files:
+            export_metrics(os.path.abspath(output_file), args.compact)
+    else:
+        export_all_metrics(compact=args.compact)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Multi-process zip extraction. The regular file members of an archive are sharded by uncompressed size across worker
+processes, each of which opens the archive on its own. Unix permissions and symlinks stored in the archive are
+restored, runs of zero blocks are written as sparse holes (emulator .img files are mostly empty) and members that are
+already on disk with the same size and CRC-32 can be skipped.
+"""
+import logging
+import os
+import stat
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from config import EXTRACT_ZIP_WORKERS
+from pipeline_trace import trace_span
+from streaming_unzip import get_safe_target_path
+
+SPARSE_BLOCK_SIZE = 64 * 1024
+ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+CRC_BLOCK_SIZE = 1024 * 1024
+PARALLEL_EXTRACT_MIN_SIZE = 64 * 1024 * 1024
+ZIP_CREATE_SYSTEM_UNIX = 3
+
+
+def get_unix_mode(info):
+    """
+    :param info: zipfile.ZipInfo - archive member.
+    :return: int - unix st_mode stored in the archive or 0 if the archive has none.
+    """
+    if info.create_system != ZIP_CREATE_SYSTEM_UNIX:
+        return 0
+    return info.external_attr >> 16
+
+
+def is_symlink_member(info):
+    return stat.S_ISLNK(get_unix_mode(info))
+
+
+def is_unchanged(info, target_path):
+    """
+    Checks if the member is already on disk with the same size and CRC-32.
+
+    :param info: zipfile.ZipInfo - archive member.
+    :param target_path: str - path of the extracted member.
+    :return: bool - True if the member does not need to be extracted.
+    """
+    try:
+        file_stat = os.lstat(target_path)
+    except OSError:
+        return False
+    if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size != info.file_size:
+        return False
+    crc = 0
+    with open(target_path, "rb") as target_file:
+        for block in iter(lambda: target_file.read(CRC_BLOCK_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+    return crc == info.CRC
+
+
+def write_sparse_member(zip_ref, info, target_path):
+    """
+    Extracts a member and seeks over zero blocks instead of writing them, so they become holes in the file.
+    """
+    if os.path.islink(target_path):
+        os.remove(target_path)
+    with zip_ref.open(info) as member_file, open(target_path, "wb") as target_file:
+        while True:
+            block = member_file.read(SPARSE_BLOCK_SIZE)
+            if not block:
+                break
+            if len(block) == SPARSE_BLOCK_SIZE and block == ZERO_BLOCK:
+                target_file.seek(SPARSE_BLOCK_SIZE, os.SEEK_CUR)
+            else:
+                target_file.write(block)
+        # Sets the size if the file ends with a hole
+        target_file.truncate()
+
+
+def extract_members(file_path, destination, member_index_list, skip_unchanged):
+    """
+    Worker routine: extracts a shard of regular file members.
+
+    :param file_path: str - path to the zip archive.
+    :param destination: str - folder to extract to.
+    :param member_index_list: list(int) - indices of the members in the archive's infolist.
+    :param skip_unchanged: bool - skip members that are already on disk with the same size and CRC-32.
+    :return: tuple - (int, int) - number of extracted members, number of skipped members.
+    """
+    extracted_count = 0
+    skipped_count = 0
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        info_list = zip_ref.infolist()
+        for member_index in member_index_list:
+            info = info_list[member_index]
+            target_path = get_safe_target_path(destination, info.filename)
+            if skip_unchanged and is_unchanged(info, target_path):
+                skipped_count += 1
+            else:
+                write_sparse_member(zip_ref, info, target_path)
+                extracted_count += 1
+            mode = stat.S_IMODE(get_unix_mode(info))
+            if mode:
+                os.chmod(target_path, mode)
+    return extracted_count, skipped_count
+
+
+def split_into_shards(info_list, member_index_list, shard_count):
+    """
+    Distributes the members over the shards, largest first onto the shard with the least data.
+
+    :return: list(list(int)) - member indices per shard.
+    """
+    shard_list = [[] for _ in range(shard_count)]
+    shard_size_list = [0] * shard_count
+    for member_index in sorted(member_index_list, key=lambda index: info_list[index].file_size, reverse=True):
+        shard_index = shard_size_list.index(min(shard_size_list))
+        shard_list[shard_index].append(member_index)
+        shard_size_list[shard_index] += info_list[member_index].file_size
+    return [shard for shard in shard_list if shard]
+
+
+def extract_zip_parallel(file_path, destination, worker_count=EXTRACT_ZIP_WORKERS, skip_unchanged=False):
+    """
+    Extracts a zip archive with several worker processes.
+
+    :param file_path: str - path to the zip archive.
+    :param destination: str - folder to extract to.
+    :param worker_count: int - number of worker processes. 0 uses one per cpu.
+    :param skip_unchanged: bool - skip members that are already on disk with the same size and CRC-32.
+    :return: tuple - (int, int) - number of extracted members, number of skipped members.
+    """
+    start_time = time.time()
+    worker_count = worker_count or os.cpu_count() or 1
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        info_list = zip_ref.infolist()
+        # Later members with the same name overwrite earlier ones, like with extractall
+        target_dict = {}
+        for member_index, info in enumerate(info_list):
+            target_dict[get_safe_target_path(destination, info.filename)] = member_index
+        dir_index_list = []
+        symlink_index_list = []
+        file_index_list = []
+        for target_path, member_index in target_dict.items():
+            info = info_list[member_index]
+            if info.is_dir():
+                os.makedirs(target_path, exist_ok=True)
+                dir_index_list.append(member_index)
+            elif is_symlink_member(info):
+                symlink_index_list.append(member_index)
+            else:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                file_index_list.append(member_index)
+
+        total_size = sum(info_list[member_index].file_size for member_index in file_index_list)
+        with trace_span("extract_zip", category="extract", file_path=file_path, bytes=total_size,
+                        members=len(file_index_list)) as span:
+            if worker_count > 1 and len(file_index_list) > 1 and total_size >= PARALLEL_EXTRACT_MIN_SIZE:
+                shard_list = split_into_shards(info_list, file_index_list, worker_count)
+                with ProcessPoolExecutor(max_workers=len(shard_list)) as executor:
+                    result_list = list(executor.map(extract_members,
+                                                    [file_path] * len(shard_list),
+                                                    [destination] * len(shard_list),
+                                                    shard_list,
+                                                    [skip_unchanged] * len(shard_list)))
+            else:
+                result_list = [extract_members(file_path, destination, file_index_list, skip_unchanged)]
+            span["workers"] = len(result_list)
+        extracted_count = sum(result[0] for result in result_list)
+        skipped_count = sum(result[1] for result in result_list)
+
+        # Symlinks are created after the files, so no file is written through a link of the archive
+        for member_index in symlink_index_list:
+            info = info_list[member_index]
+            target_path = get_safe_target_path(destination, info.filename)
+            link_target = zip_ref.read(info).decode("utf-8")
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            if os.path.lexists(target_path):
+                if os.path.islink(target_path) and os.readlink(target_path) == link_target:
+                    skipped_count += 1
+                    continue
+                os.remove(target_path)
+            os.symlink(link_target, target_path)
+            extracted_count += 1
+
+    # Directory permissions are set last, read-only directories would block the extraction
+    for member_index in reversed(dir_index_list):
+        mode = stat.S_IMODE(get_unix_mode(info_list[member_index]))
+        if mode:
+            os.chmod(get_safe_target_path(destination, info_list[member_index].filename), mode)
+    logging.info(f"Extracted {extracted_count} and skipped {skipped_count} unchanged members of {file_path} "
+                 f"with {len(result_list)} workers in {round(time.time() - start_time, 2)} seconds.")
+    return extracted_count, skipped_count
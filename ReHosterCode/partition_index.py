@@ -0,0 +1,163 @@
+"""
+One-pass index of the native libraries of a vendor partition. The creation of isolated-namespace APEX files needs to
+resolve missing libraries by name and to bulk-copy whole lib64 trees. Instead of walking the partition again for every
+lookup, the partition is walked once and every shared object is recorded by basename and soname together with its
+ELF class and location flags.
+"""
+import logging
+import os
+import struct
+from collections import defaultdict
+
+from common import check_shared_object_architecture
+
+VNDK_APEX_FOLDER_MARKER = "com_android_vndk_current_apex"
+DT_SONAME = 14
+SHT_DYNAMIC = 6
+_partition_index_memo = {}
+
+
+def read_elf_soname(file_path):
+    """
+    Reads the DT_SONAME entry of an ELF shared object.
+
+    :param file_path: str - path to the shared object.
+    :return: str - soname of the library or None if not set or unreadable.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            ident = f.read(16)
+            if len(ident) < 16 or ident[:4] != b"\x7fELF":
+                return None
+            is_64_bit = ident[4] == 2
+            endian = "<" if ident[5] == 1 else ">"
+            if is_64_bit:
+                f.seek(0x28)
+                sh_offset, = struct.unpack(endian + "Q", f.read(8))
+                f.seek(0x3A)
+                sh_entsize, sh_num = struct.unpack(endian + "HH", f.read(4))
+                section_format, dyn_format = endian + "IIQQQQIIQQ", endian + "qQ"
+            else:
+                f.seek(0x20)
+                sh_offset, = struct.unpack(endian + "I", f.read(4))
+                f.seek(0x2E)
+                sh_entsize, sh_num = struct.unpack(endian + "HH", f.read(4))
+                section_format, dyn_format = endian + "IIIIIIIIII", endian + "iI"
+            if not sh_offset or not sh_num:
+                return None
+
+            f.seek(sh_offset)
+            section_table = f.read(sh_entsize * sh_num)
+            section_size = struct.calcsize(section_format)
+            sections = [struct.unpack(section_format, section_table[i * sh_entsize:i * sh_entsize + section_size])
+                        for i in range(sh_num)]
+            for section in sections:
+                if section[1] != SHT_DYNAMIC:
+                    continue
+                dyn_offset, dyn_size, dyn_link = section[4], section[5], section[6]
+                strtab_offset = sections[dyn_link][4]
+                f.seek(dyn_offset)
+                dynamic = f.read(dyn_size)
+                entry_size = struct.calcsize(dyn_format)
+                for i in range(0, len(dynamic) - entry_size + 1, entry_size):
+                    tag, value = struct.unpack(dyn_format, dynamic[i:i + entry_size])
+                    if tag == 0:
+                        break
+                    if tag == DT_SONAME:
+                        f.seek(strtab_offset + value)
+                        return f.read(256).split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
+    except (OSError, struct.error, IndexError) as err:
+        logging.debug(f"Could not read soname of {file_path}: {err}")
+    return None
+
+
+def build_partition_index(partition_root):
+    """
+    Walks the partition once and indexes all shared objects and all lib64 and javalib folders. The index is memoized
+    per process since several isolated-namespace binaries of the same partition are handled by the same worker.
+
+    :param partition_root: str - root path of the partition.
+    :return: dict - "libraries": basename/soname -> list of entries, "lib64_folders": list of lib64 folders and
+    their subfolders, "javalib_folders": list of javalib folders and their subfolders.
+    """
+    if partition_root in _partition_index_memo:
+        return _partition_index_memo[partition_root]
+
+    libraries = defaultdict(list)
+    lib64_folders = []
+    javalib_folders = []
+    library_count = 0
+    for dirpath, dirnames, filenames in os.walk(partition_root):
+        dirnames.sort()
+        path_parts = dirpath.split(os.sep)
+        is_in_lib64 = "lib64" in path_parts
+        if is_in_lib64 and VNDK_APEX_FOLDER_MARKER not in dirpath:
+            lib64_folders.append(dirpath)
+        if "javalib" in path_parts and VNDK_APEX_FOLDER_MARKER not in dirpath:
+            javalib_folders.append(dirpath)
+
+        for filename in sorted(filenames):
+            if ".so" not in filename:
+                continue
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.isfile(file_path):
+                continue
+            entry = {
+                "path": file_path,
+                "dir": dirpath,
+                "elf_class": check_shared_object_architecture(file_path),
+                "is_apex": "apex" in dirpath,
+                "is_vndk": VNDK_APEX_FOLDER_MARKER in file_path or "vndk" in dirpath,
+                "in_lib64": is_in_lib64,
+            }
+            libraries[filename].append(entry)
+            soname = read_elf_soname(file_path)
+            if soname and soname != filename:
+                libraries[soname].append(entry)
+            library_count += 1
+
+    partition_index = {"libraries": libraries, "lib64_folders": lib64_folders, "javalib_folders": javalib_folders}
+    _partition_index_memo[partition_root] = partition_index
+    logging.info(f"Indexed partition {partition_root}: {library_count} libraries | {len(lib64_folders)} lib64 folders")
+    return partition_index
+
+
+def find_library(partition_index, lib_name, elf_class="64-bit", exclude_keyword_list=None):
+    """
+    Resolves a library by basename or soname from the partition index. VNDK APEX copies are never returned.
+
+    :param partition_index: dict - index created by build_partition_index.
+    :param lib_name: str - basename or soname of the library.
+    :param elf_class: str - required ELF class, e.g. "64-bit".
+    :param exclude_keyword_list: list(str) - path keywords to skip.
+    :return: dict - the first matching index entry or None.
+    """
+    entry_list = partition_index["libraries"].get(lib_name, [])
+    # Exact basename matches first, soname aliases afterwards
+    for entry in sorted(entry_list, key=lambda entry: os.path.basename(entry["path"]) != lib_name):
+        if VNDK_APEX_FOLDER_MARKER in entry["path"]:
+            continue
+        if exclude_keyword_list and any(keyword in entry["path"] for keyword in exclude_keyword_list):
+            continue
+        if entry["elf_class"] == elf_class:
+            return entry
+    return None
+
+
+def get_lib64_libraries(partition_index, elf_class="64-bit"):
+    """
+    Returns all indexed shared objects located in a lib64 folder.
+
+    :param partition_index: dict - index created by build_partition_index.
+    :param elf_class: str - required ELF class, e.g. "64-bit".
+    :return: list(dict) - index entries, each path only once.
+    """
+    seen_path_set = set()
+    entry_list = []
+    for entries in partition_index["libraries"].values():
+        for entry in entries:
+            if entry["in_lib64"] and entry["elf_class"] == elf_class and entry["path"] not in seen_path_set \
+                    and entry["path"].endswith(".so"):
+                seen_path_set.add(entry["path"])
+                entry_list.append(entry)
+    return sorted(entry_list, key=lambda entry: entry["path"])
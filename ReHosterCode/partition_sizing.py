@@ -0,0 +1,228 @@
+"""
+Right-sizing of the dynamic partitions. Instead of rounding the injected content up to 64 GB steps, every partition is
+sized from an inventory of its files: the content rounded to ext4 blocks, one inode per file, directory and symlink,
+the filesystem and AVB metadata and a configurable headroom. The super partition and the dynamic partition group are
+the sum of the partitions.
+
+Before the main build the partitions only exist as extracted firmware files, so the sizes are an upper bound of the
+AOSP base size plus the firmware content. After the post-build injection the partition folders of the target out
+path hold exactly what is packed into the images and the sizes are computed again from them.
+"""
+import glob
+import logging
+import os
+import stat
+
+from config import PARTITION_BASE_SIZE, PARTITION_HEADROOM_PERCENT, PARTITION_MIN_HEADROOM
+
+PARTITION_NAMES = ["system", "system_ext", "product", "vendor"]
+EXT4_BLOCK_SIZE = 4096
+EXT4_INODE_SIZE = 256
+EXT4_FAST_SYMLINK_LENGTH = 60
+# ext4 group descriptors, bitmaps and journal plus the AVB hashtree and FEC data
+PARTITION_METADATA_PERCENT = 4
+PARTITION_MIN_METADATA_SIZE = 16 * 1024 * 1024
+PARTITION_SIZE_ALIGNMENT = 1024 * 1024
+SUPER_PARTITION_METADATA_SIZE = 8 * 1024 * 1024
+FIXED_STEP_DEFAULT_SIZE = 4 * 1024 ** 3
+FIXED_STEP_SIZE = 64 * 1024 ** 3
+FIXED_STEP_MARGIN = 10 * 1024 ** 3
+RESERVED_SIZE_BLOCK_BEGIN = "# BEGIN FMD partition reserved sizes\n"
+RESERVED_SIZE_BLOCK_END = "# END FMD partition reserved sizes\n"
+
+
+def round_up(size, alignment):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def get_partition_inventory(partition_path):
+    """
+    Walks a partition folder once without following symlinks.
+
+    :param partition_path: str - path to the partition folder.
+    :return: dict - "bytes": content size rounded to ext4 blocks, "files", "directories" and "symlinks": counts.
+    """
+    inventory = {"bytes": 0, "files": 0, "directories": 0, "symlinks": 0}
+    folder_path_list = [partition_path]
+    while folder_path_list:
+        folder_path = folder_path_list.pop()
+        inventory["directories"] += 1
+        inventory["bytes"] += EXT4_BLOCK_SIZE
+        try:
+            with os.scandir(folder_path) as entry_iterator:
+                entry_list = list(entry_iterator)
+        except OSError as err:
+            logging.warning(f"Could not list {folder_path} for the partition inventory: {err}")
+            continue
+        for entry in entry_list:
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISDIR(entry_stat.st_mode):
+                folder_path_list.append(entry.path)
+            elif stat.S_ISLNK(entry_stat.st_mode):
+                inventory["symlinks"] += 1
+                # Short link targets are stored in the inode itself
+                if entry_stat.st_size >= EXT4_FAST_SYMLINK_LENGTH:
+                    inventory["bytes"] += EXT4_BLOCK_SIZE
+            else:
+                inventory["files"] += 1
+                inventory["bytes"] += round_up(entry_stat.st_size, EXT4_BLOCK_SIZE)
+    return inventory
+
+
+def estimate_partition_size(inventory, headroom_percent=PARTITION_HEADROOM_PERCENT,
+                            min_headroom=PARTITION_MIN_HEADROOM):
+    """
+    Estimates the ext4 partition size needed for the inventoried content.
+
+    :param inventory: dict - inventory of the partition, see get_partition_inventory.
+    :param headroom_percent: int - free space to leave in the partition in percent of the content.
+    :param min_headroom: int - minimal free space in bytes.
+    :return: tuple - (int, int) - partition size in bytes, headroom in bytes.
+    """
+    inode_count = inventory["files"] + inventory["directories"] + inventory["symlinks"]
+    inode_table_size = round_up(inode_count * EXT4_INODE_SIZE, EXT4_BLOCK_SIZE)
+    metadata_size = max(PARTITION_MIN_METADATA_SIZE, inventory["bytes"] * PARTITION_METADATA_PERCENT // 100)
+    headroom = round_up(max(min_headroom, inventory["bytes"] * headroom_percent // 100), EXT4_BLOCK_SIZE)
+    partition_size = round_up(inventory["bytes"] + inode_table_size + metadata_size + headroom,
+                              PARTITION_SIZE_ALIGNMENT)
+    return partition_size, headroom
+
+
+def get_partition_sizes(partition_root_path, headroom_percent=PARTITION_HEADROOM_PERCENT):
+    """
+    Computes the size of every partition folder below partition_root_path.
+
+    :param partition_root_path: str - folder holding the partition folders, e.g. the target out path.
+    :param headroom_percent: int - free space to leave in every partition in percent of its content.
+    :return: dict - partition name -> dict with the inventory, "headroom" and "size".
+    """
+    partition_size_dict = {}
+    for partition_name in PARTITION_NAMES:
+        partition_path = os.path.join(partition_root_path, partition_name)
+        if not os.path.isdir(partition_path):
+            continue
+        inventory = get_partition_inventory(partition_path)
+        partition_size, headroom = estimate_partition_size(inventory, headroom_percent)
+        partition_size_dict[partition_name] = dict(inventory, headroom=headroom, size=partition_size)
+        logging.debug(f"Partition {partition_name}: {inventory['bytes']} content bytes, "
+                      f"{inventory['files']} files, sized to {partition_size} bytes")
+    return partition_size_dict
+
+
+def get_fixed_step_partition_size(content_size):
+    """
+    :param content_size: int - bytes to inject.
+    :return: int - partition size of the former sizing in 64 GB steps, used to report the savings.
+    """
+    partition_size = FIXED_STEP_DEFAULT_SIZE
+    while partition_size < content_size + FIXED_STEP_MARGIN:
+        partition_size += FIXED_STEP_SIZE
+    return partition_size
+
+
+def get_board_config(aosp_path, aosp_version):
+    """
+    :return: tuple - (str, str) - path to the BoardConfig makefile, name of the dynamic partition group size variable.
+    """
+    if aosp_version and int(aosp_version) >= 14:
+        return (os.path.join(aosp_path, "build/make/target/board/BoardConfigGsiCommon.mk"),
+                "BOARD_GSI_DYNAMIC_PARTITIONS_SIZE")
+    return (os.path.join(aosp_path, "build/make/target/board/BoardConfigEmuCommon.mk"),
+            "BOARD_EMULATOR_DYNAMIC_PARTITIONS_SIZE")
+
+
+def get_reserved_size_variable(partition_name):
+    return f"BOARD_{partition_name.upper()}IMAGE_PARTITION_RESERVED_SIZE"
+
+
+def write_board_partition_sizes(aosp_path, aosp_version, group_size, reserved_size_dict=None):
+    """
+    Writes the super partition and dynamic partition group sizes into the BoardConfig makefile. The headroom of
+    every partition is written as its reserved size, so build_image leaves exactly that much free space. A previous
+    block of reserved sizes is replaced.
+
+    :param aosp_path: str - path to the root of the aosp source code.
+    :param aosp_version: str - version of the aosp build.
+    :param group_size: int - size of the dynamic partition group in bytes.
+    :param reserved_size_dict: dict - partition name -> reserved size in bytes.
+    """
+    board_config_file_path, group_size_variable = get_board_config(aosp_path, aosp_version)
+    super_partition_size = group_size + SUPER_PARTITION_METADATA_SIZE
+    logging.debug(f"Overwriting partition size to: {group_size} in {board_config_file_path}")
+    with open(board_config_file_path, 'r') as base_file:
+        lines = base_file.readlines()
+    if RESERVED_SIZE_BLOCK_BEGIN in lines and RESERVED_SIZE_BLOCK_END in lines:
+        del lines[lines.index(RESERVED_SIZE_BLOCK_BEGIN):lines.index(RESERVED_SIZE_BLOCK_END) + 1]
+    for i, line in enumerate(lines):
+        if "BOARD_SUPER_PARTITION_SIZE" in line:
+            lines[i] = f"  BOARD_SUPER_PARTITION_SIZE := {super_partition_size}\n"
+        if group_size_variable in line:
+            lines[i] = f"  {group_size_variable} := {group_size}\n"
+    if reserved_size_dict:
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append(RESERVED_SIZE_BLOCK_BEGIN)
+        for partition_name, reserved_size in reserved_size_dict.items():
+            lines.append(f"{get_reserved_size_variable(partition_name)} := {reserved_size}\n")
+        lines.append(RESERVED_SIZE_BLOCK_END)
+    with open(board_config_file_path, 'w') as base_file:
+        base_file.writelines(lines)
+
+
+def right_size_partitions_before_build(aosp_path, aosp_version, firmware_files_path,
+                                      headroom_percent=PARTITION_HEADROOM_PERCENT):
+    """
+    Sizes the partitions for the main build from the AOSP base size and the extracted firmware files.
+
+    :param firmware_files_path: str - folder with the extracted partition folders of the firmware.
+    :param headroom_percent: int - free space to leave in every partition in percent of its content.
+    :return: int - size of the dynamic partition group in bytes.
+    """
+    partition_size_dict = get_partition_sizes(firmware_files_path, headroom_percent)
+    group_size = PARTITION_BASE_SIZE + sum(partition["size"] for partition in partition_size_dict.values())
+    write_board_partition_sizes(aosp_path, aosp_version, group_size)
+    logging.info(f"Sized dynamic partitions for the main build to {group_size / 1024 ** 3:.2f} GiB")
+    return group_size
+
+
+def right_size_partitions_after_injection(aosp_path, aosp_version, target_out_path,
+                                          headroom_percent=PARTITION_HEADROOM_PERCENT):
+    """
+    Sizes every partition from the post-injection content of the target out path.
+
+    :param target_out_path: str - target out path of the build, holding the partition folders.
+    :param headroom_percent: int - free space to leave in every partition in percent of its content.
+    :return: dict - sizing report with the partitions, the group size and the savings against the 64 GB steps.
+    """
+    partition_size_dict = get_partition_sizes(target_out_path, headroom_percent)
+    group_size = sum(partition["size"] for partition in partition_size_dict.values())
+    write_board_partition_sizes(aosp_path, aosp_version, group_size,
+                                {name: partition["headroom"] for name, partition in partition_size_dict.items()})
+    content_size = sum(partition["bytes"] for partition in partition_size_dict.values())
+    fixed_step_group_size = get_fixed_step_partition_size(content_size)
+    report = {
+        "partitions": partition_size_dict,
+        "dynamic_partitions_size": group_size,
+        "super_partition_size": group_size + SUPER_PARTITION_METADATA_SIZE,
+        "fixed_step_super_partition_size": fixed_step_group_size + SUPER_PARTITION_METADATA_SIZE,
+        "saved_bytes": fixed_step_group_size - group_size,
+    }
+    logging.info(f"Right-sized dynamic partitions to {group_size / 1024 ** 3:.2f} GiB instead of "
+                 f"{fixed_step_group_size / 1024 ** 3:.2f} GiB in 64 GB steps, saving "
+                 f"{report['saved_bytes'] / 1024 ** 3:.2f} GiB")
+    return report
+
+
+def get_image_sizes(target_out_path):
+    """
+    :return: dict - image file name -> dict with the apparent "size" and the "allocated" bytes on disk.
+    """
+    image_size_dict = {}
+    for image_path in sorted(glob.glob(os.path.join(target_out_path, "*.img"))):
+        image_stat = os.stat(image_path)
+        image_size_dict[os.path.basename(image_path)] = {"size": image_stat.st_size,
+                                                         "allocated": image_stat.st_blocks * 512}
+    return image_size_dict
@@ -0,0 +1,127 @@
+"""
+Hierarchical phase tracing in the Chrome trace event format. Every span is appended as one complete ("X") event per
+line to the trace file of the firmware, which starts with "[" and is never closed; Perfetto and chrome://tracing
+accept the missing "]". Spans of the same thread nest by their timestamps, worker processes of the post-build
+injector and subprocesses of the build job runner show up as separate pids in the same trace.
+
+The active trace file is passed on in the FMD_TRACE_FILE environment variable, so forked workers and subprocesses
+started after start_trace() write into the same file. Without an active trace all spans are no-ops.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from config import TRACE_DIR, TRACE_ENABLED
+
+TRACE_FILE_ENV = "FMD_TRACE_FILE"
+TRACE_FILE_SUFFIX = ".trace.json"
+MAX_ARG_LENGTH = 2048
+
+
+def get_trace_file_path(trace_name):
+    safe_trace_name = re.sub(r'[^\w.-]+', '_', trace_name)
+    return os.path.join(TRACE_DIR, f"{safe_trace_name}{TRACE_FILE_SUFFIX}")
+
+
+def append_trace_event(event):
+    """
+    Appends an event with a single O_APPEND write, so concurrent processes do not interleave their lines.
+    """
+    trace_file_path = os.environ.get(TRACE_FILE_ENV)
+    if not trace_file_path:
+        return
+    line = json.dumps(event, default=str) + ",\n"
+    try:
+        file_descriptor = os.open(trace_file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(file_descriptor, line.encode("utf-8"))
+        finally:
+            os.close(file_descriptor)
+    except OSError as err:
+        logging.debug(f"Could not write trace event to {trace_file_path}: {err}")
+
+
+def start_trace(trace_name):
+    """
+    Starts a trace file for a firmware or an image and activates it for this process and its children.
+
+    :param trace_name: str - name of the trace, e.g. the firmware id.
+    :return: str - path to the trace file or None if tracing is disabled.
+    """
+    if not TRACE_ENABLED:
+        return None
+    trace_file_path = get_trace_file_path(trace_name)
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        if not os.path.exists(trace_file_path):
+            with open(trace_file_path, "w") as trace_file:
+                trace_file.write("[\n")
+    except OSError as err:
+        logging.warning(f"Could not create trace file {trace_file_path}: {err}")
+        return None
+    os.environ[TRACE_FILE_ENV] = trace_file_path
+    append_trace_event({"name": "process_name", "ph": "M", "pid": os.getpid(),
+                        "args": {"name": os.path.basename(sys.argv[0]) or "python"}})
+    logging.info(f"Tracing {trace_name} to {trace_file_path}")
+    return trace_file_path
+
+
+def stop_trace():
+    os.environ.pop(TRACE_FILE_ENV, None)
+
+
+def get_command_name(command):
+    """
+    :param command: str or list(str) - subprocess command.
+    :return: str - name of the executable, used as span name of the subprocess.
+    """
+    if isinstance(command, (list, tuple)):
+        executable = str(command[0]) if command else ""
+    else:
+        executable = command.split(maxsplit=1)[0] if command.strip() else ""
+    return os.path.basename(executable) or "subprocess"
+
+
+def truncate_arg(value):
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(item) for item in value)
+    if isinstance(value, str) and len(value) > MAX_ARG_LENGTH:
+        return value[:MAX_ARG_LENGTH] + "..."
+    return value
+
+
+@contextmanager
+def trace_span(name, category="pipeline", **span_args):
+    """
+    Records the enclosed block as a span. Yields the args dict of the span, so the block can add results such as
+    "bytes" or "returncode". Can also be used as a function decorator.
+
+    :param name: str - name of the span.
+    :param category: str - category of the span, e.g. "fetch", "build", "post_injection", "apex", "subprocess".
+    :param span_args: additional args shown with the span.
+    """
+    if not os.environ.get(TRACE_FILE_ENV):
+        yield span_args
+        return
+    start_time = time.time()
+    try:
+        yield span_args
+    except BaseException as err:
+        span_args["error"] = repr(err)
+        raise
+    finally:
+        append_trace_event({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(start_time * 1000000),
+            "dur": int((time.time() - start_time) * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {key: truncate_arg(value) for key, value in span_args.items()},
+        })
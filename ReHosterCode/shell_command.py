@@ -3,25 +3,27 @@ import os
 import subprocess
 import traceback
 
+from pipeline_trace import get_command_name, trace_span
+
 
 def execute_shell_command(command, aosp_root_path):
-    current_directory = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(aosp_root_path)
-    result = subprocess.run(command, shell=True, capture_output=True, text=False)
+    with trace_span(get_command_name(command), category="subprocess", command=command, cwd=aosp_root_path) as span:
+        result = subprocess.run(command, shell=True, capture_output=True, text=False, cwd=aosp_root_path)
+        span["returncode"] = result.returncode
     log_out = result.stdout.decode('utf-8', errors='ignore').strip()
     log_err = result.stderr.decode('utf-8', errors='ignore').strip()
 
     is_success = result.returncode == 0 or "error" not in log_err.lower()
 
-    os.chdir(current_directory)
     log = f"is_success: {is_success} result.returncode: {result.returncode}, stdout: {log_out} | error: {log_err}"
     return is_success, log
 
-def execute_command(command, cwd=None, shell=False):
+def execute_command(command, cwd=None, shell=False, env=None):
     """
     Execute a command and checks if it has an exit code of 0.
 
     :param command: list - the command and its arguments to execute.
+    :param env: dict - environment of the command, defaults to the environment of this process.
 
     :return: tuple - (bool, str) - True if the command was successful, False otherwise.
     """
@@ -29,7 +31,9 @@ def execute_command(command, cwd=None, shell=False):
         cwd = os.getcwd()
     is_success = False
     try:
-        result = subprocess.run(command, capture_output=True, text=False, cwd=cwd, shell=shell)
+        with trace_span(get_command_name(command), category="subprocess", command=command, cwd=cwd) as span:
+            result = subprocess.run(command, capture_output=True, text=False, cwd=cwd, shell=shell, env=env)
+            span["returncode"] = result.returncode
         logging.debug(f"Executed command: {command} - {result.returncode}")
         if result.returncode == 0:
             is_success = True
@@ -0,0 +1,89 @@
+"""
+Copy-on-write layer over a pristine AOSP checkout. A firmware build job mounts an overlayfs with the checkout as
+read-only lower directory and works on the merged view, so all source edits of the injector (BoardConfig partition
+sizes, base_*.mk, packages/modules/fmd, system/sepolicy/apex/*-file_contexts, build_image.py) end up in the job's
+upper directory. Resetting the source tree is an unmount; the discarded upper directory is removed in the background.
+
+The checkout must not be modified while overlays are mounted on it. The build output is written directly to OUT_DIR
+outside the overlay.
+"""
+import logging
+import os
+import subprocess
+import uuid
+
+UPPER_DIR_NAME = "upper"
+WORK_DIR_NAME = "work"
+MERGED_DIR_NAME = "aosp"
+TRASH_DIR_PREFIX = "trash_"
+
+
+def get_merged_path(overlay_root):
+    return os.path.join(overlay_root, MERGED_DIR_NAME, "")
+
+
+def run_privileged(command):
+    """
+    Runs a mount related command with sudo.
+
+    :param command: list(str) - the command without sudo.
+    :return: tuple - (bool, str) - True if the command was successful, stderr of the command.
+    """
+    result = subprocess.run(["sudo", "-n"] + command, capture_output=True, text=True)
+    return result.returncode == 0, result.stderr.strip()
+
+
+def discard_layer(overlay_root):
+    """
+    Moves the upper and work directories out of the way and deletes them in the background.
+    """
+    for dir_name in [UPPER_DIR_NAME, WORK_DIR_NAME]:
+        dir_path = os.path.join(overlay_root, dir_name)
+        if os.path.exists(dir_path):
+            trash_path = os.path.join(overlay_root, f"{TRASH_DIR_PREFIX}{dir_name}_{uuid.uuid4().hex}")
+            os.rename(dir_path, trash_path)
+            subprocess.Popen(["sudo", "-n", "rm", "-rf", trash_path],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def unmount_source_overlay(overlay_root):
+    """
+    Unmounts the overlay of a job and discards its layer.
+
+    :param overlay_root: str - directory of the job's overlay.
+    :return: bool - True if no overlay is mounted anymore.
+    """
+    merged_path = get_merged_path(overlay_root)
+    if os.path.ismount(os.path.normpath(merged_path)):
+        is_success, log_message = run_privileged(["umount", merged_path])
+        if not is_success:
+            logging.error(f"Could not unmount source overlay {merged_path}: {log_message}")
+            return False
+        logging.info(f"Unmounted source overlay: {merged_path}")
+    discard_layer(overlay_root)
+    return True
+
+
+def mount_source_overlay(aosp_path, overlay_root):
+    """
+    Mounts a fresh copy-on-write layer over the aosp checkout. An overlay left mounted by a previous job is reset
+    first.
+
+    :param aosp_path: str - path to the pristine aosp checkout.
+    :param overlay_root: str - directory of the job's overlay.
+    :return: str - path to the merged aosp tree or None if the overlay could not be mounted.
+    """
+    if not unmount_source_overlay(overlay_root):
+        return None
+    merged_path = get_merged_path(overlay_root)
+    upper_path = os.path.join(overlay_root, UPPER_DIR_NAME)
+    work_path = os.path.join(overlay_root, WORK_DIR_NAME)
+    for dir_path in [merged_path, upper_path, work_path]:
+        os.makedirs(dir_path, exist_ok=True)
+    options = f"lowerdir={os.path.normpath(aosp_path)},upperdir={upper_path},workdir={work_path}"
+    is_success, log_message = run_privileged(["mount", "-t", "overlay", "overlay", "-o", options, merged_path])
+    if not is_success:
+        logging.error(f"Could not mount source overlay over {aosp_path} at {merged_path}: {log_message}")
+        return None
+    logging.info(f"Mounted source overlay over {aosp_path} at {merged_path}")
+    return merged_path
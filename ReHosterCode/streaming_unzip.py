@@ -0,0 +1,242 @@
+"""
+Extraction of zip archives while they are downloaded. The local file headers of the archive are parsed as the bytes
+arrive and every entry is written to the extraction folder as soon as its data is complete, so no copy of the archive
+is needed on disk. Deflated and stored entries are supported, with and without data descriptors and zip64 sizes.
+Entries that cannot be streamed (encrypted entries, other compression methods, stored entries with data descriptor)
+switch the extractor to spooling: the rest of the archive is written to a spool file and extracted with zipfile once
+the download is complete.
+"""
+import logging
+import os
+import struct
+import zipfile
+import zlib
+
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_DIRECTORY_SIGNATURE = b"PK\x01\x02"
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b"PK\x05\x06"
+ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b"PK\x06\x06"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+LOCAL_FILE_HEADER_STRUCT = struct.Struct("<4sHHHHHIIIHH")
+ZIP64_EXTRA_ID = 0x0001
+FLAG_ENCRYPTED = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+STATE_HEADER = "header"
+STATE_DATA = "data"
+STATE_DESCRIPTOR = "descriptor"
+STATE_DONE = "done"
+
+
+def get_safe_target_path(destination, name):
+    """
+    Maps an archive member name to a path below destination, like zipfile does for extractall.
+    """
+    arcname = name.replace("/", os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(part for part in arcname.split(os.path.sep) if part not in invalid_path_parts)
+    return os.path.join(destination, arcname)
+
+
+class StreamingZipExtractor:
+    """
+    Incremental zip extractor. Feed the archive bytes in order with feed() and call close() at the end.
+
+    :param destination: str - folder to extract the archive to.
+    """
+    def __init__(self, destination):
+        self.destination = destination
+        self.offset = 0
+        self.buffer = bytearray()
+        self.state = STATE_HEADER
+        self.entry = None
+        self.spool_path = None
+        self.spool_file = None
+        self.extracted_count = 0
+        os.makedirs(destination, exist_ok=True)
+
+    def feed(self, data):
+        """
+        Processes the next bytes of the archive.
+
+        :param data: bytes - the next chunk of the archive.
+        """
+        self.offset += len(data)
+        if self.spool_file:
+            self.spool_file.write(data)
+            return
+        if self.state == STATE_DONE:
+            return
+        self.buffer += data
+        while self.process_buffer():
+            pass
+
+    def process_buffer(self):
+        """
+        Advances the parser as far as the buffered bytes allow.
+
+        :return: bool - True if progress was made and the parser should be called again.
+        """
+        if self.state == STATE_HEADER:
+            return self.read_local_file_header()
+        elif self.state == STATE_DATA:
+            return self.read_entry_data()
+        elif self.state == STATE_DESCRIPTOR:
+            return self.read_data_descriptor()
+        return False
+
+    def read_local_file_header(self):
+        if len(self.buffer) < 4:
+            return False
+        signature = bytes(self.buffer[:4])
+        if signature in (CENTRAL_DIRECTORY_SIGNATURE, END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+                         ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE):
+            self.state = STATE_DONE
+            self.buffer = bytearray()
+            return False
+        if signature != LOCAL_FILE_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Unexpected signature {signature} at offset "
+                                     f"{self.offset - len(self.buffer)}")
+        if len(self.buffer) < LOCAL_FILE_HEADER_STRUCT.size:
+            return False
+        _, _, flags, method, _, _, crc, compressed_size, uncompressed_size, name_length, extra_length = \
+            LOCAL_FILE_HEADER_STRUCT.unpack_from(self.buffer)
+        header_length = LOCAL_FILE_HEADER_STRUCT.size + name_length + extra_length
+        if len(self.buffer) < header_length:
+            return False
+        name_bytes = bytes(self.buffer[LOCAL_FILE_HEADER_STRUCT.size:LOCAL_FILE_HEADER_STRUCT.size + name_length])
+        name = name_bytes.decode("utf-8" if flags & FLAG_UTF8 else "cp437")
+        extra = bytes(self.buffer[LOCAL_FILE_HEADER_STRUCT.size + name_length:header_length])
+        is_zip64, compressed_size, uncompressed_size = parse_zip64_extra(extra, compressed_size, uncompressed_size)
+
+        if flags & FLAG_ENCRYPTED or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) \
+                or (method == zipfile.ZIP_STORED and flags & FLAG_DATA_DESCRIPTOR):
+            self.start_spooling(name)
+            return False
+
+        del self.buffer[:header_length]
+        target_path = get_safe_target_path(self.destination, name)
+        if name.endswith("/"):
+            os.makedirs(target_path, exist_ok=True)
+            output_file = None
+        else:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            output_file = open(target_path, "wb")
+        self.entry = {
+            "name": name,
+            "flags": flags,
+            "method": method,
+            "crc": crc,
+            "is_zip64": is_zip64,
+            "remaining": compressed_size,
+            "computed_crc": 0,
+            "output_file": output_file,
+            "decompressor": zlib.decompressobj(-zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else None,
+        }
+        self.state = STATE_DATA
+        return True
+
+    def write_entry_data(self, data):
+        if data:
+            self.entry["computed_crc"] = zlib.crc32(data, self.entry["computed_crc"])
+            if self.entry["output_file"]:
+                self.entry["output_file"].write(data)
+
+    def read_entry_data(self):
+        if not self.buffer:
+            return False
+        decompressor = self.entry["decompressor"]
+        if decompressor:
+            data = bytes(self.buffer)
+            self.buffer = bytearray()
+            self.write_entry_data(decompressor.decompress(data))
+            if not decompressor.eof:
+                return False
+            self.buffer = bytearray(decompressor.unused_data)
+        else:
+            take_length = min(self.entry["remaining"], len(self.buffer))
+            self.write_entry_data(bytes(self.buffer[:take_length]))
+            del self.buffer[:take_length]
+            self.entry["remaining"] -= take_length
+            if self.entry["remaining"] > 0:
+                return False
+        if self.entry["flags"] & FLAG_DATA_DESCRIPTOR:
+            self.state = STATE_DESCRIPTOR
+        else:
+            self.finish_entry(self.entry["crc"])
+        return True
+
+    def read_data_descriptor(self):
+        size_length = 8 if self.entry["is_zip64"] else 4
+        # The descriptor is always followed by at least the 4 byte signature of the next record
+        if len(self.buffer) < 4 + 4 + 2 * size_length + 4:
+            return False
+        position = 4 if bytes(self.buffer[:4]) == DATA_DESCRIPTOR_SIGNATURE else 0
+        crc, = struct.unpack_from("<I", self.buffer, position)
+        del self.buffer[:position + 4 + 2 * size_length]
+        self.finish_entry(crc)
+        return True
+
+    def finish_entry(self, expected_crc):
+        if self.entry["output_file"]:
+            self.entry["output_file"].close()
+        if self.entry["computed_crc"] != expected_crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for streamed file {self.entry['name']}")
+        self.extracted_count += 1
+        self.entry = None
+        self.state = STATE_HEADER
+
+    def start_spooling(self, name):
+        """
+        Writes the rest of the archive, starting with the local header of the current entry, to a spool file.
+        """
+        self.spool_path = f"{os.path.normpath(self.destination)}.spool.zip"
+        logging.info(f"Entry {name} cannot be streamed, spooling the rest of the archive to {self.spool_path}")
+        self.spool_file = open(self.spool_path, "wb")
+        self.spool_file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        """
+        Completes the extraction. Extracts the spooled part of the archive if the extractor had to spool.
+
+        :return: int - number of extracted entries.
+        """
+        if self.entry and self.entry["output_file"]:
+            self.entry["output_file"].close()
+        if self.spool_file:
+            self.spool_file.close()
+            try:
+                # zipfile rebases the member offsets on the spool file; members before the spool start are negative
+                with zipfile.ZipFile(self.spool_path, "r") as zip_ref:
+                    for member in zip_ref.infolist():
+                        if member.header_offset >= 0:
+                            zip_ref.extract(member, self.destination)
+                            self.extracted_count += 1
+            finally:
+                os.remove(self.spool_path)
+        elif self.state != STATE_DONE:
+            raise zipfile.BadZipFile(f"Archive stream ended after {self.offset} bytes without central directory")
+        return self.extracted_count
+
+
+def parse_zip64_extra(extra, compressed_size, uncompressed_size):
+    """
+    Reads the zip64 sizes of a local file header.
+
+    :return: tuple - (bool, int, int) - True if the entry has a zip64 extra field, compressed size, uncompressed size.
+    """
+    position = 0
+    while position + 4 <= len(extra):
+        extra_id, extra_length = struct.unpack_from("<HH", extra, position)
+        if extra_id == ZIP64_EXTRA_ID:
+            field_position = position + 4
+            if uncompressed_size == 0xFFFFFFFF and field_position + 8 <= len(extra):
+                uncompressed_size, = struct.unpack_from("<Q", extra, field_position)
+                field_position += 8
+            if compressed_size == 0xFFFFFFFF and field_position + 8 <= len(extra):
+                compressed_size, = struct.unpack_from("<Q", extra, field_position)
+            return True, compressed_size, uncompressed_size
+        position += 4 + extra_length
+    return False, compressed_size, uncompressed_size
@@ -0,0 +1,66 @@
+"""
+Cached Jinja rendering for the AOSP build files. One environment per template folder is kept for the whole process,
+so every template is loaded and compiled once; the compiled bytecode is additionally cached on disk for the worker
+processes of the post-build injector. Rendered files are only written if their content changed, which keeps the
+mtimes of unchanged base_*.mk files and with that avoids the Kati/Soong regeneration of the next build.
+"""
+import logging
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from config import TEMPLATE_BYTECODE_CACHE_DIR
+
+_environment_memo = {}
+
+
+def get_template_environment(template_folder_abs_path):
+    """
+    :param template_folder_abs_path: str - path to the template folder.
+    :return: jinja2.Environment - the cached environment of the template folder.
+    """
+    template_folder_abs_path = os.path.normpath(str(template_folder_abs_path))
+    environment = _environment_memo.get(template_folder_abs_path)
+    if environment is None:
+        os.makedirs(TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+        # Templates do not change during a run, so the loader does not need to stat them on every use
+        environment = Environment(loader=FileSystemLoader(template_folder_abs_path),
+                                  bytecode_cache=FileSystemBytecodeCache(TEMPLATE_BYTECODE_CACHE_DIR),
+                                  auto_reload=False,
+                                  cache_size=-1)
+        _environment_memo[template_folder_abs_path] = environment
+    return environment
+
+
+def render_template_file(template_folder_abs_path, template_name, **context):
+    """
+    Renders a template of the template folder.
+
+    :param template_folder_abs_path: str - path to the template folder.
+    :param template_name: str - file name of the template.
+    :param context: variables passed to the template.
+    :return: str - rendered template.
+    """
+    return get_template_environment(template_folder_abs_path).get_template(template_name).render(**context)
+
+
+def write_file_if_changed(file_path, content):
+    """
+    Writes content to file_path unless the file already holds exactly this content.
+
+    :param file_path: str - path of the file to write.
+    :param content: str - content to write, utf-8 encoded.
+    :return: bool - True if the file was written.
+    """
+    data = content.encode("utf-8")
+    try:
+        if os.path.getsize(file_path) == len(data):
+            with open(file_path, "rb") as existing_file:
+                if existing_file.read() == data:
+                    logging.debug(f"Unchanged, not rewriting {file_path}")
+                    return False
+    except OSError:
+        pass
+    with open(file_path, "wb") as out_file:
+        out_file.write(data)
+    return True